@@ -325,6 +325,170 @@ class champ_ccc :
             champ_lu.append(record)
         
 
+class fichier_ccc_indexe:
+    """
+    fichier_ccc_indexe
+    lecteur de fichiers ccc qui projette le fichier en memoire (memmap) et construit
+    un index des records (ibuf1..ibuf8, position et longueur des donnees) en une seule passe
+    sur les etiquettes. Les champs sont decodes avec numpy sans copier le fichier,
+    on peut lire n'importe quel record et une sous-region sans decoder tout le record.
+
+    ex
+    x = fichier_ccc_indexe('aet_p1rof_196101.ccc')
+    x.invntry()
+    champ = x.lit_champ(0)
+    region = x.lit_champ(0, i1=10, i2=20, j1=5, j2=15)
+    """
+
+    # type de l'index des records
+    _dtype_index = N.dtype([('ibuf1', 'S4'), ('ibuf2', 'i8'), ('ibuf3', 'S4'), ('ibuf4', 'i8'),
+                            ('ibuf5', 'i8'), ('ibuf6', 'i8'), ('ibuf7', 'i8'), ('ibuf8', 'i8'),
+                            ('position', 'i8'), ('long_rec', 'i8')])
+
+    # format des etiquettes (voir champ_ccc._lit_ibuf)
+    _dtype_ibuf = N.dtype([('ibuf1', 'S4'), ('pad1', 'S4'), ('ibuf2', '>i8'), ('ibuf3', 'S4'), ('pad3', 'S4'),
+                           ('ibuf4', '>i8'), ('ibuf5', '>i8'), ('ibuf6', '>i8'), ('ibuf7', '>i8'), ('ibuf8', '>i8')])
+
+    # type des valeurs selon le packing
+    _dtype_packing = {1: N.dtype('>f8'), 2: N.dtype('>u4'), 4: N.dtype('>u2')}
+
+    def __init__(self, fichier):
+        self.fichier = fichier
+        self._mm = N.memmap(fichier, dtype=N.uint8, mode='r')
+        self.index = self._construit_index()
+
+    def _construit_index(self):
+        """
+        une seule passe sur les etiquettes, les donnees ne sont pas lues
+        """
+        taille = len(self._mm)
+        records = []
+        position = 0
+        while position + 8 <= taille:
+            long_ibuf = int(N.frombuffer(self._mm, dtype='>i4', count=1, offset=position)[0])
+            ibuf = N.frombuffer(self._mm, dtype=self._dtype_ibuf, count=1, offset=position + 4)[0]
+            position += long_ibuf + 8
+
+            # etiquette du debut du record de donnees
+            long_rec = int(N.frombuffer(self._mm, dtype='>i4', count=1, offset=position)[0])
+            records.append((ibuf['ibuf1'], ibuf['ibuf2'], ibuf['ibuf3'], ibuf['ibuf4'], ibuf['ibuf5'],
+                            ibuf['ibuf6'], ibuf['ibuf7'], ibuf['ibuf8'], position + 4, long_rec))
+            position += long_rec + 8
+
+        return N.array(records, dtype=self._dtype_index)
+
+    def __len__(self):
+        return len(self.index)
+
+    def ibuf(self, n):
+        """
+        retourne le ibuf du record n sous forme de dictionnaire (comme champ_ccc._lit_ibuf)
+        """
+        rec = self.index[n]
+        return {'ibuf%i' % k: (rec['ibuf%i' % k].decode() if k in (1, 3) else int(rec['ibuf%i' % k]))
+                for k in range(1, 9)}
+
+    def trouve_records(self, **criteres):
+        """
+        retourne les numeros des records qui correspondent aux criteres
+        ex : x.trouve_records(ibuf3='ST', ibuf4=1)
+        """
+        choix = N.ones(len(self.index), dtype=bool)
+        for clef, valeur in criteres.items():
+            if clef in ('ibuf1', 'ibuf3'):
+                valeur = valeur.encode()
+            choix &= self.index[clef] == valeur
+        return N.where(choix)[0]
+
+    def _vecteur_brut(self, n):
+        """
+        retourne xmin, xscali et une vue (sans copie) des valeurs du record n de forme (nj, ni)
+        """
+        rec = self.index[n]
+        npack = int(rec['ibuf8'])
+        ni, nj = int(rec['ibuf5']), int(rec['ibuf6'])
+        position = int(rec['position'])
+
+        xmin, xscali = 0.0, 1.0
+        if npack != 1:
+            # xmin et xmax sont ecrits en 64 bits
+            xmin, xmax = N.frombuffer(self._mm, dtype='>f8', count=2, offset=position)
+            position += 16
+
+            # calcul de xscali (voir paccrn)
+            if npack == 2:
+                biggest = 2 ** 31 - 1
+            else:
+                biggest = 2 ** (64 // npack) - 1
+            xscali = (xmax - xmin) / biggest
+
+        # les blancs a la fin du record sont ignores
+        vec = N.frombuffer(self._mm, dtype=self._dtype_packing[npack], count=ni * nj, offset=position)
+        return xmin, xscali, vec.reshape((nj, ni))
+
+    def lit_champ(self, n, i1=None, i2=None, j1=None, j2=None):
+        """
+        decode le record n, le champ de sortie est de forme (ni, nj)
+        si i1, i2, j1, j2 sont fournis, seule la region [i1:i2, j1:j2] (indices de 0) est decodee
+        """
+        xmin, xscali, vec = self._vecteur_brut(n)
+        vec = vec[j1:j2, i1:i2]
+
+        champ = vec.T.astype(N.float64)
+        if int(self.index[n]['ibuf8']) != 1:
+            champ *= xscali
+            champ += xmin
+        return champ
+
+    def invntry(self):
+        """
+        methode qui affiche les etiquettes des champs dans le fichier
+        """
+        print("""
+        invntry de %s
+        #record   ibuf
+        """ % self.fichier)
+        for compteur, rec in enumerate(self.index):
+            print("%5i %4s %10i %4s %5i %5i %5i %5i %5i" % (compteur + 1, rec['ibuf1'].decode(), rec['ibuf2'],
+                                                          rec['ibuf3'].decode(), rec['ibuf4'], rec['ibuf5'],
+                                                          rec['ibuf6'], rec['ibuf7'], rec['ibuf8']))
+
+    def ggstat(self):
+        """
+        methode qui fait un ggstat des records du fichier
+        """
+        print("""
+        ggstat de %s
+        #record   ibuf
+        """ % self.fichier)
+        for compteur, rec in enumerate(self.index):
+            champ = self.lit_champ(compteur)
+            print("%5i %4s %10i %4s %5i %5i %5i %5i %5i %14.6e %14.6e %14.6e %14.6e" % (
+                compteur + 1, rec['ibuf1'].decode(), rec['ibuf2'], rec['ibuf3'].decode(), rec['ibuf4'],
+                rec['ibuf5'], rec['ibuf6'], rec['ibuf7'], rec['ibuf8'],
+                champ.min(), champ.max(), champ.mean(), champ.var()))
+
+    def charge_champs(self, i1=None, i2=None, j1=None, j2=None):
+        """
+        meme sortie que champ_ccc.charge_champs : une liste de {'ibuf': ibuf, 'field': champ}
+        (les indices de la region commencent a 1 comme dans champ_ccc.charge_champs)
+        """
+        champ_lu = []
+        for n in range(len(self.index)):
+            ibuf = self.ibuf(n)
+            if i1 is not None and i2 is not None and j1 is not None and j2 is not None:
+                champ = self.lit_champ(n, i1=i1 - 1, i2=i2 - 1, j1=j1 - 1, j2=j2 - 1)
+                ibuf['ibuf5'] = i2 - i1
+                ibuf['ibuf6'] = j2 - j1
+            else:
+                champ = self.lit_champ(n)
+            champ_lu.append({'ibuf': ibuf, 'field': champ})
+        return champ_lu
+
+    def ferme(self):
+        del self._mm
+
+
 ##################################################
 # partie test
 ##################################################
@@ -0,0 +1,283 @@
+import json
+import os
+from datetime import datetime
+from multiprocessing.pool import Pool
+from pathlib import Path
+
+import netCDF4 as nc
+import numpy as np
+from rpn import level_kinds
+from rpn.rpn import RPN
+
+__author__ = 'huziy'
+
+
+# Conversion of rpn files to netcdf driven by a manifest:
+#   - each task converts a list of rpn files (i.e. a month folder) to one netcdf file,
+#   - the records are streamed file by file into chunked and compressed netcdf4 variables,
+#   - the output is written to a temporary file, which is renamed when complete,
+#   - the completion of each task is recorded in a marker file, so that the conversion can be restarted.
+
+DONE_MARKER_SUFFIX = ".done"
+TMP_SUFFIX = ".tmp"
+
+DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+class VariableSpec(object):
+    def __init__(self, name="", level=-1, level_kind=level_kinds.ARBITRARY, nc_name=None, units="", mult=1.0):
+        """
+        :param name: name of the variable in the rpn files
+        :param level: level of the variable, if None, all the levels are converted (a level dimension is added)
+        :param nc_name: name of the variable in the netcdf file (the rpn name is used if None)
+        :param mult: the multiplier applied to the data (i.e. for the unit conversion)
+        """
+        self.name = name
+        self.level = level
+        self.level_kind = level_kind
+        self.nc_name = name if nc_name is None else nc_name
+        self.units = units
+        self.mult = mult
+
+    def to_dict(self):
+        return dict(self.__dict__)
+
+
+class ConversionTask(object):
+    def __init__(self, in_paths, out_path):
+        """
+        :param in_paths: list of the rpn files, the data are written in the order of the dates
+        :param out_path: path to the netcdf file
+        """
+        self.in_paths = [str(p) for p in in_paths]
+        self.out_path = str(out_path)
+
+    @property
+    def done_marker_path(self):
+        return self.out_path + DONE_MARKER_SUFFIX
+
+    @property
+    def tmp_path(self):
+        return self.out_path + TMP_SUFFIX
+
+    def is_done(self, signature):
+        """
+        The task is done if the output file exists and the marker file contains the same signature
+        """
+        if not (os.path.isfile(self.out_path) and os.path.isfile(self.done_marker_path)):
+            return False
+
+        with open(self.done_marker_path) as f:
+            return json.load(f) == signature
+
+    def to_dict(self):
+        return dict(in_paths=self.in_paths, out_path=self.out_path)
+
+
+class ConversionManifest(object):
+    def __init__(self, variables, tasks, start_date=None, end_date=None, chunk_time_steps=24, complevel=4):
+        """
+        :param variables: list of VariableSpec
+        :param tasks: list of ConversionTask
+        :param start_date: the records outside of [start_date, end_date] are not converted
+        :param chunk_time_steps: chunk size along the time dimension in the netcdf files
+        """
+        self.variables = variables
+        self.tasks = tasks
+        self.start_date = start_date
+        self.end_date = end_date
+        self.chunk_time_steps = chunk_time_steps
+        self.complevel = complevel
+
+    def get_signature(self, task):
+        """
+        Everything that determines the contents of the output file of the task
+        """
+        return dict(
+            task=task.to_dict(),
+            variables=[v.to_dict() for v in self.variables],
+            start_date=None if self.start_date is None else self.start_date.strftime(DATE_FORMAT),
+            end_date=None if self.end_date is None else self.end_date.strftime(DATE_FORMAT),
+            chunk_time_steps=self.chunk_time_steps,
+            complevel=self.complevel
+        )
+
+    def get_pending_tasks(self):
+        return [t for t in self.tasks if not t.is_done(self.get_signature(t))]
+
+    def save(self, path):
+        d = self.get_signature(ConversionTask([], ""))
+        d.pop("task")
+        d["tasks"] = [t.to_dict() for t in self.tasks]
+        with open(path, "w") as f:
+            json.dump(d, f, indent=2)
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as f:
+            d = json.load(f)
+
+        def _to_date(s):
+            return None if s is None else datetime.strptime(s, DATE_FORMAT)
+
+        return cls([VariableSpec(**v) for v in d["variables"]],
+                   [ConversionTask(**t) for t in d["tasks"]],
+                   start_date=_to_date(d["start_date"]), end_date=_to_date(d["end_date"]),
+                   chunk_time_steps=d["chunk_time_steps"], complevel=d["complevel"])
+
+    @classmethod
+    def from_month_folders(cls, samples_dir, out_dir, variables, file_filter=None, **kwargs):
+        """
+        One task (output file <month folder name>.nc) for each month folder in samples_dir
+        :param file_filter: function of the file name, if None, hidden files and files ending with ~ are skipped
+        """
+        if file_filter is None:
+            def file_filter(fname):
+                return not (fname.startswith(".") or fname.endswith("~"))
+
+        tasks = []
+        for month_dir in sorted(Path(samples_dir).iterdir()):
+            if not month_dir.is_dir():
+                continue
+
+            in_paths = sorted(str(f) for f in month_dir.iterdir() if f.is_file() and file_filter(f.name))
+            tasks.append(ConversionTask(in_paths, Path(out_dir).joinpath(month_dir.name + ".nc")))
+
+        return cls(variables, tasks, **kwargs)
+
+
+def _read_variable_from_file(r, spec):
+    """
+    :return: dict {date: field}, the fields are 3d (level, x, y) if spec.level is None
+    """
+    if spec.level is None:
+        data = r.get_4d_field(name=spec.name)
+        return {d: np.array([lev_to_field[lev] for lev in sorted(lev_to_field)]) for d, lev_to_field in data.items()}
+
+    return r.get_all_time_records_for_name_and_level(varname=spec.name, level=spec.level,
+                                                      level_kind=spec.level_kind)
+
+
+def _create_output(ds, manifest, r, spec_to_sample):
+    lons2d, lats2d = r.get_longitudes_and_latitudes_for_the_last_read_rec()
+    nx, ny = lons2d.shape
+
+    ds.createDimension("lon", nx)
+    ds.createDimension("lat", ny)
+    ds.createDimension("time", None)
+
+    lon_var = ds.createVariable("longitude", "f4", dimensions=("lon", "lat"))
+    lat_var = ds.createVariable("latitude", "f4", dimensions=("lon", "lat"))
+    lon_var[:] = lons2d
+    lat_var[:] = lats2d
+
+    time_var = ds.createVariable("time", "f8", dimensions=("time",))
+
+    for spec in manifest.variables:
+        sample = spec_to_sample[spec.nc_name]
+
+        dims = ("time", "lon", "lat")
+        chunks = (manifest.chunk_time_steps, nx, ny)
+        if sample.ndim == 3:
+            level_dim = "level_{}".format(spec.nc_name)
+            ds.createDimension(level_dim, sample.shape[0])
+            dims = ("time", level_dim, "lon", "lat")
+            chunks = (manifest.chunk_time_steps, 1, nx, ny)
+
+        var = ds.createVariable(spec.nc_name, "f4", dimensions=dims, zlib=True, complevel=manifest.complevel,
+                                chunksizes=chunks)
+        var.units = spec.units
+
+    return time_var
+
+
+def run_task(manifest, task):
+    """
+    Convert the rpn files of the task to a netcdf file, the records are streamed file by file
+    :return: the number of the time steps written
+    """
+    if os.path.isfile(task.done_marker_path):
+        os.remove(task.done_marker_path)
+
+    # the partial output from an interrupted run
+    if os.path.isfile(task.tmp_path):
+        os.remove(task.tmp_path)
+
+    last_date = None
+    nt = 0
+    time_var = None
+    with nc.Dataset(task.tmp_path, "w", format="NETCDF4") as ds:
+        for in_path in task.in_paths:
+            r = RPN(in_path)
+            try:
+                vars_in_file = r.get_list_of_varnames()
+                if manifest.variables[0].name not in vars_in_file:
+                    continue
+
+                spec_to_data = {spec.nc_name: _read_variable_from_file(r, spec) for spec in manifest.variables
+                                if spec.name in vars_in_file}
+
+                # The time axis is defined by the first variable
+                dates = sorted(spec_to_data[manifest.variables[0].nc_name])
+                dates = [d for d in dates if
+                         (manifest.start_date is None or d >= manifest.start_date) and
+                         (manifest.end_date is None or d <= manifest.end_date) and
+                         (last_date is None or d > last_date)]
+
+                if not len(dates):
+                    continue
+
+                if time_var is None:
+                    spec_to_sample = {name: data[dates[0]] for name, data in spec_to_data.items()}
+                    time_var = _create_output(ds, manifest, r, spec_to_sample)
+                    time_var.units = "hours since {:%Y-%m-%d %H:%M:%S}".format(dates[0])
+            finally:
+                r.close()
+
+            t1 = nt + len(dates)
+            time_var[nt:t1] = nc.date2num(dates, time_var.units)
+            for spec in manifest.variables:
+                var = ds.variables[spec.nc_name]
+                data = spec_to_data.get(spec.nc_name, {})
+                fields = [data[d] * spec.mult if d in data else np.ma.masked_all(var.shape[1:]) for d in dates]
+                var[nt:t1] = np.ma.asarray(fields)
+
+            nt = t1
+            last_date = dates[-1]
+
+    os.rename(task.tmp_path, task.out_path)
+
+    with open(task.done_marker_path, "w") as f:
+        json.dump(manifest.get_signature(task), f)
+
+    return nt
+
+
+def _run_task_in_process(args):
+    manifest, task = args
+    try:
+        return task.out_path, run_task(manifest, task)
+    except Exception as e:
+        print("Exception occurred while converting to {}".format(task.out_path))
+        print(e)
+        return task.out_path, None
+
+
+def convert(manifest, processes=None):
+    """
+    Run the tasks of the manifest that are not done yet in a pool of processes
+    :param processes: number of the processes, if None - the number of cpus
+    :return: dict {out_path: number of the time steps written or None if the task failed}
+    """
+    pending = manifest.get_pending_tasks()
+    print("{} of {} tasks to do".format(len(pending), len(manifest.tasks)))
+
+    if processes == 1:
+        return dict(_run_task_in_process((manifest, t)) for t in pending)
+
+    pool = Pool(processes=processes)
+    try:
+        return dict(pool.imap_unordered(_run_task_in_process, [(manifest, t) for t in pending]))
+    finally:
+        pool.close()
+        pool.join()
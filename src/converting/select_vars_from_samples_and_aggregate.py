@@ -1,15 +1,16 @@
+import os
 from collections import defaultdict
+from datetime import datetime, timedelta
 from multiprocessing.pool import Pool
 from pathlib import Path
 
-import xarray
 from rpn import level_kinds
 from rpn.rpn import RPN
 
 # Mostly for 2D arrays in time
 import numpy as np
 
-from netCDF4 import date2num
+from netCDF4 import Dataset, date2num
 
 integrated_wv_RPN_name = "IWVM"
 
@@ -37,7 +38,14 @@ def get_default_mult():
     return 1
 
 rpn_name_to_mult = defaultdict(get_default_mult)
-rpn_name_to_mult["PR"] = 1.0e3,  # To convert M/s to kg /(m**2 * s)
+rpn_name_to_mult["PR"] = 1.0e3  # To convert M/s to kg /(m**2 * s)
+
+
+def get_default_aggregation():
+    return "mean"
+
+# how the records are aggregated to the target frequency: mean, sum, min or max
+rpn_name_to_aggregation = defaultdict(get_default_aggregation)
 
 rpn_name_to_ncunits = {
     "PR": "kg m-2 s-1",
@@ -57,129 +65,252 @@ def extract_data_for_year_in_parallel(kwargs):
 
 
 
-def extract_data_for_year(year: int = 1980, varnames = None, samples_dir: Path = None, out_dir: Path = None,
-                          level: int = -1, level_kind: int = level_kinds.ARBITRARY, target_freq_hours=6, calendar_str=None):
-
-    month_folders = [mf for mf in samples_dir.iterdir() if mf.name[:-2].endswith(str(year))]
+class StreamingResampler(object):
+    def __init__(self, target_freq_hours=6, how="mean"):
+        """
+        Aggregates the time ordered records to the target frequency, the bins are closed on the left
+        and labeled by their start date. Only the current bin is kept in memory.
+        :param how: mean, sum, min or max
+        """
+        self.freq = timedelta(hours=target_freq_hours)
+        self.how = how
+
+        self.bin_start = None
+        self.acc = None
+        self.count = 0
+
+    def _get_bin_start(self, the_date):
+        day_start = datetime(the_date.year, the_date.month, the_date.day)
+        return day_start + ((the_date - day_start) // self.freq) * self.freq
+
+    def add(self, the_date, field):
+        """
+        :return: list of the completed (bin_start, aggregated field) pairs
+        """
+        completed = []
+        bin_start = self._get_bin_start(the_date)
+
+        if self.bin_start is not None and bin_start < self.bin_start:
+            print("Skipping {}: the records should be in time order, the bin {} is already written".format(
+                the_date, bin_start))
+            return completed
+
+        if self.bin_start is not None and bin_start > self.bin_start:
+            completed.extend(self.flush())
+
+        field = np.asarray(field, dtype=np.float64)
+        if self.acc is None:
+            self.bin_start = bin_start
+            self.acc = field.copy()
+        elif self.how in ["mean", "sum"]:
+            self.acc += field
+        elif self.how == "min":
+            np.minimum(self.acc, field, out=self.acc)
+        elif self.how == "max":
+            np.maximum(self.acc, field, out=self.acc)
+        else:
+            raise ValueError("Unknown aggregation: {}".format(self.how))
+
+        self.count += 1
+        return completed
+
+    def flush(self):
+        """
+        :return: list containing the current bin if any
+        """
+        if self.acc is None:
+            return []
+
+        result = self.acc / self.count if self.how == "mean" else self.acc
+        completed = [(self.bin_start, result)]
+
+        self.acc = None
+        self.count = 0
+        return completed
+
+
+def _get_data_files(year, samples_dir: Path):
+    """
+    The files in the chronological order. Only the last files of the previous December are taken,
+    since only they may contain the records of the year.
+    """
+    month_folders = sorted(mf for mf in samples_dir.iterdir() if mf.name[:-2].endswith(str(year)))
+
+    def _is_data_file(f):
+        # skip hidden files and backups
+        return not (f.name.startswith(".") or f.name.endswith("~"))
+
+    data_files = []
+    for mf in samples_dir.iterdir():
+        if mf.name.endswith("{}12".format(year - 1)):
+            prefix_to_last_file = {}
+            for f in sorted(filter(_is_data_file, mf.iterdir())):
+                prefix_to_last_file[f.name[:2]] = f
+            data_files.extend(sorted(prefix_to_last_file.values()))
+
+    for mf in month_folders:
+        data_files.extend(sorted(filter(_is_data_file, mf.iterdir())))
+
+    return data_files
+
+
+def _iter_time_records(r, varname, level=-1, level_kind=level_kinds.ARBITRARY):
+    """
+    The records of the variable at the level one by one in the order of the file, so that only one record
+    is in memory at a time (the records are expected to be in time order)
+    :return: generator of (date, field)
+    """
+    data = r.get_first_record_for_name_and_level(varname, level=level, level_kind=level_kind)
+    while data is not None:
+        yield r.get_datetime_for_the_last_read_record(), data
+        data = r.get_next_record()
+
+
+def _create_output_file(out_file, vname, r, samples_dir, year, calendar_str):
+    projparams = r.get_proj_parameters_for_the_last_read_rec()
+    rlons, rlats = r.get_tictacs_for_the_last_read_record()
+    lons, lats = r.get_longitudes_and_latitudes_for_the_last_read_rec()
+
+    ds = Dataset(out_file, "w")
+    ds.createDimension("time", None)
+    ds.createDimension("rlat", len(rlats))
+    ds.createDimension("rlon", len(rlons))
+    ds.createDimension("dummy", 1)
+
+    ds.setncatts({
+        "converted_from": str(samples_dir),
+        "prepared_by": "Oleksandr Huziy (guziy.sasha@gmail.com)",
+        "organization": "ESCER/UQAM",
+        "simulations_performed_by": "Katja Winger",
+        "project": "CORDEX"
+    })
+
+    rlon_var = ds.createVariable("rlon", "f4", ("rlon",))
+    rlon_var.long_name = "rotated longitudes"
+    rlon_var[:] = rlons
+
+    rlat_var = ds.createVariable("rlat", "f4", ("rlat",))
+    rlat_var.long_name = "rotated latitudes"
+    rlat_var[:] = rlats
+
+    for name, data, long_name in [("lon", lons, "geographic longitude"), ("lat", lats, "geographic latitude")]:
+        v = ds.createVariable(name, "f4", ("rlat", "rlon"))
+        v.long_name = long_name
+        v.ranges = "{} .. {}".format(data.min(), data.max())
+        v[:] = data.T
+
+    rot_var = ds.createVariable("rotated_latlon", "i4", ("dummy",))
+    rot_var.setncatts(projparams)
+    rot_var[:] = 0
+
+    time_var = ds.createVariable("time", "i4", ("time",))
+    time_var.units = "hours since {}-01-01 00:00:00".format(year)
+    time_var.calendar = calendar_str
+
+    data_var = ds.createVariable(rpn_name_to_nc_name[vname], "f4", ("time", "rlat", "rlon"),
+                                 zlib=True, chunksizes=(1, len(rlats), len(rlons)))
+    data_var.units = rpn_name_to_ncunits[vname]
+    data_var.long_name = rpn_name_to_long_name[vname]
+    return ds
 
-    # get the data from a month before in case there are some values from this year there
-    month_folders += [mf for mf in samples_dir.iterdir() if mf.name.endswith("{}12".format(year - 1))]
 
-    data_for_var = {}
+def extract_data_for_year(year: int = 1980, varnames = None, samples_dir: Path = None, out_dir: Path = None,
+                          level: int = -1, level_kind: int = level_kinds.ARBITRARY, target_freq_hours=6, calendar_str=None):
+    """
+    Read the records of the year one by one, aggregate them to the target frequency
+    and write each aggregated time step as soon as it is complete.
+    The outputs are saved only if all the files were read.
+    """
+    if calendar_str is None:
+        calendar_str = "proleptic_gregorian"
 
+    print("calendar_str = {}".format(calendar_str))
 
     vname_to_outfile = {}
 
     for vname in varnames:
-        vname_to_outfile[vname] = str(out_dir.joinpath("{}_{}.nc".format(rpn_name_to_nc_name[vname], year)))
-
-
-
-    lons = None
-    lats = None
-    rlons = None
-    rlats = None
-
-    projparams = None
-
-    for vname in varnames:
+        out_file = str(out_dir.joinpath("{}_{}.nc".format(rpn_name_to_nc_name[vname], year)))
 
         # If the output file already exists, skip it
-        if Path(vname_to_outfile[vname]).is_file():
-            print("{} already exists, skipping ...".format(vname_to_outfile[vname]))
+        if Path(out_file).is_file():
+            print("{} already exists, skipping ...".format(out_file))
             continue
 
+        vname_to_outfile[vname] = out_file
 
-        data_for_var[vname] = {}
+    if not vname_to_outfile:
+        return 0
 
-        for mf in month_folders:
-            for data_file in mf.iterdir():
-                # skip hidden files
-                if data_file.name.startswith("."):
-                    continue
+    vname_to_resampler = {vname: StreamingResampler(target_freq_hours=target_freq_hours,
+                                                    how=rpn_name_to_aggregation[vname])
+                          for vname in vname_to_outfile}
 
-                if data_file.name.endswith("~"):
-                    continue
+    # the output is written to temporary files, which are renamed when complete
+    vname_to_ds = {}
 
-                try:
-                    r = RPN(str(data_file))
+    def _write_steps(vname, steps):
+        ds = vname_to_ds[vname]
+        time_var = ds.variables["time"]
+        data_var = ds.variables[rpn_name_to_nc_name[vname]]
+        for the_date, field in steps:
+            t = len(time_var)
+            time_var[t] = date2num(the_date, time_var.units, calendar=calendar_str)
 
-                    vars_in_file = r.get_list_of_varnames()
+            # change the order of dimensions and convert the units if required
+            data_var[t, :, :] = field.T * rpn_name_to_mult[vname]
 
-                    if vname in vars_in_file:
-                        data = r.get_all_time_records_for_name_and_level(varname=vname, level=level, level_kind=level_kind)
-                        data_for_var[vname].update(data)
-
-
-                        if lons is None:
-                            projparams = r.get_proj_parameters_for_the_last_read_rec()
-                            rlons, rlats = r.get_tictacs_for_the_last_read_record()
-                            lons, lats = r.get_longitudes_and_latitudes_for_the_last_read_rec()
-
-                except Exception:
-                    pass
-
-                finally:
+    failed_files = []
+    try:
+        for data_file in _get_data_files(year, samples_dir):
+            r = None
+            try:
+                r = RPN(str(data_file))
+                vars_in_file = r.get_list_of_varnames()
+
+                for vname, resampler in vname_to_resampler.items():
+                    if vname not in vars_in_file:
+                        continue
+
+                    for the_date, field in _iter_time_records(r, vname, level=level, level_kind=level_kind):
+                        if vname not in vname_to_ds:
+                            tmp_file = vname_to_outfile[vname] + ".tmp"
+                            vname_to_ds[vname] = _create_output_file(tmp_file, vname, r, samples_dir, year,
+                                                                     calendar_str)
+
+                        if the_date.year != year:
+                            continue
+                        _write_steps(vname, resampler.add(the_date, field))
+
+            except Exception as e:
+                print("Could not read {}: {}".format(data_file, e))
+                failed_files.append(data_file)
+
+            finally:
+                if r is not None:
                     r.close()
 
+        for vname, resampler in vname_to_resampler.items():
+            if vname in vname_to_ds:
+                _write_steps(vname, resampler.flush())
 
-    # ---- Save retrieved data to netcdf
-    if calendar_str is None:
-        calendar_str = "proleptic_gregorian"
-
-    for vname in data_for_var:
-        print("Inside the loop over data_for_var")
-
-        times = list(sorted(d for d in data_for_var[vname] if d.year == year))
-
-        data = np.array([data_for_var[vname][d] for d in times])
-
-        # change the order of dimensions and convert the units if required
-        data = np.transpose(data, (0, 2, 1)) * rpn_name_to_mult[vname]
-        
-        print("calendar_str = {}".format(calendar_str))
-
-        ds = xarray.Dataset({
-                vname: (("time", "rlat", "rlon"), data, {"units": rpn_name_to_ncunits[vname], "long_name": rpn_name_to_long_name[vname]}),
-            },
-            coords = {
-                "rlon": (["rlon"], rlons, {"long_name": "rotated longitudes"}),
-                "rlat": (["rlat"], rlats, {"long_name": "rotated latitudes"}),
-                "time": (["time"], times),
-                "lon": (["rlat", "rlon"], lons.T, {"long_name": "geographic longitude", "ranges": "{} .. {}".format(lons.min(), lons.max())}),
-                "lat": (["rlat", "rlon"], lats.T, {"long_name": "geographic latitude", "ranges": "{} .. {}".format(lats.min(), lats.max())}),
-                "rotated_latlon": (("dummy", ), [int(0),], projparams)
-            },
-            attrs={
-                "converted_from": str(samples_dir),
-                "prepared_by": "Oleksandr Huziy (guziy.sasha@gmail.com)",
-                "organization": "ESCER/UQAM",
-                "simulations_performed_by": "Katja Winger",
-                "project": "CORDEX"
-            }
-        )
-
-        # "Calculate target_freq_hours-hourly means"
-        ds = ds.resample("{}H".format(target_freq_hours), "time", keep_attrs=True, closed="left")
-
-
-        # construct the name of the output file
-        out_file = vname_to_outfile[vname]
-        print("saving data to {}".format(out_file))
-
+    finally:
+        for ds in vname_to_ds.values():
+            ds.close()
 
-        # Rename the names of the variables if required
-        ds.rename({vname: rpn_name_to_nc_name[vname]}, inplace=True)
-        
-        # Remove the all-nan fields, if any have creeped in during resampling
-        ds = ds.dropna(dim="time", how="all")
+    # the incomplete outputs are left as .tmp files, so that the year is redone on the next run
+    if failed_files:
+        print("Could not read {} files for {}, the outputs are not saved".format(len(failed_files), year))
+        return 1
 
-        ds.to_netcdf(path=out_file, encoding={"time": {"dtype": "int32", "calendar": calendar_str}, "rotated_latlon": {"dtype": "int32"}})
+    for vname, out_file in vname_to_outfile.items():
+        if vname in vname_to_ds:
+            print("saving data to {}".format(out_file))
+            os.rename(out_file + ".tmp", out_file)
 
     return 0
 
 
-def main_era_interim():
+def main_era_interim(processes=3):
     samples_dir_p = Path("/RECH/data/Simulations/CRCM5/North_America/NorthAmerica_0.44deg_ERA40-Int0.75_QC_B1/Samples")
 
     out_dir_root = Path("/RECH2/huziy/BenAlaya/")
@@ -205,14 +336,14 @@ def main_era_interim():
         inputs.append(dict(year=y, varnames=varnames, samples_dir=samples_dir_p, out_dir=out_dir_p, target_freq_hours=6, calendar_str=None))
 
     # Extract the data for each year in parallel
-    pool = Pool(processes=3)
+    pool = Pool(processes=processes)
     pool.map(extract_data_for_year_in_parallel, inputs)
 
     # extract_data_for_year(1980, varnames=varnames, samples_dir=samples_dir_p, out_dir=out_dir_p, target_freq_hours=6)
 
 
 
-def main_canesm2_historical():
+def main_canesm2_historical(processes=5):
     samples_dir_p = Path("/RECH/data/Simulations/CRCM5/North_America/NorthAmerica_0.44deg_CanHisto_B1/Samples")
 
     out_dir_root = Path("/RECH2/huziy/BenAlaya/")
@@ -240,14 +371,14 @@ def main_canesm2_historical():
         inputs.append(dict(year=y, varnames=varnames, samples_dir=samples_dir_p, out_dir=out_dir_p, target_freq_hours=6, calendar_str="365_day"))
 
     # Extract the data for each year in parallel
-    pool = Pool(processes=5)
+    pool = Pool(processes=processes)
     pool.map(extract_data_for_year_in_parallel, inputs)
 
     # extract_data_for_year(1980, varnames=varnames, samples_dir=samples_dir_p, out_dir=out_dir_p, target_freq_hours=6)
 
 
 
-def main_canesm2_rcp45():
+def main_canesm2_rcp45(processes=3):
     samples_dir_p = Path("/RECH/data/Simulations/CRCM5/North_America/NorthAmerica_0.44deg_CanRCP45_B1/Samples")
 
     out_dir_root = Path("/RECH2/huziy/BenAlaya/")
@@ -275,13 +406,13 @@ def main_canesm2_rcp45():
         inputs.append(dict(year=y, varnames=varnames, samples_dir=samples_dir_p, out_dir=out_dir_p, target_freq_hours=6, calendar_str="365_day"))
 
     # Extract the data for each year in parallel
-    pool = Pool(processes=3)
+    pool = Pool(processes=processes)
     pool.map(extract_data_for_year_in_parallel, inputs)
 
     # extract_data_for_year(1980, varnames=varnames, samples_dir=samples_dir_p, out_dir=out_dir_p, target_freq_hours=6)
 
 
-def main_canesm2_rcp85():
+def main_canesm2_rcp85(processes=3):
     samples_dir_p = Path("/RECH/data/Simulations/CRCM5/North_America/NorthAmerica_0.44deg_CanRCP85_B1/Samples")
 
     out_dir_root = Path("/RECH2/huziy/BenAlaya/")
@@ -308,7 +439,7 @@ def main_canesm2_rcp85():
         inputs.append(dict(year=y, varnames=varnames, samples_dir=samples_dir_p, out_dir=out_dir_p, target_freq_hours=6, calendar_str="365_day"))
 
     # Extract the data for each year in parallel
-    pool = Pool(processes=3)
+    pool = Pool(processes=processes)
     pool.map(extract_data_for_year_in_parallel, inputs)
 
     # extract_data_for_year(1980, varnames=varnames, samples_dir=samples_dir_p, out_dir=out_dir_p, target_freq_hours=6)
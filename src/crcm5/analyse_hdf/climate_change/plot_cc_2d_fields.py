@@ -6,7 +6,7 @@ from matplotlib.gridspec import GridSpec
 from matplotlib.ticker import MaxNLocator
 from mpl_toolkits.basemap import maskoceans
 from pathlib import Path
-from scipy.stats import ttest_ind
+from util.significance import ttest_ind_fields
 from crcm5 import infovar
 from crcm5.analyse_hdf.run_config import RunConfig
 from crcm5.analyse_hdf import do_analysis_using_pytables as analysis
@@ -45,13 +45,9 @@ def compute_seasonal_means_for_each_year(sim_config, season_to_months=None, var_
     if season_to_months is None:
         season_to_months = get_default_season_to_months_dict()
 
-    season_to_field = OrderedDict()
-    for season, months in season_to_months.items():
-        season_to_field[season] = analysis.get_mean_2d_fields_for_months(
-            path=sim_config.data_path, var_name=var_name, level=level, months=months,
-            start_year=sim_config.start_year, end_year=sim_config.end_year)
-
-    return season_to_field
+    return analysis.get_mean_2d_fields_for_seasons(
+        path=sim_config.data_path, var_name=var_name, level=level, season_to_months=season_to_months,
+        start_year=sim_config.start_year, end_year=sim_config.end_year)
 
 
 def _plot_row(vname="", level=0, config_dict=None, plot_cc_only_for=None, mark_significance=True):
@@ -163,8 +159,8 @@ def _plot_row(vname="", level=0, config_dict=None, plot_cc_only_for=None, mark_s
     season_to_pvalue = OrderedDict()
     for season in list(current_base.keys()):
 
-        _, pvalue_current = ttest_ind(current_modif[season], current_base[season], axis=0, equal_var=False)
-        _, pvalue_future = ttest_ind(future_modif[season], future_base[season], axis=0, equal_var=False)
+        _, pvalue_current = ttest_ind_fields(current_modif[season], current_base[season], equal_var=False)
+        _, pvalue_future = ttest_ind_fields(future_modif[season], future_base[season], equal_var=False)
 
         if plot_cc_only_for is None:
             season_to_pvalue[season] = np.minimum(pvalue_current, pvalue_future)
@@ -175,11 +171,11 @@ def _plot_row(vname="", level=0, config_dict=None, plot_cc_only_for=None, mark_s
         else:
 
             if plot_cc_only_for == label_base:
-                _, season_to_pvalue[season] = ttest_ind(future_base[season], current_base[season], axis=0, equal_var=False)
+                _, season_to_pvalue[season] = ttest_ind_fields(future_base[season], current_base[season], equal_var=False)
                 c_data = current_base[season]
                 f_data = future_base[season]
             else:
-                _, season_to_pvalue[season] = ttest_ind(future_modif[season], current_modif[season], axis=0, equal_var=False)
+                _, season_to_pvalue[season] = ttest_ind_fields(future_modif[season], current_modif[season], equal_var=False)
                 c_data = current_modif[season]
                 f_data = future_modif[season]
 
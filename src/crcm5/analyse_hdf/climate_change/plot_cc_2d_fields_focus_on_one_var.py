@@ -6,14 +6,15 @@ from matplotlib.font_manager import FontProperties
 from matplotlib.gridspec import GridSpec
 from matplotlib.ticker import MaxNLocator, LogLocator
 from mpl_toolkits.basemap import maskoceans
-from scipy.stats import ttest_ind
+from util.significance import ttest_ind_fields
 from crcm5 import infovar
 from crcm5.analyse_hdf.run_config import RunConfig
 import matplotlib.pyplot as plt
 from crcm5.analyse_hdf import do_analysis_using_pytables as analysis
 from crcm5.analyse_hdf.climate_change.plot_cc_2d_fields import compute_seasonal_means_for_each_year, \
     get_default_season_to_months_dict
-from util import plot_utils
+from util import plot_utils, rendering_service
+from util.rendering_service import RenderTask
 import numpy as np
 
 
@@ -69,11 +70,11 @@ def _plot_var(vname="", level=0, config_dict=None, data_dict=None):
     base_config_f, modif_config_f = [config_dict["Future"][the_label] for the_label in [base_label, modif_label]]
 
     bmp = config_dict.basemap
-    lons = config_dict.lons
+    lons = config_dict.lons.copy()
     lons[lons > 180] -= 360
 
     lats = config_dict.lats
-    xx, yy = bmp(lons, lats)
+    xx, yy = config_dict.x, config_dict.y
 
     i_to_label = {
         0: base_label,
@@ -117,12 +118,12 @@ def _plot_var(vname="", level=0, config_dict=None, data_dict=None):
 
         print("------------ {}, {} --------------".format(vname, season))
         print("data_dict[base_config_c][season].shape = {}".format(data_dict[base_config_c][season].shape))
-        _, p_signif_base_cc = ttest_ind(data_dict[base_config_c][season], data_dict[base_config_f][season], axis=0, equal_var=False)
-        _, p_signif_current = ttest_ind(data_dict[base_config_c][season], data_dict[modif_config_c][season], axis=0, equal_var=False)
+        _, p_signif_base_cc = ttest_ind_fields(data_dict[base_config_c][season], data_dict[base_config_f][season], equal_var=False)
+        _, p_signif_current = ttest_ind_fields(data_dict[base_config_c][season], data_dict[modif_config_c][season], equal_var=False)
 
-        print("Base p-value ranges: {} to {}".format(p_signif_base_cc.min(), p_signif_base_cc.max()))
-        _, p_signif_modif_cc = ttest_ind(data_dict[modif_config_c][season], data_dict[modif_config_f][season], axis=0, equal_var=False)
-        _, p_signif_future = ttest_ind(data_dict[base_config_f][season], data_dict[modif_config_f][season], axis=0, equal_var=False)
+        print("Base p-value ranges: {} to {}".format(np.nanmin(p_signif_base_cc), np.nanmax(p_signif_base_cc)))
+        _, p_signif_modif_cc = ttest_ind_fields(data_dict[modif_config_c][season], data_dict[modif_config_f][season], equal_var=False)
+        _, p_signif_future = ttest_ind_fields(data_dict[base_config_f][season], data_dict[modif_config_f][season], equal_var=False)
 
         ij_to_pvalue = {
             (0, 2): p_signif_base_cc,
@@ -287,9 +288,9 @@ def _plot_var(vname="", level=0, config_dict=None, data_dict=None):
         plt.close(fig)
 
 
-def main():
+def main(processes=None):
     """
-
+    :param processes: number of processes used for plotting
     """
 
     season_to_months = get_default_season_to_months_dict()
@@ -352,15 +353,21 @@ def main():
     config_dict.season_to_months = season_to_months
     config_dict.multipliers = multipliers
 
-    lons, lats, bmp = analysis.get_basemap_from_hdf(base_current_path)
+    lons, lats, bmp, x, y = analysis.get_basemap_and_xy_from_hdf(base_current_path)
     config_dict.lons = lons
     config_dict.lats = lats
     config_dict.basemap = bmp
+    config_dict.x = x
+    config_dict.y = y
 
-    # Calculate and plot seasonal means
+    # Calculate seasonal means, then plot the variables in parallel
+    tasks = []
     for vname, level in zip(var_names, levels):
         data = get_data(vname=vname, level=level, config_dict=config_dict)
-        _plot_var(vname=vname, level=level, config_dict=config_dict, data_dict=data)
+        tasks.append(RenderTask(_plot_var, kwargs=dict(vname=vname, level=level, config_dict=config_dict,
+                                                       data_dict=data), label=vname))
+
+    rendering_service.render(tasks, processes=processes)
 
 
 if __name__ == '__main__':
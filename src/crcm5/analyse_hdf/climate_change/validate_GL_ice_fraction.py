@@ -66,16 +66,14 @@ def main():
     lkid_to_mask = get_lake_masks(bmp_info.lons, bmp_info.lats)
 
 
-    cell_area_m2 = analysis.get_array_from_file(path=r_config.data_path, var_name="cell_area_m2")
+    # read the model data (area averages for all the lakes in one pass, weighted by the cell areas)
+    df_all_lakes = analysis.get_area_mean_timeseries_for_masks(r_config.data_path, var_name=var_name,
+                                                               label_to_mask=lkid_to_mask,
+                                                               start_year=start_year, end_year=end_year)
 
-
-    # read the model data
     lkid_to_ts_model = {}
-    for lkid, the_mask in lkid_to_mask.items():
-        lkid_to_ts_model[lkid] = analysis.get_area_mean_timeseries(r_config.data_path, var_name=var_name, the_mask=the_mask * cell_area_m2,
-                                                                   start_year=start_year, end_year=end_year)
-
-        df = lkid_to_ts_model[lkid]
+    for lkid in lkid_to_mask:
+        df = df_all_lakes[lkid]
 
         # remove the last December
         df = df.select(lambda d: not (d.year == end_year and d.month == 12))
@@ -10,7 +10,7 @@ from matplotlib.axes import Axes
 from matplotlib.colorbar import Colorbar
 from matplotlib.colors import LogNorm
 from matplotlib.figure import Figure
-from scipy.stats import ttest_ind
+from util.significance import ttest_ind_fields
 from tables import NoSuchNodeError
 
 from crcm5 import infovar
@@ -161,7 +161,7 @@ def compare(paths=None, path_to_control_data=None, control_label="",
 
             cb = basemap.colorbar(format=sfmt)
 
-            t, pval = ttest_ind(means_for_years, control_means, axis=0)
+            t, pval = ttest_ind_fields(means_for_years, control_means)
             sig = pval < 0.1
             basemap.contourf(x, y, sig.astype(int), nlevels=2, hatches=["+", None], colors="none")
 
@@ -484,9 +484,9 @@ def plot_control_and_differences_in_one_panel_for_all_seasons(varnames=None,
                                                                             start_year=start_year, end_year=end_year,
                                                                             level=level)
 
-                    tval, pval = ttest_ind(modified_means, control_means, axis=0, equal_var=False)
+                    tval, pval = ttest_ind_fields(modified_means, control_means, equal_var=False)
                     significance = ((pval <= pvalue_max) & (~control_mean.mask)).astype(int)
-                    print("pval ranges: {} to {}".format(pval.min(), pval.max()))
+                    print("pval ranges: {} to {}".format(np.nanmin(pval), np.nanmax(pval)))
 
                     modified_mean = np.mean(modified_means, axis=0)
                     if the_label not in label_to_season_to_difference:
@@ -11,10 +11,14 @@ from data import cehq_station
 import matplotlib.pyplot as plt
 from matplotlib import gridspec
 import numpy as np
+import tables as tb
 
 from crcm5 import infovar, model_point
 from crcm5.analyse_hdf.plot_station_positions import plot_positions_of_station_list
+from crcm5.analyse_hdf.event_statistics import rows_to_datetime64
 from crcm5.model_point import ModelPoint
+from crcm5.streamflow_validation_store import get_files_signature, get_station_signature, \
+    build_station_validation, StreamflowValidationStore
 from data.anusplin import AnuSplinManager
 from data.cehq_station import Station
 from data.cell_manager import CellManager
@@ -37,7 +41,10 @@ from crcm5.analyse_hdf import do_analysis_using_pytables as analysis
 images_folder = "/home/huziy/skynet3_rech1/Netbeans Projects/Python/RPN/images_for_lake-river_paper"
 
 
-def _plot_station_position(ax, the_station, basemap, cell_manager, the_model_point):
+def _plot_station_position(ax, the_station, basemap, cell_manager, the_model_point, upstream_mask=None):
+    """
+    :param upstream_mask: the mask of the upstream cells (i.e. from the validation store), calculated if None
+    """
     assert the_station is None or isinstance(the_station, Station)
     assert isinstance(the_model_point, ModelPoint)
     assert isinstance(cell_manager, CellManager)
@@ -48,7 +55,10 @@ def _plot_station_position(ax, the_station, basemap, cell_manager, the_model_poi
 
 
     # plot the arrows for upstream cells
-    ups_mask = cell_manager.get_mask_of_upstream_cells_connected_with_by_indices(the_model_point.ix, the_model_point.jy)
+    ups_mask = upstream_mask
+    if ups_mask is None:
+        ups_mask = cell_manager.get_mask_of_upstream_cells_connected_with_by_indices(the_model_point.ix,
+                                                                                     the_model_point.jy)
 
     x1d_start = x[ups_mask == 1]
     y1d_start = y[ups_mask == 1]
@@ -378,15 +388,101 @@ def write_annual_flows_to_txt(sim_label_list, sim_to_values_model, values_obs, f
     file_annual_discharge.write(line_format.format(*line_data))
 
 
+def _read_daily_point_series(path, var_name, years, model_points, chunk_size=1000):
+    """
+    Read the series at the model points: one query over the range of the years, the selected rows are read
+    in chunks of chunk_size fields and only the values at the points are kept
+    :return: dates (numpy.datetime64), values (ntimes, npoints), empty if there is no data for the years
+    """
+    ix = np.array([mp.ix for mp in model_points])
+    jy = np.array([mp.jy for mp in model_points])
+
+    with tb.open_file(path) as h:
+        the_table = h.get_node("/", var_name)
+        query = "(year >= {}) & (year <= {}) & (level_index == 0)".format(min(years), max(years))
+        coords = the_table.get_where_list(query)
+
+        dates = np.empty((len(coords), ), dtype="datetime64[s]")
+        values = np.empty((len(coords), len(model_points)), dtype=the_table.coldtypes["field"].base)
+        for start in range(0, len(coords), chunk_size):
+            rows = the_table.read_coordinates(coords[start:start + chunk_size])
+            dates[start:start + len(rows)] = rows_to_datetime64(rows)
+            values[start:start + len(rows)] = rows["field"][:, ix, jy]
+
+    order = np.argsort(dates, kind="mergesort")
+    dates, values = dates[order], values[order]
+
+    # the years in the range without complete observations are not needed
+    sel = np.isin(dates.astype("datetime64[Y]").astype(int) + 1970, years)
+    return dates[sel], values[sel]
+
+
+def get_validations_for_run(validation_store, sim_label, path, stations, model_points, cell_manager,
+                            stfl_name="STFA", start_year=None, end_year=None):
+    """
+    Get the validations of the run for the stations from the store, the missing (or outdated) ones are calculated
+    using a single pass over the hdf file and saved to the store.
+    :param stations: list of stations corresponding to the list of model points
+    :return: {station: StationValidation}, the stations without complete years or without model data
+        for them are not included
+    """
+    model_signature = get_files_signature([path])
+
+    station_to_validation = OrderedDict()
+    to_calculate = []
+    for the_station, the_model_point in zip(stations, model_points):
+        years = [y for y in the_station.get_list_of_complete_years()
+                 if (start_year is None or start_year <= y) and (end_year is None or y <= end_year)]
+        if not len(years):
+            continue
+
+        signature = dict(model=model_signature, var_name=stfl_name, station=get_station_signature(the_station),
+                         ix=int(the_model_point.ix), jy=int(the_model_point.jy), years=years)
+
+        validation = validation_store.load(sim_label, the_station.id, signature)
+        if validation is None:
+            to_calculate.append((the_station, the_model_point, years, signature))
+        else:
+            station_to_validation[the_station] = validation
+
+    print("{}: {} validations from the store, {} to calculate".format(sim_label, len(station_to_validation),
+                                                                      len(to_calculate)))
+
+    if not len(to_calculate):
+        return station_to_validation
+
+    all_years = sorted(set(y for _, _, years, _ in to_calculate for y in years))
+    dates, values = _read_daily_point_series(path, stfl_name, all_years, [mp for _, mp, _, _ in to_calculate])
+    date_years = dates.astype("datetime64[Y]").astype(int) + 1970
+
+    for k, (the_station, the_model_point, years, signature) in enumerate(to_calculate):
+        if not np.any(np.isin(date_years, years)):
+            print("Skipping {}: no model data for the years {}-{} in {}".format(the_station.id, min(years),
+                                                                                max(years), path))
+            continue
+
+        upstream_mask = cell_manager.get_mask_of_upstream_cells_connected_with_by_indices(the_model_point.ix,
+                                                                                          the_model_point.jy)
+        validation = build_station_validation(sim_label, the_station.id, the_model_point, upstream_mask,
+                                              obs_dates=the_station.dates, obs_values=the_station.values,
+                                              mod_dates=dates, mod_values=values[:, k], years=years)
+        validation_store.save(sim_label, the_station.id, validation, signature)
+        station_to_validation[the_station] = validation
+
+    return station_to_validation
+
+
 def draw_model_comparison(model_points=None, stations=None, sim_name_to_file_name=None, hdf_folder=None,
                           start_year=None, end_year=None, cell_manager=None, stfl_name="STFA",
                           drainage_area_reldiff_min=0.1, plot_upstream_area_averaged=True,
-                          sim_name_to_color=None):
+                          sim_name_to_color=None, validation_store=None):
     """
 
     :param model_points: list of model point objects
     :param stations: list of stations corresponding to the list of model points
     :param cell_manager: is a CellManager instance which can be provided for better performance if necessary
+    :param validation_store: StreamflowValidationStore, if not None the streamflow climatologies, upstream masks
+        and scores for the stations are taken from it (and the missing ones are added to it)
     len(model_points) == len(stations) if stations is not None.
     if stations is None - then no measured streamflow will be plotted
     """
@@ -488,6 +584,17 @@ def draw_model_comparison(model_points=None, stations=None, sim_name_to_file_nam
     else:
         processed_stations = [None] * len(mp_list)
     processed_model_points = mp_list
+
+    # {sim label: {station: StationValidation}}
+    label_to_validations = {}
+    if validation_store is not None and station_list is not None:
+        for label in label_list:
+            fpath = sim_name_to_file_name[label]
+            fpath = fpath if hdf_folder is None else os.path.join(hdf_folder, fpath)
+            label_to_validations[label] = get_validations_for_run(validation_store, label, fpath,
+                                                                  station_list, mp_list, cell_manager,
+                                                                  stfl_name=stfl_name,
+                                                                  start_year=start_year, end_year=end_year)
     plot_point_positions_with_upstream_areas(processed_stations, processed_model_points, basemap,
                                              cell_manager, lake_fraction_field=lake_fraction)
 
@@ -545,7 +652,11 @@ def draw_model_comparison(model_points=None, stations=None, sim_name_to_file_nam
 
         # plot station position
         ax = fig.add_subplot(gs[3, 0:2])
-        upstream_mask = _plot_station_position(ax, the_station, basemap, cell_manager, the_model_point)
+        validations = [label_to_validations[label].get(the_station) for label in label_to_validations]
+        validations = [v for v in validations if v is not None]
+
+        upstream_mask = _plot_station_position(ax, the_station, basemap, cell_manager, the_model_point,
+                                               upstream_mask=validations[0].upstream_mask if len(validations) else None)
 
 
 
@@ -590,11 +701,15 @@ def draw_model_comparison(model_points=None, stations=None, sim_name_to_file_nam
                 _, model_daily_clim_swe[label] = analysis.get_daily_climatology(
                     path_to_hdf_file=fpath, var_name="I5", level=0, start_year=start_year, end_year=end_year)
 
-            dates, values_model = analysis.get_daily_climatology_for_a_point(path=fpath,
-                                                                             var_name=stfl_name,
-                                                                             years_of_interest=year_list,
-                                                                             i_index=the_model_point.ix,
-                                                                             j_index=the_model_point.jy)
+            validation = label_to_validations.get(label, {}).get(the_station)
+            if validation is not None:
+                dates, values_model = validation.clim_dates, validation.mod_clim
+            else:
+                dates, values_model = analysis.get_daily_climatology_for_a_point(path=fpath,
+                                                                                 var_name=stfl_name,
+                                                                                 years_of_interest=year_list,
+                                                                                 i_index=the_model_point.ix,
+                                                                                 j_index=the_model_point.jy)
 
             ax.plot(dates, values_model, label=label, lw=2)
 
@@ -611,8 +726,11 @@ def draw_model_comparison(model_points=None, stations=None, sim_name_to_file_nam
 
         if the_station is not None:
             assert isinstance(the_station, Station)
-            dates, values_obs = the_station.get_daily_climatology_for_complete_years_with_pandas(stamp_dates=dates,
-                                                                                                 years=year_list)
+            if len(validations):
+                values_obs = validations[0].obs_clim
+            else:
+                dates, values_obs = the_station.get_daily_climatology_for_complete_years_with_pandas(
+                    stamp_dates=dates, years=year_list)
 
             # To keep the colors consistent for all the variables, the obs Should be plotted last
             ax.plot(dates, values_obs, label="Obs.", lw=2)
@@ -631,6 +749,11 @@ def draw_model_comparison(model_points=None, stations=None, sim_name_to_file_nam
                                            da_mod=the_model_point.accumulation_area,
                                            da_obs=the_station.drainage_km2)
 
+            # Nash-Sutcliffe coefficients of the daily series
+            if len(validations) == len(label_list) and the_station.drainage_km2 is not None:
+                file_scores.write(line_format.format(the_station.id, the_station.drainage_km2,
+                                                     the_model_point.accumulation_area,
+                                                     *[v.scores["ns"] for v in validations]) + "\n")
 
 
 
@@ -974,7 +1097,8 @@ def main(hdf_folder="/home/huziy/skynet3_rech1/hdf_store", start_date=None, end_
                           start_year=start_date.year, end_year=end_date.year, stations=stations,
                           stfl_name="STFA",
                           drainage_area_reldiff_min=0.1,
-                          plot_upstream_area_averaged=False, sim_name_to_color=simname_to_color)
+                          plot_upstream_area_averaged=False, sim_name_to_color=simname_to_color,
+                          validation_store=StreamflowValidationStore())
 
 
 def main_for_cc_paper(start_date=None, end_date=None):
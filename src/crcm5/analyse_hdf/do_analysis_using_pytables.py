@@ -8,10 +8,13 @@ from queue import PriorityQueue
 
 from scipy.spatial import KDTree
 
+from crcm5.analyse_hdf.event_statistics import rows_to_datetime64
+from crcm5.analyse_hdf.multi_season_means import get_multi_season_means
 from crcm5.analyse_hdf.rain_duration_distr_for_region import Selection
 from crcm5.analyse_hdf.run_config import RunConfig
 from util.geo import lat_lon
 from util.geo.basemap_info import BasemapInfo
+from util.rendering_service import get_projection_cache, DEFAULT_CACHE_FOLDER
 
 __author__ = 'huziy'
 
@@ -20,6 +23,7 @@ import itertools
 from matplotlib.axes import Axes
 from matplotlib.dates import DateFormatter, DayLocator
 from crcm5.model_data import Crcm5ModelDataManager
+from crcm5 import infovar
 
 import numpy as np
 import matplotlib.pyplot as plt
@@ -58,30 +62,31 @@ def get_basemap_from_hdf(file_path="", resolution="l"):
     :param file_path:
     :return: lons(2d), lats(2), basemap - corresponding to the data in the file
     """
-    h = tb.open_file(file_path)
-
-    # Extract 2d longitudes and latitudes
-    lons = h.getNode("/", "longitude")[:]
-    lats = h.getNode("/", "latitude")[:]
-
-    rotpoletable = h.getNode("/", "rotpole")
+    lons, lats, basemap, _, _ = get_basemap_and_xy_from_hdf(file_path=file_path, resolution=resolution)
+    return lons, lats, basemap
 
-    assert isinstance(rotpoletable, tb.Table)
 
-    params = {}
-    for row in rotpoletable:
-        print(row["name"], row["value"])
+def get_basemap_and_xy_from_hdf(file_path="", resolution="l", cache_folder=DEFAULT_CACHE_FOLDER):
+    """
+    The basemap and the projected coordinates are taken from the projection cache (keyed by the grid),
+    they are calculated only for the grids that were not seen before
+    :return: lons(2d), lats(2d), basemap, x(2d), y(2d)
+    """
+    with tb.open_file(file_path) as h:
+        # Extract 2d longitudes and latitudes
+        lons = h.get_node("/", "longitude")[:]
+        lats = h.get_node("/", "latitude")[:]
 
-        params[row["name"].decode()] = row["value"].decode() if isinstance(row["value"], bytes) else row["value"]
-    rotpoletable.close()
+        params = {}
+        for row in h.get_node("/", "rotpole"):
+            params[row["name"].decode()] = row["value"].decode() if isinstance(row["value"], bytes) else row["value"]
 
-    basemap = Crcm5ModelDataManager.get_rotpole_basemap_using_lons_lats(
-        lons2d=lons, lats2d=lats,
+    basemap, x, y = get_projection_cache(cache_folder).get(
+        lons, lats, Crcm5ModelDataManager.get_rotpole_basemap_using_lons_lats,
         lon_1=params["lon1"], lon_2=params["lon2"],
         lat_1=params["lat1"], lat_2=params["lat2"], resolution=resolution
     )
-    h.close()
-    return lons, lats, basemap
+    return lons, lats, basemap, x, y
 
 
 def get_array_from_file(path="", var_name=""):
@@ -118,6 +123,29 @@ def get_mean_2d_fields_for_months(path="", var_name="", level=None, months=None,
 
 
 
+def get_mean_2d_fields_for_seasons(path="", var_name="", level=None, season_to_months=None,
+                                   start_year=None, end_year=None):
+    """
+    The same as get_mean_2d_fields_for_months for several seasons, the table is read once for all the seasons
+    :param season_to_months: OrderedDict {season name: list of months}
+    :return: OrderedDict {season name: means for each year (year, nx, ny)}
+    """
+    if ("-" in var_name) or ("+" in var_name):
+        var_name1, var_name2 = re.split(r"[+\-]", var_name)
+        params = dict(path=path, level=level, season_to_months=season_to_months,
+                      start_year=start_year, end_year=end_year)
+        v1 = get_mean_2d_fields_for_seasons(var_name=var_name1, **params)
+        v2 = get_mean_2d_fields_for_seasons(var_name=var_name2, **params)
+        return OrderedDict((season, v1[season] - v2[season] if "-" in var_name else v1[season] + v2[season])
+                           for season in v1)
+
+    season_means = get_multi_season_means(path_to_hdf=path, var_name=var_name, season_to_months=season_to_months,
+                                          start_year=start_year, end_year=end_year, level=level)
+
+    return OrderedDict((season, np.ma.filled(season_means.get_means(season)[1].astype(float), np.nan))
+                       for season in season_means.seasons)
+
+
 def get_lake_level_timesries_due_to_precip_evap(path="", i_index=None, j_index=None, point_label=""):
     """
 
@@ -647,9 +675,18 @@ def get_area_mean_timeseries(hdf_path, var_name="PR", level_index=0, selection=N
 
     path_hash = hashlib.sha224(hdf_path.encode()).hexdigest()
 
+    # the mask and the selection bounds define the averaging region
+    region_hash = hashlib.sha224()
+    if the_mask is not None:
+        the_mask = np.ma.filled(np.ma.asarray(the_mask, dtype=np.float64), 0)
+        region_hash.update(str(the_mask.shape).encode())
+        region_hash.update(np.ascontiguousarray(the_mask).tobytes())
+
+    if selection is not None:
+        region_hash.update("sel_{}_{}".format(selection.ll_indices(), selection.ur_indices()).encode())
 
-    mask_sum = the_mask.sum() if the_mask is not None else 0
-    cache_file = "{}_{}_{}-{}_lev_index_{}_mask_{}_cache.hdf5".format(path_hash, var_name, start_year, end_year, level_index, mask_sum)
+    cache_file = "{}_{}_{}-{}_lev_index_{}_region_{}_cache.hdf5".format(path_hash, var_name, start_year, end_year,
+                                                                        level_index, region_hash.hexdigest())
 
     if os.path.isfile(cache_file):
         print("reusing cache file at: {}".format(cache_file))
@@ -658,16 +695,67 @@ def get_area_mean_timeseries(hdf_path, var_name="PR", level_index=0, selection=N
 
     assert level_index is not None, "Please, specify the index of the levele you want to retreive"
 
-    if selection is not None:
-        # Indices of the lower left corner of the selection
-        # --//-- upper right corner of the selection
-        assert isinstance(selection, Selection)
-        i0, j0 = selection.ll_indices()
-        i1, j1 = selection.ur_indices()
-        raise NotImplementedError("Subsetting based on the selection object is not implemented yet.")
+    df = get_area_mean_timeseries_for_masks(hdf_path, var_name=var_name, level_index=level_index, selection=selection,
+                                            label_to_mask=None if the_mask is None else {"ts": the_mask},
+                                            start_year=start_year, end_year=end_year,
+                                            weight_by_cell_area=False)
+    s = df[df.columns[0]].rename("ts")
+    s.to_hdf(cache_file, key="ts")
+    return s
+
+
+def get_area_mean_timeseries_for_masks(hdf_path, var_name="PR", level_index=0, selection=None, label_to_mask=None,
+                                       start_year=None, end_year=None, weight_by_cell_area=True,
+                                       rows_per_block=500):
+    """
+    Calculate the weighted area averages for several regions in one pass through the table.
+    Only the bounding box of the regions is kept from each block of rows.
+
+    :param label_to_mask: {label: 2d mask or weights}, if None the average is taken over the selection (or everywhere)
+    :param selection: Selection object, the points outside of the selection are not averaged over
+    :param weight_by_cell_area: multiply the masks by the cell areas from the file
+    :param rows_per_block: number of rows read at once
+    :return: pd.DataFrame (time, label)
+    """
+
+    assert level_index is not None, "Please, specify the index of the levele you want to retreive"
 
     with tb.open_file(hdf_path) as h:
         v_table = h.get_node("/{}".format(var_name))
+        field_shape = v_table.coldescrs["field"].shape
+
+        if label_to_mask is None:
+            label_to_mask = {"mean": np.ones(field_shape)}
+
+        labels = list(label_to_mask.keys())
+        weights = np.asarray([np.ma.filled(np.ma.asarray(label_to_mask[k], dtype=np.float64), 0) for k in labels])
+
+        if selection is not None:
+            # Indices of the lower left corner of the selection
+            # --//-- upper right corner of the selection
+            assert isinstance(selection, Selection)
+            i0, j0 = selection.ll_indices()
+            i1, j1 = selection.ur_indices()
+
+            in_selection = np.zeros(field_shape, dtype=bool)
+            in_selection[i0:i1 + 1, j0:j1 + 1] = True
+            weights[:, ~in_selection] = 0
+
+        if weight_by_cell_area:
+            if infovar.HDF_CELL_AREA_NAME_M2 in h.root:
+                weights *= h.get_node("/", infovar.HDF_CELL_AREA_NAME_M2)[:][np.newaxis, :, :]
+            else:
+                print("Warning: no {} in {}, the cell areas are not taken into account".format(
+                    infovar.HDF_CELL_AREA_NAME_M2, hdf_path))
+
+        # The bounding box of all the regions
+        i_nz, j_nz = np.where((weights != 0).any(axis=0))
+        if len(i_nz) == 0:
+            print("Warning: the masks are empty within the selection, nothing to average")
+            return pd.DataFrame(columns=labels, dtype=np.float64)
+
+        bi0, bi1, bj0, bj1 = i_nz.min(), i_nz.max() + 1, j_nz.min(), j_nz.max() + 1
+        weights = weights[:, bi0:bi1, bj0:bj1].reshape((len(labels), -1)).T
 
         query = []
         if start_year is not None:
@@ -679,19 +767,28 @@ def get_area_mean_timeseries(hdf_path, var_name="PR", level_index=0, selection=N
         query += ["(level_index == {})".format(level_index), ]
 
         query = "&".join(query)
+        coords = v_table.get_where_list(query)
 
-        vals = []
         dates = []
-        for row in v_table.where(query):
-            dates.append(datetime(row["year"], row["month"], row["day"], row["hour"]))
+        vals = []
+        for start in range(0, len(coords), rows_per_block):
+            rows = v_table.read_coordinates(coords[start:start + rows_per_block])
+            dates.append(rows_to_datetime64(rows))
+
+            data = rows["field"][:, bi0:bi1, bj0:bj1].reshape((len(rows), -1)).astype(np.float64)
 
-            data = the_mask * row["field"]
-            vals.append(data.sum() / the_mask.sum())
+            # NaNs are not taken into account
+            is_nan = np.isnan(data)
+            data[is_nan] = 0
+            vals.append(np.dot(data, weights) / np.dot(~is_nan, weights))
+
+    if len(vals) == 0:
+        return pd.DataFrame(columns=labels)
+
+    df = pd.DataFrame(index=pd.DatetimeIndex(np.concatenate(dates)), data=np.concatenate(vals), columns=labels)
+    df.sort_index(inplace=True)
+    return df
 
-        s = pd.Series(index=dates, data=vals)
-        s.sort_index(inplace=True)
-        s.to_hdf(cache_file, "ts")
-        return s
 
 if __name__ == "__main__":
     import application_properties
@@ -742,41 +839,80 @@ def get_timeseries_for_points(lons, lats, data_path="", varname="LD"):
     :param lats:
     :return: pd.DataFrame with axes (time, point_index)
     """
+    df = get_timeseries_for_points_and_vars(lons, lats, data_path=data_path, varnames=[varname, ])
+    return df[varname]
 
-    assert len(lons) == len(lats)
 
-    df = None
-    indices = None
-    lk_fraction = None
-    with tb.open_file(data_path) as h:
-        var_table = h.get_node("/{}".format(varname))
-        for i, row in enumerate(var_table):
-            if df is None:
-                df = pd.DataFrame(index=range(len(var_table)), columns=["date", ] + list(range(len(lons))))
-
-                # calculate indices of the grid corresponding to the points
-                bmp_info = get_basemap_info_from_hdf(file_path=data_path)
-                """
-                :type bmp_info: BasemapInfo
-                """
-                grid_lons, grid_lats = bmp_info.lons, bmp_info.lats
+def get_timeseries_for_points_and_vars(lons, lats, data_path="", varnames=("LD", ), level_index=None,
+                                       rows_per_block=2000):
+    """
+    Get the timeseries of several variables for the points with the given coordinates
+    (nearest neighbor interpolation). Each variable table is read once in blocks of rows,
+    and the point values are taken from the flattened fields by fancy indexing.
 
-                x, y, z = lat_lon.lon_lat_to_cartesian(grid_lons.flatten(), grid_lats.flatten())
+    :param lons:
+    :param lats:
+    :param data_path: path to the hdf5 file
+    :param varnames: list of the variable names
+    :param level_index: if None, all the rows of the tables are taken, ValueError is raised if a table has
+        several levels (they should be selected explicitly)
+    :param rows_per_block: number of rows read at once
+    :return: pd.DataFrame with the index - time and the columns - (varname, point_index),
+        the values of the rows with the same date are averaged, empty if there are no rows
+    """
 
-                ktree = KDTree(list(zip(x, y, z)))
+    assert len(lons) == len(lats)
 
-                x1, y1, z1 = lat_lon.lon_lat_to_cartesian(lons, lats)
+    # calculate indices of the grid corresponding to the points
+    bmp_info = get_basemap_info_from_hdf(file_path=data_path)
+    """
+    :type bmp_info: BasemapInfo
+    """
+    grid_lons, grid_lats = bmp_info.lons, bmp_info.lats
 
-                dists, indices = ktree.query(list(zip(x1, y1, z1)))
+    x, y, z = lat_lon.lon_lat_to_cartesian(grid_lons.flatten(), grid_lats.flatten())
+    ktree = KDTree(list(zip(x, y, z)))
 
-                lk_fraction = get_array_from_file(path=data_path, var_name="lake_fraction")
+    x1, y1, z1 = lat_lon.lon_lat_to_cartesian(np.asarray(lons), np.asarray(lats))
+    dists, indices = ktree.query(list(zip(x1, y1, z1)))
 
-            df.loc[i, :] = [datetime(row["year"], row["month"], row["day"], row["hour"]), ] + list(row["field"].flatten()[indices])
+    frames = []
+    with tb.open_file(data_path) as h:
+        for varname in varnames:
+            var_table = h.get_node("/{}".format(varname))
 
-    # print lake fractions
-    print(lk_fraction.flatten()[indices])
-    print(sum(lk_fraction.flatten()[indices] > 0.05))
+            if level_index is None:
+                coords = np.arange(var_table.nrows)
+            else:
+                coords = var_table.get_where_list("level_index == {}".format(level_index))
 
-    df.set_index("date", inplace=True)
-    df.sort_index(inplace=True)
-    return df
+            dates = []
+            vals = []
+            levels = set()
+            for start in range(0, len(coords), rows_per_block):
+                rows = var_table.read_coordinates(coords[start:start + rows_per_block])
+                dates.append(rows_to_datetime64(rows))
+                vals.append(rows["field"].reshape((len(rows), -1))[:, indices])
+                levels.update(np.unique(rows["level_index"]).tolist())
+
+            if len(levels) > 1:
+                raise ValueError("{} has {} levels in {}, please specify level_index".format(varname, len(levels),
+                                                                                          data_path))
+
+            columns = pd.MultiIndex.from_product([[varname, ], list(range(len(lons)))])
+            if not len(dates):
+                frames.append(pd.DataFrame(index=pd.DatetimeIndex([], name="date"), columns=columns,
+                                           dtype=np.float64))
+                continue
+
+            df = pd.DataFrame(index=pd.DatetimeIndex(np.concatenate(dates), name="date"),
+                              data=np.concatenate(vals).astype(np.float64), columns=columns)
+
+            # the values for the same date (of the same level) are averaged
+            if df.index.has_duplicates:
+                df = df.groupby(level=0).mean()
+
+            df.sort_index(inplace=True)
+            frames.append(df)
+
+    return pd.concat(frames, axis=1)
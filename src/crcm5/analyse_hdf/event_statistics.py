@@ -0,0 +1,258 @@
+import numpy as np
+import tables as tb
+
+__author__ = 'huziy'
+
+
+# Statistics of events (runs of consecutive time steps where a condition holds, i.e. rain events)
+# for each grid cell of the fields stored in the hdf tables.
+# The time series are processed in chunks (i.e. year by year), events crossing the chunk boundaries are handled.
+
+
+def read_sorted_fields_for_year(the_table, year, level_index=0, selection=None):
+    """
+    Read the fields for the year from the table and sort them by date
+    :param the_table: tb.Table with the columns year, month, day, hour, minute, second, level_index and field
+    :param year:
+    :param level_index:
+    :param selection: crcm5.analyse_hdf.rain_duration_distr_for_region.Selection, if not None the fields are subset
+    :return: the array of the dates (numpy.datetime64) and the 3d array of the fields (time, x, y)
+    """
+    query = "(year == {}) & (level_index == {})".format(year, level_index)
+    return read_sorted_fields_where(the_table, query, selection=selection)
+
+
+def read_sorted_fields_where(the_table, query, selection=None):
+    """
+    Read the fields satisfying the query from the table and sort them by date
+    :return: the array of the dates (numpy.datetime64) and the 3d array of the fields (time, x, y)
+    """
+    assert isinstance(the_table, tb.Table)
+
+    rows = the_table.read_where(query)
+
+    dates = rows_to_datetime64(rows)
+    order = np.argsort(dates, kind="mergesort")
+
+    data = rows["field"][order]
+    if selection is not None:
+        i0, j0 = selection.ll_indices()
+        i1, j1 = selection.ur_indices()
+        data = data[:, i0:i1 + 1, j0:j1 + 1]
+
+    return dates[order], data
+
+
+def rows_to_datetime64(rows):
+    """
+    Vectorized conversion of the date columns of a structured array to numpy.datetime64
+    """
+    months_since_epoch = (rows["year"].astype(np.int64) - 1970) * 12 + rows["month"] - 1
+    result = months_since_epoch.astype("datetime64[M]").astype("datetime64[s]")
+    result += (rows["day"].astype(np.int64) - 1).astype("timedelta64[D]").astype("timedelta64[s]")
+
+    for col, unit in [("hour", "h"), ("minute", "m"), ("second", "s")]:
+        if col in rows.dtype.names:
+            result += rows[col].astype("timedelta64[{}]".format(unit)).astype("timedelta64[s]")
+    return result
+
+
+def get_events(condition, covariables=None, skip_first_steps=0):
+    """
+    Run-length encoding of the condition along the time axis (axis 0) for each grid cell.
+    The events touching the ends of the time axis are included.
+
+    :param condition: boolean array (time, ...)
+    :param covariables: list of arrays of the same shape as condition, accumulated over each event
+    :param skip_first_steps: the first skip_first_steps time steps of each event are not accumulated
+    :return: cell (flat index of the grid cell), start, end (exclusive) time indices of the events,
+            and the list of the accumulated covariables for each event
+    """
+    nt = condition.shape[0]
+    # (cell, time), so the events are ordered by cell and then by time
+    cond2d = condition.reshape((nt, -1)).T
+
+    padded = np.zeros((cond2d.shape[0], nt + 2), dtype=np.int8)
+    padded[:, 1:-1] = cond2d
+    d = np.diff(padded, axis=1)
+
+    cell, start = np.nonzero(d == 1)
+    _, end = np.nonzero(d == -1)
+
+    acc = []
+    if covariables is not None:
+        for cv in covariables:
+            cs = np.zeros((cond2d.shape[0], nt + 1))
+            np.cumsum(cv.reshape((nt, -1)).T, axis=1, out=cs[:, 1:])
+            acc_start = np.minimum(start + skip_first_steps, end)
+            acc.append(cs[cell, end] - cs[cell, acc_start])
+
+    return cell, start, end, acc
+
+
+class EventStatisticsAccumulator(object):
+    """
+    Accumulates the statistics of the events (i.e. rain events) for each grid cell,
+    the data are fed in time-ordered chunks via update().
+    """
+
+    def __init__(self, field_shape, n_covariables=0, skip_first_steps=0, max_duration=None):
+        """
+        :param field_shape: shape of the 2d field
+        :param n_covariables: number of the variables to accumulate over the events
+        :param skip_first_steps: the first skip_first_steps time steps of each event are not accumulated
+        :param max_duration: the longer events are counted in the last bin of the duration histogram,
+            if None the histogram is extended as needed
+        """
+        self.field_shape = tuple(field_shape)
+        self.ncells = int(np.prod(self.field_shape))
+        self.n_covariables = n_covariables
+        self.skip_first_steps = skip_first_steps
+        self.max_duration = max_duration
+
+        # Events that are still going on at the end of the last chunk
+        self.current_duration = np.zeros(self.ncells, dtype=np.int64)
+        self.current_acc = np.zeros((n_covariables, self.ncells))
+
+        self.duration_max = np.zeros(self.ncells, dtype=np.int64)
+        self.duration_sum = np.zeros(self.ncells, dtype=np.int64)
+        self.event_count = np.zeros(self.ncells, dtype=np.int64)
+
+        # accumulated covariables during the longest events and during all events
+        self.acc_for_longest = np.zeros((n_covariables, self.ncells))
+        self.acc_total = np.zeros((n_covariables, self.ncells))
+
+        # duration_histogram[d] - number of events of duration d (in time steps)
+        self.duration_histogram = np.zeros(1 if max_duration is None else max_duration + 1, dtype=np.int64)
+
+    def update(self, condition, covariables=None):
+        """
+        :param condition: boolean array (time, nx, ny)
+        :param covariables: list of arrays (time, nx, ny)
+        """
+        covariables = [] if covariables is None else covariables
+        assert len(covariables) == self.n_covariables
+        nt = condition.shape[0]
+
+        cell, start, end, _ = get_events(condition)
+
+        # Events continuing the ones from the previous chunk
+        carried = (start == 0) & (self.current_duration[cell] > 0)
+        prev_duration = np.where(carried, self.current_duration[cell], 0)
+
+        # the steps of the event that should not be accumulated, some could have been skipped in the previous chunk
+        n_skip = np.maximum(self.skip_first_steps - prev_duration, 0)
+        acc = self._get_acc(covariables, cell, start, end, n_skip)
+
+        duration = end - start + prev_duration
+        acc = acc + np.where(carried, self.current_acc[:, cell], 0)
+
+        # The events from the previous chunk that are not continued have finished at the chunk boundary
+        not_continued = self.current_duration > 0
+        not_continued[cell[carried]] = False
+        cells_finished = np.where(not_continued)[0]
+        self._add_finished_events(cells_finished, self.current_duration[cells_finished],
+                                  self.current_acc[:, cells_finished])
+
+        # Events reaching the end of the chunk are not finished yet
+        is_open = end == nt
+        self.current_duration[:] = 0
+        self.current_acc[:] = 0
+        self.current_duration[cell[is_open]] = duration[is_open]
+        self.current_acc[:, cell[is_open]] = acc[:, is_open]
+
+        closed = ~is_open
+        self._add_finished_events(cell[closed], duration[closed], acc[:, closed])
+
+    def _get_acc(self, covariables, cell, start, end, n_skip):
+        acc_start = np.minimum(start + n_skip, end)
+        result = []
+        for cv in covariables:
+            nt = cv.shape[0]
+            cs = np.zeros((self.ncells, nt + 1))
+            np.cumsum(cv.reshape((nt, -1)).T, axis=1, out=cs[:, 1:])
+            result.append(cs[cell, end] - cs[cell, acc_start])
+        return np.array(result).reshape((self.n_covariables, len(cell)))
+
+    def _add_finished_events(self, cell, duration, acc):
+        if len(cell) == 0:
+            return
+
+        np.add.at(self.duration_sum, cell, duration)
+        np.add.at(self.event_count, cell, 1)
+        for k in range(self.n_covariables):
+            np.add.at(self.acc_total[k], cell, acc[k])
+
+        # The first of the longest events (in time) is retained for each cell
+        new_max = np.zeros(self.ncells, dtype=np.int64)
+        np.maximum.at(new_max, cell, duration)
+        longest = (duration == new_max[cell]) & (duration > self.duration_max[cell])
+        cells_longest, i_first = np.unique(cell[longest], return_index=True)
+        i_first = np.where(longest)[0][i_first]
+
+        self.duration_max[cells_longest] = duration[i_first]
+        self.acc_for_longest[:, cells_longest] = acc[:, i_first]
+
+        # Update the histogram of durations
+        if self.max_duration is not None:
+            duration = np.minimum(duration, self.max_duration)
+        counts = np.bincount(duration, minlength=len(self.duration_histogram))
+        if len(counts) > len(self.duration_histogram):
+            counts[:len(self.duration_histogram)] += self.duration_histogram
+            self.duration_histogram = counts
+        else:
+            self.duration_histogram += counts
+
+    def close_open_events(self):
+        """
+        Count the events still going on at the end of the last chunk as finished
+        """
+        cell = np.where(self.current_duration > 0)[0]
+        self._add_finished_events(cell, self.current_duration[cell], self.current_acc[:, cell])
+        self.current_duration[:] = 0
+        self.current_acc[:] = 0
+
+    def get_max_durations(self):
+        return self.duration_max.reshape(self.field_shape)
+
+    def get_mean_durations(self):
+        result = np.ma.masked_where(self.event_count == 0, self.duration_sum.astype(float))
+        return (result / np.where(self.event_count > 0, self.event_count, 1)).reshape(self.field_shape)
+
+    def get_event_counts(self):
+        return self.event_count.reshape(self.field_shape)
+
+    def get_acc_for_longest_events(self, index=0):
+        return self.acc_for_longest[index].reshape(self.field_shape)
+
+    def get_acc_total(self, index=0):
+        return self.acc_total[index].reshape(self.field_shape)
+
+
+def get_event_statistics_for_hdf(hdf_path, var_name="PR", level_index=0, start_year=None, end_year=None,
+                                 lower_limit=0.0, selection=None, months=None, max_duration=None):
+    """
+    Stream the field year by year and calculate the statistics of the events when field >= lower_limit
+    :param months: if not None, the condition is considered false outside of the months
+    :return: EventStatisticsAccumulator
+    """
+    accumulator = None
+    with tb.open_file(hdf_path) as h:
+        the_table = h.get_node("/{}".format(var_name))
+
+        for the_year in range(start_year, end_year + 1):
+            dates, data = read_sorted_fields_for_year(the_table, the_year, level_index=level_index,
+                                                      selection=selection)
+
+            if accumulator is None:
+                accumulator = EventStatisticsAccumulator(data.shape[1:], max_duration=max_duration)
+
+            condition = data >= lower_limit
+            if months is not None:
+                date_months = dates.astype("datetime64[M]").astype(int) % 12 + 1
+                condition &= np.isin(date_months, months)[:, np.newaxis, np.newaxis]
+
+            accumulator.update(condition)
+
+    accumulator.close_open_events()
+    return accumulator
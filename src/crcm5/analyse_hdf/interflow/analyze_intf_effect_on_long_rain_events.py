@@ -12,13 +12,12 @@ from matplotlib.gridspec import GridSpec
 __author__ = 'huziy'
 
 import tables as tb
-from datetime import datetime
-import pandas as pd
 import numpy as np
 
 import matplotlib.pyplot as plt
 
 import crcm5.analyse_hdf.do_analysis_using_pytables as analysis
+from crcm5.analyse_hdf.event_statistics import EventStatisticsAccumulator, read_sorted_fields_for_year
 
 from mpl_toolkits.basemap import maskoceans
 import ctypes
@@ -28,21 +27,6 @@ import ctypes
 #
 
 
-def get_pandas_panel(rows):
-    """
-
-    :param rows: iterable of dicts of the form:
-        {
-        "year":int, "month": int, "day": int, "hour":int, "minute":int, "second": int,
-        "field": 2D numpy array (nx, ny)
-        }
-    :return pd.Panel
-    """
-    date_keys = ["year", "month", "day", "hour", "minute", "second"]
-    return pd.Panel({datetime(*[row[k] for k in date_keys]): pd.DataFrame(row["field"])
-                     for row in rows})
-
-
 def get_longest_rain_event_durations_from_tables(pr, traf=None, t2m=None, pr_lower_lim=0.0):
     """
     Get maximum numbers of time steps where
@@ -51,38 +35,15 @@ def get_longest_rain_event_durations_from_tables(pr, traf=None, t2m=None, pr_low
     :param t2m: 2m air temperature in Celsius
     """
 
-    # durations of the longest and current rain events
-    durations_max = np.zeros(pr.shape[1:])
-    durations_current = np.zeros(pr.shape[1:])
-
-    acc_runoff_max = np.zeros(pr.shape[1:])
-    acc_runoff_current = np.zeros(pr.shape[1:])
-
-    # loop in time
-    for t in range(pr.shape[0]):
-        p = pr[t]
-        r = traf[t]
-
-        # Use 2m air temperature to distinguish between rain and snow (In my opinion this is more correct)
-        t2m_field = t2m[t]
-        is_it_raining_now = (p >= pr_lower_lim) & (t2m_field > 0)
-
-        durations_current[is_it_raining_now] += 1
-
-        to_update_runoff = is_it_raining_now & (durations_current > 2)
-        acc_runoff_current[to_update_runoff] += r[to_update_runoff]
-
-        update_duration_max = (~is_it_raining_now) & (durations_max < durations_current)
+    # Use 2m air temperature to distinguish between rain and snow (In my opinion this is more correct)
+    is_it_raining = (pr >= pr_lower_lim) & (t2m > 0)
 
-        # If the maximum duration should be updated somewhere
-        if np.any(update_duration_max):
-            durations_max[update_duration_max] = durations_current[update_duration_max]
-            acc_runoff_max[update_duration_max] = acc_runoff_current[update_duration_max]
+    # the runoff is accumulated starting from the third time step of an event,
+    # the events still going on at the end of the period are not counted
+    accumulator = EventStatisticsAccumulator(pr.shape[1:], n_covariables=1, skip_first_steps=2)
+    accumulator.update(is_it_raining, covariables=[traf])
 
-        durations_current[~is_it_raining_now] = 0
-        acc_runoff_current[~is_it_raining_now] = 0
-
-    return durations_max, acc_runoff_max
+    return accumulator.get_max_durations(), accumulator.get_acc_for_longest_events()
 
 
 def get_longest_rain_durations_for_files(intf_file="", no_intf_file="",
@@ -108,7 +69,7 @@ def get_longest_rain_durations_for_files(intf_file="", no_intf_file="",
     # os.remove(cache_file)
 
     if os.path.isfile(cache_file):
-        return pickle.load(open(cache_file))
+        return pickle.load(open(cache_file, "rb"))
 
     precip_lower_limit_m_per_s = precip_lower_limit_mm_per_day * (1.0e-3 / (60.0 * 60.0 * 24.0))
 
@@ -145,65 +106,31 @@ def get_longest_rain_durations_for_files(intf_file="", no_intf_file="",
         total_acc_runoff_intf = 0
         for the_year in range(start_year, end_year + 1):
             print("Start processing year: {}".format(the_year))
-            # we need level_index == 0 in both cases, so the query will be the same for
-            # runoff and precipitation
-            query = "(year == {}) & (level_index == 0)".format(the_year)
-
-            # Get data for a year into a pandas Panel.
-            coords = pr_table_no_intf.get_where_list(query)
-            pr_no_intf_panel = get_pandas_panel(pr_table_no_intf.read_coordinates(coords))
-            print(len(coords))
-
-            coords = pr_table_intf.get_where_list(query)
-            pr_intf_panel = get_pandas_panel(pr_table_intf.read_coordinates(coords))
-            print(len(coords))
-
-            coords = traf_table_no_intf.get_where_list(query)
-            traf_no_intf_panel = get_pandas_panel(traf_table_no_intf.read_coordinates(coords))
-            print(len(coords))
-
-            coords = traf_table_intf.get_where_list(query)
-            traf_intf_panel = get_pandas_panel(traf_table_intf.read_coordinates(coords))
-            print(len(coords))
-
-            coords = t2m_table_no_intf.get_where_list(query)
-            t2m_no_intf_panel = get_pandas_panel(t2m_table_no_intf.read_coordinates(coords))
-            print(len(coords))
-
-            coords = t2m_table_intf.get_where_list(query)
-            t2m_intf_panel = get_pandas_panel(t2m_table_intf.read_coordinates(coords))
-            print(len(coords))
-
-            # Sort by date
-            pr_no_intf_panel = pr_no_intf_panel.sort_index(axis="items")
-            pr_intf_panel = pr_intf_panel.sort_index(axis="items")
-
-            traf_no_intf_panel = traf_no_intf_panel.sort_index(axis="items")
-            traf_intf_panel = traf_intf_panel.sort_index(axis="items")
-
-            t2m_no_intf_panel = t2m_no_intf_panel.sort_index(axis="items")
-            t2m_intf_panel = t2m_intf_panel.sort_index(axis="items")
+            # we need level_index == 0 in both cases (the default)
+            # Get data for a year sorted by date
+            _, pr_no_intf = read_sorted_fields_for_year(pr_table_no_intf, the_year)
+            _, pr_intf = read_sorted_fields_for_year(pr_table_intf, the_year)
 
-            print("No intf panels: ")
-            print(pr_no_intf_panel)
+            _, traf_no_intf = read_sorted_fields_for_year(traf_table_no_intf, the_year)
+            _, traf_intf = read_sorted_fields_for_year(traf_table_intf, the_year)
 
-            print("With intf panels: ")
-            print(pr_intf_panel)
+            _, t2m_no_intf = read_sorted_fields_for_year(t2m_table_no_intf, the_year)
+            _, t2m_intf = read_sorted_fields_for_year(t2m_table_intf, the_year)
 
             # Get durations of the longest events during the year when no interflow is present
             max_durations_nointf, acc_runoff_nointf = get_longest_rain_event_durations_from_tables(
-                pr_no_intf_panel.values,
-                traf=traf_no_intf_panel.values,
-                t2m=t2m_no_intf_panel.values,
+                pr_no_intf,
+                traf=traf_no_intf,
+                t2m=t2m_no_intf,
                 pr_lower_lim=precip_lower_limit_m_per_s,
             )
             no_intf_all_max_durations.append(max_durations_nointf)
 
             # Get durations of the longest events during the year when interflow is present
             max_durations_intf, acc_runoff_intf = get_longest_rain_event_durations_from_tables(
-                pr_intf_panel.values,
-                traf=traf_intf_panel.values,
-                t2m=t2m_intf_panel.values,
+                pr_intf,
+                traf=traf_intf,
+                t2m=t2m_intf,
                 pr_lower_lim=precip_lower_limit_m_per_s,
             )
             intf_all_max_durations.append(max_durations_intf)
@@ -220,7 +147,7 @@ def get_longest_rain_durations_for_files(intf_file="", no_intf_file="",
     pickle.dump([no_intf_all_max_durations,
                  total_acc_runoff_nointf,
                  intf_all_max_durations,
-                 total_acc_runoff_intf], open(cache_file, "w"))
+                 total_acc_runoff_intf], open(cache_file, "wb"))
     return no_intf_all_max_durations, total_acc_runoff_nointf, intf_all_max_durations, total_acc_runoff_intf
 
 
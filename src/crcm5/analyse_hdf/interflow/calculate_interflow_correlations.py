@@ -16,7 +16,10 @@ from util import plot_utils
 __author__ = 'huziy'
 
 import crcm5.analyse_hdf.do_analysis_using_pytables as analysis
+from crcm5.analyse_hdf.event_statistics import read_sorted_fields_where
+from util.stat_helpers import StreamingCorrelation
 import numpy as np
+import tables as tb
 import matplotlib.pyplot as plt
 import crcm5.analyse_hdf.common_plot_params as cpp
 from crcm5 import crcm_constants
@@ -78,6 +81,74 @@ def calculate_correlation_field_for_climatology(start_year=None,
     return calculate_correlation(selfields1, selfields2), np.array(selfields1), np.array(selfields2)
 
 
+def calculate_correlation_field_for_raw_data(start_year=None,
+                                             end_year=None,
+                                             path1="",
+                                             varname1="",
+                                             level1=None,
+                                             path2="",
+                                             varname2="",
+                                             level2=None, months=None, lag=0):
+    """
+    Calculate correlations between the raw (not averaged) time series of the 2 variables.
+    The tables are read month by month and only the accumulated moments are kept in memory.
+
+    :param months: the months of the first variable to take into account
+    :param lag: in time steps, the first variable at t is correlated with the second at t + lag
+    :return: StreamingCorrelation object, (use get_correlation(), get_covariance() to get the fields)
+    """
+    if months is None:
+        months = list(range(1, 13))
+
+    assert lag >= 0
+
+    corr_accumulator = None
+
+    # Fields of the first variable (and the dates) waiting for the lagged values of the second variable
+    dates_tail, data1_tail = None, None
+
+    with tb.open_file(path1) as h1, tb.open_file(path2) as h2:
+        table1 = h1.get_node("/{}".format(varname1))
+        table2 = h2.get_node("/{}".format(varname2))
+
+        for the_year in range(start_year, end_year + 1):
+            for the_month in range(1, 13):
+
+                # The neighbouring months are needed for the lagged correlations
+                if the_month not in months and lag == 0:
+                    continue
+
+                query = "(year == {}) & (month == {}) & (level_index == {})"
+                dates1, data1 = read_sorted_fields_where(table1, query.format(the_year, the_month, level1))
+                dates2, data2 = read_sorted_fields_where(table2, query.format(the_year, the_month, level2))
+
+                # Take only the dates present in both tables
+                _, i1, i2 = np.intersect1d(dates1, dates2, assume_unique=True, return_indices=True)
+                dates1, data1, data2 = dates1[i1], data1[i1], data2[i2]
+
+                if lag > 0:
+                    if dates_tail is not None:
+                        dates1 = np.concatenate((dates_tail, dates1))
+                        data1 = np.concatenate((data1_tail, data1))
+
+                    # keep the fields which do not have their pairs yet
+                    dates_tail, data1_tail = dates1[-lag:], data1[-lag:]
+                    dates1, data1 = dates1[:-lag], data1[:-lag]
+                    data2 = data2[len(data2) - len(data1):]
+
+                if len(data1) == 0:
+                    continue
+
+                if corr_accumulator is None:
+                    corr_accumulator = StreamingCorrelation(data1.shape[1:])
+
+                date_months = dates1.astype("datetime64[M]").astype(int) % 12 + 1
+                selected = np.isin(date_months, months)
+                corr_accumulator.update(data1[selected], data2[selected])
+
+    return corr_accumulator
+
+
 def calculate_correlation_of_infiltration_rate_with(start_year=None,
                                                     end_year=None,
                                                     path_for_infiltration_data="",
@@ -0,0 +1,176 @@
+import hashlib
+import os
+import pickle
+from collections import OrderedDict
+
+import numpy as np
+import tables as tb
+
+__author__ = 'huziy'
+
+
+# Means of a variable over several seasons (groups of months) for each year, calculated in a single pass
+# over the hdf table with the fields (columns year, month, ..., level_index, field).
+# The seasons can wrap across the year boundary (i.e. DJF), in which case the season of a year starts in
+# that year (December 1980 - February 1981 is the DJF of 1980), and only complete seasons are considered.
+# The results are cached and recalculated when the hdf file or the definition of the seasons change.
+
+
+def get_season_start_month(months):
+    """
+    :param months: months of the season
+    :return: the first month of the season, for the seasons wrapping across the year boundary
+        it is the first month of the run of the months ending in December (12 for DJF)
+    """
+    months = sorted(set(months))
+    if len(months) == 12:
+        return 1
+
+    if 12 in months and 1 in months:
+        start = 12
+        while start - 1 in months:
+            start -= 1
+        return start
+
+    return months[0]
+
+
+def get_season_years(years, months, start_month):
+    """
+    The year of the season for each time step: the months before the start month belong
+    to the season of the previous year
+    """
+    return np.where(months >= start_month, years, years - 1)
+
+
+class MultiSeasonMeans(object):
+    def __init__(self, season_to_months, start_year, end_year, level_indices, field_shape):
+        """
+        :param season_to_months: OrderedDict {season name: list of months}
+        :param level_indices: the level indices in the result (the values of the level_index column)
+        """
+        self.season_to_months = OrderedDict((s, sorted(m)) for s, m in season_to_months.items())
+        self.seasons = list(self.season_to_months)
+        self.start_year = start_year
+        self.end_year = end_year
+        self.years = np.arange(start_year, end_year + 1)
+        self.level_indices = np.asarray(level_indices)
+
+        # the seasons wrapping across the year boundary are not complete for the end_year
+        self.start_months = [get_season_start_month(m) for m in self.season_to_months.values()]
+        self.last_years = [end_year - 1 if sm > min(m) else end_year
+                           for sm, m in zip(self.start_months, self.season_to_months.values())]
+
+        shape = (len(self.seasons), len(self.years), len(self.level_indices))
+        self.sums = np.zeros(shape + tuple(field_shape))
+        self.counts = np.zeros(shape, dtype=np.int64)
+
+    def update(self, rows):
+        """
+        Accumulate the rows of the table
+        :param rows: structured array with the columns year, month, level_index and field
+        """
+        nlevels = len(self.level_indices)
+        li = np.searchsorted(self.level_indices, rows["level_index"])
+        known_level = (li < nlevels) & (self.level_indices[np.minimum(li, nlevels - 1)] == rows["level_index"])
+
+        fields = None
+        for s, months in enumerate(self.season_to_months.values()):
+            sel = known_level & np.isin(rows["month"], months)
+            season_years = get_season_years(rows["year"], rows["month"], self.start_months[s])
+            sel &= (season_years >= self.start_year) & (season_years <= self.last_years[s])
+            if not np.any(sel):
+                continue
+
+            if fields is None:
+                fields = rows["field"]
+
+            keys = (season_years[sel] - self.start_year) * nlevels + li[sel]
+            self._accumulate(s, keys, fields[sel])
+
+    def _accumulate(self, s, keys, fields):
+        order = np.argsort(keys, kind="mergesort")
+        keys = keys[order]
+        starts = np.where(np.concatenate(([True], keys[1:] != keys[:-1])))[0]
+
+        the_sums = self.sums[s].reshape((-1,) + self.sums.shape[3:])
+        the_counts = self.counts[s].reshape(-1)
+
+        the_sums[keys[starts]] += np.add.reduceat(fields[order].astype(np.float64), starts, axis=0)
+        the_counts[keys[starts]] += np.diff(np.append(starts, len(keys)))
+
+    def get_means(self, season, level_index=None):
+        """
+        :param level_index: if None, all the levels are averaged together
+        :return: (years, means): the years of the complete seasons, masked array (year, nx, ny)
+        """
+        s = self.seasons.index(season)
+        nyears = self.last_years[s] - self.start_year + 1
+
+        if level_index is None:
+            sums, counts = self.sums[s, :nyears].sum(axis=1), self.counts[s, :nyears].sum(axis=1)
+        else:
+            li = list(self.level_indices).index(level_index)
+            sums, counts = self.sums[s, :nyears, li], self.counts[s, :nyears, li]
+
+        counts_bc = counts.reshape(counts.shape + (1,) * (sums.ndim - 1))
+        means = np.ma.masked_where(np.broadcast_to(counts_bc == 0, sums.shape), sums)
+        return self.years[:nyears], means / np.where(counts_bc > 0, counts_bc, 1)
+
+
+def _get_cache_path(path_to_hdf, var_name, key):
+    key_hash = hashlib.sha1(repr(key).encode()).hexdigest()
+    return os.path.join("{}.cache".format(path_to_hdf), "multi_season_means", var_name, "{}.bin".format(key_hash))
+
+
+def get_multi_season_means(path_to_hdf="", var_name="", season_to_months=None, start_year=None, end_year=None,
+                           level=None, rows_per_chunk=500, use_cache=True):
+    """
+    Read the table once and calculate the means for all the seasons and years
+    :param season_to_months: OrderedDict {season name: list of months}
+    :param level: level_index to consider, all the levels are considered if None
+    :param rows_per_chunk: number of rows (fields) read at once
+    :return: MultiSeasonMeans
+    """
+    season_to_months = OrderedDict((s, sorted(m)) for s, m in season_to_months.items())
+
+    with tb.open_file(path_to_hdf) as h:
+        var_table = h.get_node("/", var_name)
+
+        key = (os.path.getmtime(path_to_hdf), var_table.nrows, var_name, list(season_to_months.items()),
+               start_year, end_year, level)
+        cache_path = _get_cache_path(path_to_hdf, var_name, key)
+
+        if use_cache and os.path.isfile(cache_path):
+            with open(cache_path, "rb") as f:
+                saved = pickle.load(f)
+            if saved["key"] == key:
+                return saved["result"]
+
+        level_indices = np.unique(var_table.col("level_index")) if level is None else [level]
+
+        all_months = sorted(set(m for months in season_to_months.values() for m in months))
+        query = "(year >= {}) & (year <= {}) & ({})".format(
+            start_year, end_year, " | ".join(["(month == {})".format(m) for m in all_months]))
+        if level is not None:
+            query += " & (level_index == {})".format(level)
+
+        coords = var_table.get_where_list(query, sort=True)
+        print("{}: {} rows for {} seasons".format(var_name, len(coords), len(season_to_months)))
+
+        result = MultiSeasonMeans(season_to_months, start_year, end_year, level_indices,
+                                  var_table.coldescrs["field"].shape)
+
+        for i0 in range(0, len(coords), rows_per_chunk):
+            result.update(var_table.read_coordinates(coords[i0:i0 + rows_per_chunk]))
+
+    if use_cache:
+        cache_folder = os.path.dirname(cache_path)
+        if not os.path.isdir(cache_folder):
+            os.makedirs(cache_folder)
+
+        with open(cache_path + ".tmp", "wb") as f:
+            pickle.dump(dict(key=key, result=result), f)
+        os.rename(cache_path + ".tmp", cache_path)
+
+    return result
@@ -42,15 +42,29 @@ class Period(object):
     nyears = property(fget=get_nyears)
 
 
-def get_duration_to_occurences_array(data_path, period=None, selection=None):
+def get_duration_to_occurences_array(data_path, period=None, selection=None, pr_lower_limit_mm_per_day=5):
+    """
+    :param data_path: path to the hdf file
+    :param period:
+    :param selection:
+    :param pr_lower_limit_mm_per_day: the precipitation below the limit is considered to be 0
+    :return: durations (in time steps) and the corresponding mean annual numbers of events in the region
+    """
+    from crcm5.analyse_hdf.event_statistics import get_event_statistics_for_hdf
 
     assert isinstance(selection, Selection)
     assert isinstance(period, Period)
 
+    pr_lower_limit_m_per_s = pr_lower_limit_mm_per_day * 1.0e-3 / (60.0 * 60.0 * 24.0)
 
+    event_stats = get_event_statistics_for_hdf(data_path, var_name="PR", level_index=0,
+                                               start_year=period.start_year, end_year=period.end_year,
+                                               lower_limit=pr_lower_limit_m_per_s, selection=selection,
+                                               months=period.month_list)
 
-
-
+    occurences = event_stats.duration_histogram[1:] / float(period.nyears)
+    durations = np.arange(1, len(occurences) + 1)
+    return durations, occurences
 
 
 def main():
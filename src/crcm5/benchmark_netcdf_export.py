@@ -0,0 +1,60 @@
+import os
+import resource
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from crcm5.netcdf_stream_writer import StreamingNetcdfWriter, DailyMeanAggregator
+
+__author__ = 'huziy'
+
+
+# Export of the daily means of a synthetic 30-year 3-hourly simulation to netcdf with the streaming writer:
+# throughput and peak resident memory, compared with the size of the daily mean cube that had to be
+# kept in memory before.
+
+
+def _get_peak_rss_mb():
+    # ru_maxrss is in kilobytes on linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+def main(nx=180, ny=172, nlevels=1, n_years=30, dt_hours=3, chunk_time_steps=10, complevel=1):
+    lons2d, lats2d = np.meshgrid(np.linspace(-100, -50, nx), np.linspace(35, 65, ny), indexing="ij")
+    levels = list(range(nlevels))
+
+    start = datetime(1981, 1, 1)
+    nt = int((datetime(1981 + n_years, 1, 1) - start).total_seconds() // (dt_hours * 3600))
+
+    # the record of the day is perturbed with noise, so the compression does not make it trivial
+    base_field = np.sin(np.radians(lons2d)) * np.cos(np.radians(lats2d))
+    random_state = np.random.RandomState(1)
+
+    path = os.path.join(tempfile.mkdtemp(), "synthetic_daily.nc")
+    rss_before = _get_peak_rss_mb()
+    t0 = time.perf_counter()
+    with StreamingNetcdfWriter(path=path, var_name="TT", lons2d=lons2d, lats2d=lats2d, levels=levels,
+                               start_date=start, chunk_time_steps=chunk_time_steps, complevel=complevel) as writer:
+        aggregator = DailyMeanAggregator(writer.append)
+        for i in range(nt):
+            field = base_field + 0.01 * random_state.rand(nx, ny)
+            aggregator.add(start + timedelta(hours=dt_hours * i), np.array([field] * nlevels))
+        aggregator.flush()
+    n_days = writer.n_written
+    elapsed = time.perf_counter() - t0
+
+    input_mb = nt * nlevels * nx * ny * 8 / 1024.0 ** 2
+    cube_mb = n_days * nlevels * nx * ny * 8 / 1024.0 ** 2
+    print("{} records ({:.0f} MB) -> {} daily means in {:.1f} s".format(nt, input_mb, n_days, elapsed))
+    print("Throughput: {:.0f} records/s, {:.1f} MB/s of input".format(nt / elapsed, input_mb / elapsed))
+    print("Output file: {:.0f} MB".format(os.path.getsize(path) / 1024.0 ** 2))
+    print("Peak RSS: {:.0f} MB (before the export: {:.0f} MB), the daily mean cube in memory: {:.0f} MB".format(
+        _get_peak_rss_mb(), rss_before, cube_mb))
+
+    os.remove(path)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from crcm5.point_series_store import build_point_series_store, get_blocks_from_dicts
+
+__author__ = 'huziy'
+
+
+# Timing of the clicks of TimeseriesPlotter on a synthetic 20-year daily record:
+# the point series and the upstream sums are taken from the {date: field} dictionaries (as before)
+# and from the cell-major point series store.
+
+
+def _get_synthetic_flow_directions(nx, ny):
+    # all the rivers flow towards larger i, so there are no loops
+    np.random.seed(1)
+    return np.random.choice([1, 2, 128], size=(nx, ny))
+
+
+def main(nx=80, ny=80, n_years=20, n_clicks=20):
+    dates = [datetime(1981, 1, 1) + timedelta(days=i) for i in range(365 * n_years)]
+    print("{} daily time steps on a {}x{} grid".format(len(dates), nx, ny))
+
+    flow_directions = _get_synthetic_flow_directions(nx, ny)
+    date_to_stfl = {d: np.random.rand(nx, ny) for d in dates}
+    date_to_traf = {d: np.random.rand(nx, ny) for d in dates}
+
+    t0 = time.perf_counter()
+    store = build_point_series_store(tempfile.mkdtemp(), flow_directions, dates,
+                                     {"STFL": get_blocks_from_dicts(date_to_stfl, dates),
+                                      "TRAF": get_blocks_from_dicts(date_to_traf, dates)},
+                                     upstream_sum_names=["TRAF"])
+    print("Building the store: {:.2f} s".format(time.perf_counter() - t0))
+
+    points = [(nx - 1, j) for j in np.random.randint(0, ny, n_clicks)]
+
+    # clicks using the dictionaries of fields (the upstream mask is taken from the store for both)
+    t0 = time.perf_counter()
+    for i, j in points:
+        mask = store.get_upstream_mask(i, j)
+        stfl = [date_to_stfl[d][i, j] for d in dates]
+        traf = [np.sum(date_to_traf[d][mask == 1]) for d in dates]
+    t_dicts = (time.perf_counter() - t0) / n_clicks
+
+    t0 = time.perf_counter()
+    for i, j in points:
+        stfl_store = store.get_series("STFL", i, j)
+        traf_store = store.get_upstream_sum("TRAF", i, j)
+    t_store = (time.perf_counter() - t0) / n_clicks
+
+    assert np.allclose(stfl, stfl_store, rtol=1e-6) and np.allclose(traf, traf_store, rtol=1e-5)
+
+    print("Time per click, dictionaries of fields: {:.4f} s".format(t_dicts))
+    print("Time per click, point series store: {:.4f} s".format(t_store))
+
+
+if __name__ == '__main__':
+    main()
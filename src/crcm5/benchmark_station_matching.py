@@ -0,0 +1,117 @@
+import os
+import sqlite3
+import time
+
+import numpy as np
+from scipy.spatial import cKDTree
+
+from crcm5.station_matching import get_station_coordinates, match_stations_to_grid
+from data.cehq_station import Station, read_station_data
+from util.geo import lat_lon
+
+__author__ = 'huziy'
+
+
+# Matching of the complete HYDAT and CEHQ station lists to a 0.1 deg grid over North America:
+# one station at a time (the previous Crcm5ModelDataManager._get_model_indices_for_stfl_station)
+# and all the stations in one batch.
+# The accumulation areas of the grid are synthetic, only the station positions and drainage areas are real.
+
+HYDAT_DB_PATH = "/home/huziy/skynet3_rech1/hydat_db/Hydat.sqlite"
+CEHQ_DATA_FOLDER = "data/cehq_measure_data"
+
+
+def _read_hydat_station_list(path=HYDAT_DB_PATH):
+    """
+    All the HYDAT stations with known drainage areas (only the metadata, no data)
+    """
+    connect = sqlite3.connect(path)
+    try:
+        rows = connect.execute("SELECT STATION_NUMBER, LONGITUDE, LATITUDE, DRAINAGE_AREA_GROSS FROM STATIONS "
+                               "WHERE DRAINAGE_AREA_GROSS > 0;").fetchall()
+    finally:
+        connect.close()
+
+    stations = []
+    for st_id, lon, lat, da in rows:
+        s = Station(st_id=st_id, lon=lon, lat=lat)
+        s.drainage_km2 = da
+        stations.append(s)
+    return stations
+
+
+def _get_synthetic_station_list(n, seed=1):
+    random_state = np.random.RandomState(seed)
+    stations = []
+    for k in range(n):
+        s = Station(st_id=str(k), lon=random_state.uniform(-140, -55), lat=random_state.uniform(42, 70))
+        s.drainage_km2 = 10 ** random_state.uniform(1, 5)
+        stations.append(s)
+    return stations
+
+
+def _match_one_station_previous(kdtree, accumulation_area_km2, station, nneighbours=4):
+    x0 = lat_lon.lon_lat_to_cartesian(station.longitude, station.latitude)
+    [distances, indices] = kdtree.query(x0, k=nneighbours)
+
+    acc_area_1d = accumulation_area_km2.flatten()
+    da_diff = np.abs(acc_area_1d[indices] - station.drainage_km2) / station.drainage_km2
+    if np.min(da_diff) > 0.15:
+        return -1, -1
+
+    obj_func = da_diff + distances / np.max(distances)
+    min_obj_func = np.min(obj_func[(acc_area_1d[indices] > 0) & (da_diff < 0.15)])
+    select_index = indices[np.where(min_obj_func == obj_func)[0][0]]
+
+    acc_area_1d[:select_index] = -1
+    acc_area_1d[select_index + 1:] = -1
+    [i, j] = np.where(np.reshape(acc_area_1d, accumulation_area_km2.shape) >= 0)
+    return i[0], j[0]
+
+
+def main(hydat_db_path=HYDAT_DB_PATH, cehq_folder=CEHQ_DATA_FOLDER, dx=0.1, n_previous=500):
+    stations = []
+    if os.path.isfile(hydat_db_path):
+        stations += _read_hydat_station_list(hydat_db_path)
+    else:
+        print("{} is not found, using 8000 synthetic stations instead of HYDAT".format(hydat_db_path))
+        stations += _get_synthetic_station_list(8000)
+
+    if os.path.isdir(cehq_folder):
+        stations += [s for s in read_station_data(folder=cehq_folder, only_natural=False,
+                                                  min_number_of_complete_years=-1) if s.drainage_km2]
+    else:
+        print("{} is not found, the CEHQ stations are not considered".format(cehq_folder))
+
+    lons, lats, drainage = get_station_coordinates(stations)
+    lons1d = np.arange(lons.min() - 1, lons.max() + 1, dx)
+    lats1d = np.arange(lats.min() - 1, lats.max() + 1, dx)
+    lons2d, lats2d = np.meshgrid(lons1d, lats1d, indexing="ij")
+
+    # synthetic drainage areas, so that most of the stations have some candidate cells
+    acc_area = 10 ** np.random.RandomState(2).uniform(1, 5, size=lons2d.shape)
+    print("{} stations, grid {}x{}".format(len(stations), *lons2d.shape))
+
+    t0 = time.perf_counter()
+    kdtree = cKDTree(np.column_stack(lat_lon.lon_lat_to_cartesian(lons2d.flatten(), lats2d.flatten())))
+    print("Building the kdtree: {:.2f} s".format(time.perf_counter() - t0))
+
+    t0 = time.perf_counter()
+    matches = match_stations_to_grid(kdtree, acc_area, lons, lats, drainage, nneighbours=16)
+    t_batch = time.perf_counter() - t0
+
+    # the previous approach is timed on the first n_previous stations
+    n_previous = min(n_previous, len(stations))
+    t0 = time.perf_counter()
+    previous = [_match_one_station_previous(kdtree, acc_area, s, nneighbours=16) for s in stations[:n_previous]]
+    t_previous = (time.perf_counter() - t0) * len(stations) / float(n_previous)
+
+    assert all((i, j) == (mi, mj) for (i, j), mi, mj in zip(previous, matches.ix, matches.jy))
+
+    print("Matched {} of {} stations".format(np.sum(matches.ix >= 0), len(stations)))
+    print("One station at a time (estimated from {} stations): {:.2f} s".format(n_previous, t_previous))
+    print("All the stations in one batch: {:.3f} s".format(t_batch))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,5 +1,9 @@
+import os
+
 from netCDF4 import Dataset
 from crcm5.model_data import Crcm5ModelDataManager
+from crcm5.point_series_store import PointSeriesStore, build_point_series_store, get_blocks_from_dicts, \
+    INDEX_FILE
 from crcm5.timeseries_plotter import TimeseriesPlotter
 from rpn import level_kinds
 from rpn.rpn import RPN
@@ -77,6 +81,20 @@ def main():
 
 
 
+    # cell-major store of the series for the plots on click, built on the first run
+    point_store_folder = path + ".point_store"
+    if os.path.isfile(os.path.join(point_store_folder, INDEX_FILE)):
+        point_store = PointSeriesStore(point_store_folder)
+    else:
+        dates = sorted(allStfl.keys())
+        time_dependent_names = ["TRAF", "TDRA", "PR", "I5", "STFL", "SWSR", "SWSL", "UPIN", "SWST"]
+        point_store = build_point_series_store(
+            point_store_folder, manager.cell_manager.flow_directions, dates,
+            {name: get_blocks_from_dicts(allData[name], dates) for name in time_dependent_names},
+            upstream_sum_names=["TRAF", "TDRA", "PR", "I5"])
+
+
+
     #read in slope and channel length from the geophysics file
     r = RPN("/home/huziy/skynet3_rech1/geof_lake_infl_exp/geophys_Quebec_0.1deg_260x260_with_dd_v6")
 
@@ -113,7 +131,7 @@ def main():
 
     ax = plt.gca()
     TimeseriesPlotter(name_to_date_to_field = allData, basemap = basemap, lons2d=lon, lats2d= lat,
-        ax = ax, cell_manager = manager.cell_manager, data_manager=manager)
+        ax = ax, cell_manager = manager.cell_manager, data_manager=manager, point_store=point_store)
 
 
 
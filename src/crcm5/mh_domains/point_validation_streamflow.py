@@ -12,6 +12,7 @@ from crcm5.mh_domains import default_domains
 import data.cehq_station as cehq_station
 from crcm5.mh_domains.point_validation_streamflow_from_2cols_per_station import get_model_data
 from crcm5.model_point import ModelPoint
+from crcm5.streamflow_validation_store import StreamflowValidationStore
 from data.cell_manager import CellManager
 import matplotlib.pyplot as plt
 import pandas as pd
@@ -83,7 +84,9 @@ def main():
 
     station_to_modelled_data = get_model_data(station_to_model_point, output_path=model_data_path,
                                               grid_config=gc, basins_of_interest_shp=default_domains.MH_BASINS_PATH,
-                                              cell_manager=cell_manager, vname="STFL")
+                                              cell_manager=cell_manager, vname="STFL",
+                                              validation_store=StreamflowValidationStore(
+                                                  folder=img_folder.joinpath("validation_store")))
 
     modelled_data = station_to_modelled_data[station]
 
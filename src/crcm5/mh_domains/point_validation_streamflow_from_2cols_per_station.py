@@ -1,5 +1,6 @@
 import calendar
 import glob
+import hashlib
 import re
 from datetime import datetime
 
@@ -12,6 +13,8 @@ from rpn.rpn_multi import MultiRPN
 from application_properties import main_decorator
 from crcm5.mh_domains import default_domains
 import data.cehq_station as cehq_station
+from crcm5.streamflow_validation_store import StreamflowValidationStore, get_files_signature, \
+    get_station_signature, build_station_validation
 from crcm5.model_point import ModelPoint
 from data.cell_manager import CellManager
 import matplotlib.pyplot as plt
@@ -25,7 +28,12 @@ img_folder = Path("mh")
 
 
 def get_model_data(station_to_model_point, output_path=None, grid_config=None, basins_of_interest_shp="",
-                   cell_manager=None, vname=None):
+                   cell_manager=None, vname=None, validation_store=None):
+    """
+    :param validation_store: StreamflowValidationStore, if not None, the upstream masks and the model series
+        are saved to it and the model files are read only for the stations missing from the store
+        (or if the model files or the matched cells have changed)
+    """
     lons, lats, bmp = None, None, None
     data_mask = None
 
@@ -39,12 +47,32 @@ def get_model_data(station_to_model_point, output_path=None, grid_config=None, b
     pattern = re.compile(".*" + 8 * "0" + ".*")
 
     flist = [f for f in glob.glob(str(output_path.joinpath("*").joinpath(fname_pattern))) if pattern.match(f) is None]
-    r = MultiRPN(flist)
 
-    date_to_field = r.get_all_time_records_for_name_and_level(varname=vname)
-    lons, lats = r.get_longitudes_and_latitudes_of_the_last_read_rec()
-
-    r.close()
+    model_signature = dict(files=get_files_signature(flist), vname=vname)
+
+    def _get_signature(the_model_point):
+        return dict(model=model_signature, ix=int(the_model_point.ix), jy=int(the_model_point.jy))
+
+    station_to_cached = {}
+    if validation_store is not None:
+        for station, model_point in station_to_model_point.items():
+            cached = validation_store.load(str(output_path), "{}.model".format(station.id),
+                                           _get_signature(model_point))
+            if cached is not None:
+                station_to_cached[station] = cached
+
+    date_to_field = {}
+    if len(station_to_cached) < len(station_to_model_point):
+        r = MultiRPN(flist)
+        date_to_field = r.get_all_time_records_for_name_and_level(varname=vname)
+        lons, lats = r.get_longitudes_and_latitudes_of_the_last_read_rec()
+        r.close()
+    else:
+        # only the coordinates are needed
+        r = RPN(flist[0])
+        r.get_first_record_for_name(vname)
+        lons, lats = r.get_longitudes_and_latitudes_for_the_last_read_rec()
+        r.close()
 
     # get the basemap object
     bmp, data_mask = grid_config.get_basemap_using_shape_with_polygons_of_interest(
@@ -54,13 +82,27 @@ def get_model_data(station_to_model_point, output_path=None, grid_config=None, b
 
     stations_to_ignore = []
 
+    sorted_dates = sorted(date_to_field.keys())
+
     for station, model_point in station_to_model_point.items():
         assert isinstance(model_point, ModelPoint)
         assert isinstance(cell_manager, CellManager)
         assert isinstance(station, cehq_station.Station)
 
-        upstream_mask = cell_manager.get_mask_of_upstream_cells_connected_with_by_indices(model_point.ix,
-                                                                                          model_point.jy)
+        cached = station_to_cached.get(station)
+        if cached is None:
+            upstream_mask = cell_manager.get_mask_of_upstream_cells_connected_with_by_indices(model_point.ix,
+                                                                                              model_point.jy)
+            cached = dict(upstream_mask=upstream_mask, dates=sorted_dates,
+                          values=np.array([date_to_field[d][model_point.ix, model_point.jy] for d in sorted_dates]))
+
+            if validation_store is not None:
+                validation_store.save(str(output_path), "{}.model".format(station.id), cached,
+                                      _get_signature(model_point))
+        else:
+            print("Using the model data for {} from the validation store.".format(station.id))
+
+        upstream_mask = cached["upstream_mask"]
 
         # Skip model points and staions with small number of gridcells upstream
         if upstream_mask.sum() <= 1:
@@ -75,29 +117,31 @@ def get_model_data(station_to_model_point, output_path=None, grid_config=None, b
             continue
 
         # Plot station position
-        fig = plt.figure()
+        position_img_file = img_folder.joinpath("{}_position_and_upstream.png".format(station.id))
+        if station not in station_to_cached or not position_img_file.exists():
+            fig = plt.figure()
 
-        ax = plt.gca()
+            ax = plt.gca()
 
-        lons1, lats1 = lons[upstream_mask > 0.5], lats[upstream_mask > 0.5]
-        x1, y1 = bmp(lons1, lats1)
+            lons1, lats1 = lons[upstream_mask > 0.5], lats[upstream_mask > 0.5]
+            x1, y1 = bmp(lons1, lats1)
 
-        bmp.drawrivers()
-        bmp.drawcoastlines(ax=ax)
-        bmp.drawcountries(ax=ax, linewidth=0.2)
-        bmp.drawstates(linewidth=0.1)
-        bmp.readshapefile(basins_of_interest_shp[:-4], "basin", linewidth=2, color="m")
+            bmp.drawrivers()
+            bmp.drawcoastlines(ax=ax)
+            bmp.drawcountries(ax=ax, linewidth=0.2)
+            bmp.drawstates(linewidth=0.1)
+            bmp.readshapefile(basins_of_interest_shp[:-4], "basin", linewidth=2, color="m")
 
-        bmp.scatter(x1, y1, c="g", s=100)
-        bmp.scatter(*bmp(lons[model_point.ix, model_point.jy], lats[model_point.ix, model_point.jy]), c="b", s=250)
+            bmp.scatter(x1, y1, c="g", s=100)
+            bmp.scatter(*bmp(lons[model_point.ix, model_point.jy], lats[model_point.ix, model_point.jy]),
+                        c="b", s=250)
 
-        fig.tight_layout()
-        plt.savefig(str(img_folder.joinpath("{}_position_and_upstream.png".format(station.id))), bbox_inche="tight")
-        plt.close(fig)
+            fig.tight_layout()
+            plt.savefig(str(position_img_file), bbox_inche="tight")
+            plt.close(fig)
 
 
-        res = pd.Series(index=sorted(date_to_field.keys()),
-                        data=[date_to_field[d][model_point.ix, model_point.jy] for d in sorted(date_to_field.keys())])
+        res = pd.Series(index=cached["dates"], data=cached["values"])
 
         # get monthly means
         res = res.groupby(lambda d: d.replace(day=15, hour=0)).mean()
@@ -119,8 +163,23 @@ def get_model_data(station_to_model_point, output_path=None, grid_config=None, b
     return station_to_model_data
 
 
+def _get_series_signature(series):
+    """
+    Hash of the dates and the values of the series
+    """
+    h = hashlib.sha1()
+    h.update(np.asarray(series.index.values).astype("datetime64[s]").tobytes())
+    h.update(np.ascontiguousarray(series.values, dtype=np.float64).tobytes())
+    return h.hexdigest()
+
+
 def plot_validations_for_stations(station_to_model_point=None, cell_manager=None, corrected_obs_data_folder=None,
-                                  model_data_path=None, grid_config=None, start_year=None, end_year=None):
+                                  model_data_path=None, grid_config=None, start_year=None, end_year=None,
+                                  validation_store=None):
+    """
+    :param validation_store: StreamflowValidationStore, where the model data and the validation results
+        (aligned monthly series, climatologies and scores) are kept between the runs
+    """
 
     assert isinstance(grid_config, GridConfig)
 
@@ -128,7 +187,8 @@ def plot_validations_for_stations(station_to_model_point=None, cell_manager=None
                                               output_path=model_data_path,
                                               grid_config=grid_config,
                                               basins_of_interest_shp=default_domains.MH_BASINS_PATH,
-                                              cell_manager=cell_manager, vname="STFL")
+                                              cell_manager=cell_manager, vname="STFL",
+                                              validation_store=validation_store)
 
     for station, model_point in station_to_model_point.items():
 
@@ -222,6 +282,28 @@ def plot_validations_for_stations(station_to_model_point=None, cell_manager=None
 
         modelled_data = modelled_data.select(date_selector)
 
+        # Scores of the monthly series (reused from the store if the obs and the model series have not changed)
+        obs_for_scores = obs_corrected if obs_corrected is not None else obs_not_corrected
+
+        def _compute_validation():
+            return build_station_validation(str(model_data_path), station.id, model_point,
+                                            upstream_mask=None,
+                                            obs_dates=obs_for_scores.index, obs_values=obs_for_scores.values,
+                                            mod_dates=modelled_data.index, mod_values=modelled_data.values,
+                                            freq="M")
+
+        if validation_store is None:
+            validation = _compute_validation()
+        else:
+            signature = dict(station=get_station_signature(station),
+                             corrected=None if corrected_obs_data_path is None
+                             else get_files_signature([corrected_obs_data_path]),
+                             model=_get_series_signature(modelled_data),
+                             ix=int(model_point.ix), jy=int(model_point.jy),
+                             start_year=start_year, end_year=end_year)
+            validation = validation_store.get_or_compute(str(model_data_path), station.id, signature,
+                                                         _compute_validation)
+
 
 
 
@@ -242,6 +324,7 @@ def plot_validations_for_stations(station_to_model_point=None, cell_manager=None
             obs_corrected.plot(label="obs corrected", ax=ax)
 
         ax.legend(loc="upper left")
+        ax.set_title("NS={ns:.2f}, r={corr:.2f}, bias={bias:.1f}".format(**validation.scores))
         img_file = img_folder.joinpath("{}_validation_monthly.png".format(station.id))
         fig.savefig(str(img_file))
         plt.close(fig)
@@ -367,11 +450,14 @@ def main():
     print("Established the station to model point mapping")
 
 
+    validation_store = StreamflowValidationStore(folder=img_folder.joinpath("validation_store"))
+
     plot_validations_for_stations(station_to_model_point,
                                   cell_manager=cell_manager,
                                   corrected_obs_data_folder=corrected_obs_data_folder,
                                   model_data_path=model_data_path,
-                                  grid_config=gc, start_year=start_year, end_year=end_year)
+                                  grid_config=gc, start_year=start_year, end_year=end_year,
+                                  validation_store=validation_store)
 
 
 if __name__ == '__main__':
@@ -1,11 +1,11 @@
 from datetime import datetime, timedelta
 import itertools
+from collections import OrderedDict
 from multiprocessing import Pool
-from netCDF4 import Dataset, date2num, num2date
+from netCDF4 import Dataset, num2date
 import pickle
 import shelve
 import time
-import errno
 
 import tables as tb
 from matplotlib import gridspec, cm
@@ -32,6 +32,9 @@ except ImportError as e:
 
 import application_properties
 from .model_point import ModelPoint
+from .rpn_record_catalog import RecordCatalog, get_year_month_selector, ALL_LEVELS
+from .station_matching import get_station_coordinates, match_stations_to_grid
+from .netcdf_stream_writer import StreamingNetcdfWriter, DailyMeanAggregator
 from data import cehq_station
 from data.cehq_station import Station
 from data.cell_manager import CellManager
@@ -120,6 +123,7 @@ class Crcm5ModelDataManager:
 
         self.name_to_date_to_field = {}
         self._flat_index_to_2d_cache = {}
+        self._folder_to_record_catalog = {}
 
         self.lon2d_rot = None
         self.lat2d_rot = None
@@ -741,107 +745,28 @@ class Crcm5ModelDataManager:
                                start_year=None, end_year=None):
         """
         Seasonal meanth over the specified months for each year
+        (see crcm5.analyse_hdf.multi_season_means for several seasons at once)
         :param path_to_hdf:
-        :param months:
+        :param months: the seasons wrapping across the year boundary (i.e. DJF) are assigned to the year
+            of their first month, only the complete seasons are returned
         :param var_name:
         :param start_year:
         :param end_year:
-
-        cache file:
-
-        "{}.cache/seasonal_means/{}/{}-{}/{}/level_{}/data.bin".format(
-            path_to_hdf, start_year, end_year, "-".join([str(m) for m in months]), level
-        )
         """
 
         months = list(range(1, 13)) if months is None else months
 
-        # check if cached data exist
-        cache_folder = "{}.cache/seasonal_means/{}/{}-{}/level_{}_{}".format(
-            path_to_hdf, var_name, start_year, end_year, level, "-".join([str(m) for m in sorted(months)])
-        )
-        cache_folder = os.path.realpath(cache_folder)
-
-        # check if the cache folder exists and create it if it does not
-        if not os.path.isdir(cache_folder):
-            try:
-                os.makedirs(cache_folder)
-            except OSError as oe:
-                if oe.errno != errno.EEXIST:
-                    raise oe
-
-        cache_file = os.path.join(cache_folder, "data.bin")
-        if os.path.isfile(cache_file):
-            return pickle.load(open(cache_file, "rb"), encoding="utf-8")
-
-
-        print("Reading data from: {}".format(path_to_hdf))
-
-        # Do the calculation and store results
-        with tb.open_file(path_to_hdf) as h:
-            var_table = h.get_node("/" + var_name)
-
-            def year_selector(arow):
-                # Use continuous DJF
-                if arow["month"] <= 2:
-                    if arow["year"] > start_year:
-                        return arow["year"] - 1
-                    else:
-                        # skip the first Jan and Feb
-                        return -1
-
-
-                # Skip the last december
-                if arow["month"] == 12 and arow["year"] == end_year:
-                    return -1
-
-
-
-                return arow["year"]
+        # single season case of the multi-season engine (cached)
+        from crcm5.analyse_hdf.multi_season_means import get_multi_season_means
+        season_means = get_multi_season_means(path_to_hdf=path_to_hdf, var_name=var_name,
+                                              season_to_months=OrderedDict([("season", months)]),
+                                              start_year=start_year, end_year=end_year, level=level)
 
-            # create index on date related columns if it is not created yet
-            # print "Start creation of indices"
+        years, result = season_means.get_means("season")
+        if np.ma.is_masked(result):
+            print("Warning: no data for some years in {}".format(path_to_hdf))
 
-            # if not var_table.cols.year.is_indexed:
-            # var_table.cols.year.create_index()
-            # print "created index on year column"
-
-            # if not var_table.cols.month.is_indexed:
-            # var_table.cols.month.create_index()
-            # print "created index on month column"
-
-            # var_table.cols.day.create_index()
-            # var_table.cols.hour.create_index()
-            # print "created indexes for all columns"
-
-            month_sel = "|".join(["(month == {0})".format(m) for m in months])
-            year_sel = "(year >= {0}) & (year <= {1})".format(start_year, end_year)
-            query = "({0}) & ({1})".format(year_sel, month_sel)
-            if level is not None:
-                query += "& (level_index == {0})".format(level)
-
-            year_to_mean = {}
-            year_to_counter = {}
-
-            print(query)
-            for the_year, rows_grouped_by_year in itertools.groupby(var_table.where(query), year_selector):
-                data = np.asarray([the_row["field"] for the_row in rows_grouped_by_year])
-
-                cur_mean = year_to_mean.get(the_year, 0)
-                cur_n = year_to_counter.get(the_year, 0)
-
-                year_to_mean[the_year] = (cur_mean * cur_n + data.sum(axis=0)) / float(cur_n + data.shape[0])
-                year_to_counter[the_year] = cur_n + data.shape[0]
-                print("current year is {0}".format(the_year))
-
-
-            current_last_year = end_year if len(set(months).intersection({1, 2})) > 0 else end_year + 1
-            result = np.asarray([year_to_mean[y] for y in range(start_year, current_last_year)])
-
-            print("Saving cache to: {}".format(cache_file))
-            pickle.dump(result, open(cache_file, "wb"))  # save calculated means for reuse
-            h.close()
-            return result
+        return np.ma.filled(result.astype(float), np.nan)
 
 
     @staticmethod
@@ -1142,79 +1067,61 @@ class Crcm5ModelDataManager:
         """
         return Timeseries object with values = sum(data[ti][mask == 1] * Area[mask == 1]) / sum(Area[mask == 1])
         """
-        day = timedelta(days=1)
         the_day = datetime(start_date.year, start_date.month, start_date.day)
+        ndays = (end_date - the_day).days + 1
 
         areas1d = areas2d[mask == 1]
-        areas_sum = np.sum(areas1d)
 
-        # read in the fields
-        data = {}
+        day_start = np.datetime64(the_day, "D")
+        sums = np.zeros(ndays)
+        counts = np.zeros(ndays)
         if self.all_files_in_one_folder:
-            for fPath in [os.path.join(self.samples_folder, x) for x in os.listdir(self.samples_folder)]:
-                fName = os.path.basename(fPath)
-                if not fName.startswith(self.file_name_prefix):
-                    continue
+            catalog = self._get_record_catalog(self.samples_folder, self.file_name_prefix)
 
-                rObj = RPN(fPath)
-                t_to_field = rObj.get_all_time_records_for_name_and_level(varname=var_name, level=level,
-                                                                          level_kind=level_kind)
-                for the_key in list(t_to_field.keys()):
-                    the_field = t_to_field[the_key]
-                    data[the_key] = np.sum(the_field[mask == 1] * areas1d)
-                rObj.close()
-                pass
+            def _selector(times):
+                day_indices = (times.astype("datetime64[D]") - day_start).astype(int)
+                return (day_indices >= 0) & (day_indices < ndays)
 
-        all_dates = list(data.keys())
-        times = []
-        values = []
-        while the_day <= end_date:
-            times.append(the_day)
-            sel_times = filter(lambda x: the_day.year == x.year and the_day.month == x.month and
-                                         the_day.day == x.day, all_dates)
-            sel_values = [data[key] for key in sel_times]
-            values.append(np.mean(sel_values))
-            the_day += day
+            for the_date, the_field in catalog.iter_fields(var_name, level=level, level_kind=level_kind,
+                                                           date_selector=_selector):
+                day_index = (np.datetime64(the_date, "D") - day_start).astype(int)
+                sums[day_index] += np.sum(the_field[mask == 1] * areas1d)
+                counts[day_index] += 1
+
+        times = [the_day + timedelta(days=i) for i in range(ndays)]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            values = sums / counts
 
         return TimeSeries(data=values, time=times)
 
+    def _get_record_catalog(self, folder, file_name_prefix):
+        """
+        The catalog of the records in the folder, the files of the catalogued variables are scanned only once
+        """
+        key = (folder, file_name_prefix)
+        if key not in self._folder_to_record_catalog:
+            self._folder_to_record_catalog[key] = RecordCatalog(folder=folder, file_name_prefix=file_name_prefix)
+        return self._folder_to_record_catalog[key]
+
 
     def _get_model_indices_for_stfl_station(self, station, nneighbours=4):
         """
         Selects a model point corresponding to the streamflow measuring station
         """
-        lon, lat = station.longitude, station.latitude
-        x0 = lat_lon.lon_lat_to_cartesian(lon, lat)
-
-        [distances, indices] = self.kdtree.query(x0, k=nneighbours)
-
-        acc_area_1d = self.accumulation_area_km2.flatten()
-
-        da_diff = np.abs(acc_area_1d[indices] - station.drainage_km2) / station.drainage_km2
+        match = self.get_model_indices_for_stfl_stations([station], nneighbours=nneighbours)[0]
+        if match.ix >= 0:
+            print("selected index {0}".format(match.flat_index))
+        return match.ix, match.jy
 
-        # don't look at the stations for which the accumulation area is too different
-        if np.min(da_diff) > 0.15:
-            return -1, -1
-
-        max_dist = np.max(distances)
-        obj_func = da_diff + distances / max_dist
-
-        min_obj_func = np.min(obj_func[(acc_area_1d[indices] > 0) & (da_diff < 0.15)])
-        index_of_sel_index = np.where(min_obj_func == obj_func)
-        select_index = indices[index_of_sel_index[0][0]]
-
-        print("selected index {0}".format(select_index))
-
-        # assert np.all(acc_area_1d >= 0)
-        acc_area_1d[:select_index] = -1
-        acc_area_1d[select_index + 1:] = -1
-
-        restored = np.reshape(acc_area_1d, self.accumulation_area_km2.shape)
-        [i, j] = np.where(restored >= 0)
-
-        if len(i) > 1:
-            print("Warning {0} candidate cells for the station {1}".format(len(i), station.id))
-        return i[0], j[0]
+    def get_model_indices_for_stfl_stations(self, station_list, nneighbours=4):
+        """
+        Select the model points corresponding to the streamflow measuring stations (one kdtree query for all)
+        :return: record array with the fields ix, jy, flat_index, acc_area_km2, da_diff, distance_m and score
+            (see crcm5.station_matching), ix = jy = -1 if the drainage areas are too different
+        """
+        lons, lats, drainage = get_station_coordinates(station_list)
+        return match_stations_to_grid(self.kdtree, self.accumulation_area_km2, lons, lats, drainage,
+                                      nneighbours=nneighbours)
 
 
     def _set_metadata(self, i, j):
@@ -1410,9 +1317,9 @@ class Crcm5ModelDataManager:
         ix_list = []
         jy_list = []
         station_to_cell_props = {}
-        for s in station_list:
+        matches = self.get_model_indices_for_stfl_stations(station_list, nneighbours=nneighbours)
+        for s, i, j in zip(station_list, matches.ix, matches.jy):
             assert isinstance(s, Station)
-            i, j = self._get_model_indices_for_stfl_station(s, nneighbours=nneighbours)
             ix_list.append(i)
             jy_list.append(j)
 
@@ -1539,104 +1446,61 @@ class Crcm5ModelDataManager:
                                             start_year=None, end_year=None):
 
         """
-        assumes that each file contains month of data
+        The mean of the monthly means over the years, the records outside of the years are not decoded
+        :return: {month index (0-11): 3d field (nx, ny, nz), levels sorted}
         """
-        filePaths = [os.path.join(self.samples_folder, name)
-                     for name in os.listdir(self.samples_folder)
-                     if name.startswith(file_name_prefix)]
-
-        month_to_means = {}
-
-        counts = np.zeros((12,))
+        catalog = self._get_record_catalog(self.samples_folder, file_name_prefix)
 
+        # sums and counts of the records for each (year, month)
+        ym_to_sum = {}
+        ym_to_count = {}
         levels = None
-        the_mean = None
-        for thePath in filePaths:
-            r = RPN(thePath)
-            r.suppress_log_messages()
-            data = r.get_4d_field(name=var_name)
-            r.close()
-
-
-            # #
-            dates_sorted = list(sorted(data.keys()))
-            the_month = dates_sorted[0].month
-
-            month_index = the_month - 1
-
-            the_year = dates_sorted[0].year
-
-            if start_year is not None:
-                if the_year < start_year:
-                    continue
-
-            if end_year is not None:
-                if the_year > end_year:
-                    continue
-
+        for the_date, level_to_field in catalog.iter_fields(var_name, level=ALL_LEVELS,
+                                                            date_selector=get_year_month_selector(start_year,
+                                                                                                  end_year)):
             if levels is None:
-                levels = list(sorted(list(data.items())[0][1].keys()))
-                nz = len(levels)
-                nx, ny = list(data.items())[0][1].items()[0][1].shape
-
-                the_mean = np.zeros((nx, ny, nz))
+                levels = list(sorted(level_to_field.keys()))
                 print("levels = {0}".format(",".join([str(lev) for lev in levels])))
 
-            # calculate mean 3d field for the month
-            for k, lev in enumerate(levels):
-                the_mean[:, :, k] = np.mean([fields[lev] for fields in list(data.values())], axis=0)
-
-
-            # Calculate mean
-            if counts[month_index] < 0.5:
-                month_to_means[month_index] = the_mean
+            the_field = np.dstack([level_to_field[lev] for lev in levels])
+            ym = (the_date.year, the_date.month)
+            if ym in ym_to_sum:
+                ym_to_sum[ym] += the_field
+                ym_to_count[ym] += 1
             else:
-                cur_mean = month_to_means[month_index]
-                month_to_means[month_index] = (cur_mean * counts[month_index] + the_mean) / (counts[month_index] + 1.0)
+                ym_to_sum[ym] = the_field.astype(np.float64)
+                ym_to_count[ym] = 1
 
-            counts[month_index] += 1
+        month_to_means = {}
+        for month_index in range(12):
+            monthly_means = [ym_to_sum[ym] / ym_to_count[ym] for ym in sorted(ym_to_sum) if ym[1] == month_index + 1]
+            if len(monthly_means):
+                month_to_means[month_index] = np.mean(monthly_means, axis=0)
 
         return month_to_means
 
 
     def get_mean_field(self, start_year, end_year, months=None, file_name_prefix="pm",
                        var_name="STFL", level=-1, level_kind=level_kinds.ARBITRARY):
+        """
+        Mean over the records of the years start_year..end_year and the months (all the months if None)
+        ValueError is raised if there are no such records
+        """
         if self.all_files_in_one_folder:
-            file_names = filter(lambda the_name: the_name.startswith(file_name_prefix),
-                                os.listdir(self.samples_folder))
-            file_names = list(file_names)
-            file_paths = [os.path.join(self.samples_folder, x) for x in file_names]
-
-            fields_list = []
-            for fPath in file_paths:
-                try:
-                    r_obj = RPN(fPath)
-                    r_obj.suppress_log_messages()
-                    data = r_obj.get_all_time_records_for_name_and_level(varname=var_name, level=level,
-                                                                         level_kind=level_kind)
-                    r_obj.close()
-                except Exception as e:
-                    print(e)
-                    continue
-
-                # Check date ranges in the file
-                tmin = min(data.keys())
-                tmax = max(data.keys())
-
-                # Check if year is in the range
-                if tmin.year > end_year or tmax.year < start_year:
-                    continue
+            catalog = self._get_record_catalog(self.samples_folder, file_name_prefix)
 
-                # Check if the month is in the range
-                if tmin.month not in months and tmax.month not in months:
-                    continue
+            the_sum = None
+            count = 0
+            for _, field in catalog.iter_fields(var_name, level=level, level_kind=level_kind,
+                                                date_selector=get_year_month_selector(start_year, end_year, months)):
+                the_sum = field.astype(np.float64) if the_sum is None else the_sum + field
+                count += 1
 
-                for t, field in data.items():
-                    if start_year <= t.year <= end_year:
-                        if t.month in months:
-                            fields_list.append(field)
+            if not count:
+                raise ValueError("No {} records for the years {}-{} and the months {} in {}".format(
+                    var_name, start_year, end_year, "all" if months is None else list(months), self.samples_folder))
 
-            return np.mean(fields_list, axis=0)
+            return the_sum / float(count)
         else:
             raise NotImplementedError(
                 "Need to implement the case of this data organization, or put all the data files to the same folder.")
@@ -1669,37 +1533,32 @@ class Crcm5ModelDataManager:
         if end_date is not None:
             end_year = end_date.year
 
-        field_list = []
-
         result = {}
         for m in months:
             result[m] = []
 
-        if self.all_files_in_one_folder:
-            for fName in os.listdir(self.samples_folder):
-                fPath = os.path.join(self.samples_folder, fName)
-                pass
-
         for the_year in range(start_year, end_year + 1):
             for the_month in months:
                 folder_name = self.month_folder_name_format % (self._month_folder_prefix, the_year, the_month)
-                folder_path = os.path.join(self.samples_folder, folder_name)
-                for file_name in os.listdir(folder_path):
-                    if file_name.startswith("."): continue
-                    if not file_name.startswith(file_name_prefix): continue
-                    file_path = os.path.join(folder_path, file_name)
-                    field_list.append(self._get_2d_field_from_file(path_to_file=file_path,
-                                                                   field_name=var_name, level=level,
-                                                                   level_kind=level_kind))
+                catalog = self._get_record_catalog(os.path.join(self.samples_folder, folder_name),
+                                                   file_name_prefix)
+
+                the_sum = None
+                count = 0
+                for _, field in catalog.iter_fields(var_name, level=level, level_kind=level_kind,
+                                                    date_selector=get_year_month_selector(the_year, the_year,
+                                                                                          [the_month])):
+                    the_sum = field.astype(np.float64) if the_sum is None else the_sum + field
+                    count += 1
 
                 # store mean field for the given month and year
-                result[the_month].append(np.mean(field_list, axis=0))
+                if count:
+                    result[the_month].append(the_sum / float(count))
 
         for m in months:
             result[m] = np.mean(result[m], axis=0)
 
         return result
-        pass
 
     def _get_2d_field_from_file(self, path_to_file="",
                                 field_name="STFL", level=-1, level_kind=level_kinds.ARBITRARY):
@@ -1978,32 +1837,55 @@ class Crcm5ModelDataManager:
             raise NotImplementedError("You need to implement this method for the given positions of files")
 
 
-    def _create_nc_structure(self, dataset, levels, var_name):
-        dataset.createDimension("time", None)
-        dataset.createDimension("lon", self.lons2D.shape[0])
-        dataset.createDimension("lat", self.lons2D.shape[1])
-        dataset.createDimension("level", len(levels))
-
-        dataVar = dataset.createVariable(var_name, "f8", dimensions=("time", "level", "lon", "lat"))
-        lonVar = dataset.createVariable("lon", "f8", dimensions=("lon", "lat"))
-        latVar = dataset.createVariable("lat", "f8", dimensions=("lon", "lat"))
+    def _get_sorted_sample_file_names(self):
+        fnames = [name for name in os.listdir(self.samples_folder) if name.startswith(self.file_name_prefix)]
+        return sorted(fnames, key=lambda name: int(name.split("_")[-1][:-1]))
 
-        levelVar = dataset.createVariable("level", "f8", dimensions=("level", ))
-        timeVar = dataset.createVariable("time", "f8", dimensions=("time", ))
+    def _iter_4d_records(self, var_name, start_year, end_year, level_kind=level_kinds.ARBITRARY):
+        """
+        (date, {level: field}) for the records of the years start_year..end_year, file by file.
+        The records are read one by one, so only the levels of one time step are kept in memory,
+        the levels of a time step are expected to be consecutive in the files (as in the model outputs).
+        :param start_year, end_year: None for no limit
+        """
+        for fname in self._get_sorted_sample_file_names():
+            r_obj = RPN(os.path.join(self.samples_folder, fname))
+            r_obj.suppress_log_messages()
+            try:
+                current_date, level_to_field = None, {}
+                data = r_obj.get_first_record_for_name(var_name)
+                while data is not None:
+                    the_date = r_obj.get_datetime_for_the_last_read_record()
+                    if the_date != current_date:
+                        if level_to_field:
+                            yield current_date, level_to_field
+                        current_date, level_to_field = the_date, {}
+
+                    if (start_year is None or start_year <= the_date.year) and \
+                            (end_year is None or the_date.year <= end_year):
+                        level_to_field[r_obj.get_current_level(level_kind=level_kind)] = data
+
+                    data = r_obj.get_next_record()
+
+                if level_to_field:
+                    yield current_date, level_to_field
+            finally:
+                r_obj.close()
 
-        levelVar[:] = levels
-        lonVar[:, :] = self.lons2D[:, :]
-        latVar[:, :] = self.lats2D[:, :]
-        return dataVar
+    def _create_stream_writer(self, nc_file_path, var_name, levels, start_date, **writer_kwargs):
+        return StreamingNetcdfWriter(path=nc_file_path, var_name=var_name, lons2d=self.lons2D, lats2d=self.lats2D,
+                                     levels=levels, start_date=start_date, **writer_kwargs)
 
 
-    def export_field_to_netcdf(self, start_year, end_year, nc_sim_folder="", var_name=""):
+    def export_field_to_netcdf(self, start_year, end_year, nc_sim_folder="", var_name="", **writer_kwargs):
         """
         Exports data to netcdf without aggregation
         nc_sim_folder - is a folder with netcdf files for a given simulation
         the file name patterns are <varname>_all.nc4
 
         the data for the period [start_year, end_year] should exist
+        :param writer_kwargs: chunk_time_steps, chunk_levels, chunk_shape_xy, complevel, shuffle, dtype, file_format
+            (see crcm5.netcdf_stream_writer.StreamingNetcdfWriter), the data are written chunk by chunk
 
 
         Note: the dates are not continuous here and not growing monotonously
@@ -2020,65 +1902,30 @@ class Crcm5ModelDataManager:
                 return
 
         if self.all_files_in_one_folder:
-            ds = Dataset(nc_file_path, "w")
-
-            dataVar = None
-            timeVar = None
-            levels = None
-            t = 0
+            writer_kwargs.setdefault("dtype", "f8")
 
-            fNames = os.listdir(self.samples_folder)
-            fNames = filter(lambda name: name.startswith(self.file_name_prefix), fNames)
-            fNames = sorted(fNames, key=lambda name: int(name.split("_")[-1][:-1]))
-
-            fNames = list(fNames)
-
-            for fName in fNames:
-                fPath = os.path.join(self.samples_folder, fName)
-
-                rObj = RPN(fPath)
-                # {time => {level => F(x, y)}}
-                rObj.suppress_log_messages()
-                data = rObj.get_4d_field(name=var_name)
-
-                rObj.close()
-
-                if dataVar is None:
-                    levels = list(data.items())[0][1].keys()
-                    levels = list(sorted(levels))
-
-                    dataVar = self._create_nc_structure(ds, levels, var_name)
-                    timeVar = ds.variables["time"]
-                    timeVar.units = "hours since {0}".format(str(start_date))
-
-                # put data and time to netcdf file
-                times = sorted(data.keys())
-                times = list(filter(lambda d: d.year <= end_year, times))
-
-
-                # if there are records in the given time range
-                if len(times) > 0:
-                    times_num = date2num(times, units=timeVar.units)
-                    timeVar[t:] = times_num[:]
-                    for k, level in enumerate(levels):
-                        dataVar[t:, k, :, :] = np.array(
-                            [data[d][level] for d in times]
-                        )
+            writer = None
+            for the_date, level_to_field in self._iter_4d_records(var_name, None, end_year):
+                if writer is None:
+                    writer = self._create_stream_writer(nc_file_path, var_name, sorted(level_to_field.keys()),
+                                                        start_date, **writer_kwargs)
+                writer.append(the_date, level_to_field)
 
-                    t += len(times)  # remember how many time steps have already been written
-
-            ds.close()
+            if writer is not None:
+                writer.close()
         else:
             raise Exception("Not yet implemented")
 
         pass
 
 
-    def export_daily_mean_fields(self, start_year, end_year, var_name="", nc_sim_folder="", quiet=False):
+    def export_daily_mean_fields(self, start_year, end_year, var_name="", nc_sim_folder="", quiet=False,
+                                 **writer_kwargs):
         """
         Exports daily mean fields to netcdf
         nc_sim_folder - is a folder with netcdf files for a given simulation
         the file name patterns are <varname>_daily.nc
+        :param writer_kwargs: see export_field_to_netcdf, each daily mean is written as soon as the day is complete
 
         """
         nc_file_name = "{0}_daily.nc".format(var_name)
@@ -2092,56 +1939,21 @@ class Crcm5ModelDataManager:
                 return
 
         if self.all_files_in_one_folder:
-            ds = Dataset(nc_file_path, "w", format="NETCDF3_CLASSIC")
-
-            data_var = None
-            time_var = None
-            levels = None
-            t = 0
+            writer_kwargs.setdefault("dtype", "f8")
 
-            fnames = os.listdir(self.samples_folder)
-            fnames = filter(lambda name: name.startswith(self.file_name_prefix), fnames)
-            fnames = sorted(fnames, key=lambda name: int(name.split("_")[-1][:-1]))
+            writer = None
+            aggregator = None
+            for the_date, level_to_field in self._iter_4d_records(var_name, start_year, end_year):
+                if writer is None:
+                    writer = self._create_stream_writer(nc_file_path, var_name, sorted(level_to_field.keys()),
+                                                        start_date, **writer_kwargs)
+                    aggregator = DailyMeanAggregator(writer.append)
 
-            fnames = list(fnames)
-
-            for fName in fnames:
-                fpath = os.path.join(self.samples_folder, fName)
+                aggregator.add(the_date, np.array([level_to_field[lev] for lev in writer.levels]))
 
-                r_obj = RPN(fpath)
-                # {time => {level => F(x, y)}}
-                r_obj.suppress_log_messages()
-                data = r_obj.get_4d_field(name=var_name)
-
-                # TODO: calculate daily means
-
-                r_obj.close()
-
-                if data_var is None:
-                    levels = list(data.items())[0][1].keys()
-                    levels = list(sorted(levels))
-
-                    data_var = self._create_nc_structure(ds, levels, var_name)
-                    time_var = ds.variables["time"]
-                    time_var.units = "hours since {0}".format(str(start_date))
-
-                # put data and time to netcdf file
-                times = sorted(data.keys())
-                times = list(filter(lambda the_date: start_year <= the_date.year <= end_year, times))
-
-
-                # if there are records in the given time range
-                if len(times) > 0:
-                    times_num = date2num(times, units=time_var.units)
-                    time_var[t:] = times_num[:]
-                    for k, level in enumerate(levels):
-                        data_var[t:, k, :, :] = np.array(
-                            [data[d][level] for d in times]
-                        )
-
-                    t += len(times)  # remember how many time steps have already been written
-
-            ds.close()
+            if writer is not None:
+                aggregator.flush()
+                writer.close()
         else:
             raise Exception("Not yet implemented")
 
@@ -0,0 +1,130 @@
+from datetime import datetime
+
+import numpy as np
+from netCDF4 import Dataset, date2num
+
+__author__ = 'huziy'
+
+
+# Streaming export of model fields to netcdf: the time steps are appended along the unlimited time dimension
+# and written chunk by chunk, so the memory used does not depend on the length of the simulation.
+# The daily means are calculated on the fly from the records ordered in time (DailyMeanAggregator).
+
+
+class StreamingNetcdfWriter(object):
+    def __init__(self, path="", var_name="", lons2d=None, lats2d=None, levels=None, start_date=None,
+                 chunk_time_steps=1, chunk_levels=1, chunk_shape_xy=None, complevel=4, shuffle=True,
+                 dtype="f4", file_format="NETCDF4"):
+        """
+        The file has the structure of the netcdf files exported by Crcm5ModelDataManager:
+        var_name(time, level, lon, lat), lon(lon, lat), lat(lon, lat), level(level), time(time)
+        :param start_date: the times are saved in hours since start_date
+        :param chunk_time_steps: number of time steps in a chunk, the steps are buffered and written chunk by chunk
+        :param chunk_levels: number of levels in a chunk
+        :param chunk_shape_xy: (nx, ny) of a chunk, the whole field by default
+        :param complevel: zlib compression level (0 - no compression)
+        :param file_format: NETCDF3_CLASSIC files are not compressed and not chunked
+        """
+        self.path = path
+        self.var_name = var_name
+        self.levels = list(levels)
+        self.chunk_time_steps = chunk_time_steps
+
+        nx, ny = lons2d.shape
+        self.field_shape = (len(self.levels), nx, ny)
+
+        self.ds = Dataset(path, "w", format=file_format)
+        self.ds.createDimension("time", None)
+        self.ds.createDimension("lon", nx)
+        self.ds.createDimension("lat", ny)
+        self.ds.createDimension("level", len(self.levels))
+
+        var_kwargs = {}
+        if file_format.startswith("NETCDF4"):
+            if chunk_shape_xy is None:
+                chunk_shape_xy = (nx, ny)
+            var_kwargs = dict(zlib=complevel > 0, complevel=complevel, shuffle=shuffle,
+                              chunksizes=(chunk_time_steps, min(chunk_levels, len(self.levels))) + tuple(chunk_shape_xy))
+
+        self.data_var = self.ds.createVariable(var_name, dtype, dimensions=("time", "level", "lon", "lat"),
+                                               **var_kwargs)
+        lon_var = self.ds.createVariable("lon", "f8", dimensions=("lon", "lat"))
+        lat_var = self.ds.createVariable("lat", "f8", dimensions=("lon", "lat"))
+        level_var = self.ds.createVariable("level", "f8", dimensions=("level", ))
+        self.time_var = self.ds.createVariable("time", "f8", dimensions=("time", ))
+
+        level_var[:] = self.levels
+        lon_var[:, :] = lons2d
+        lat_var[:, :] = lats2d
+
+        self.time_var.units = "hours since {0}".format(str(start_date))
+
+        self.n_written = 0
+        self._buffer = np.zeros((chunk_time_steps, ) + self.field_shape, dtype=self.data_var.dtype)
+        self._buffer_dates = []
+
+    def append(self, the_date, field):
+        """
+        :param field: {level: 2d field} or array (level, nx, ny)
+        """
+        if isinstance(field, dict):
+            field = np.array([field[lev] for lev in self.levels])
+
+        self._buffer[len(self._buffer_dates)] = np.reshape(field, self.field_shape)
+        self._buffer_dates.append(the_date)
+
+        if len(self._buffer_dates) == self.chunk_time_steps:
+            self.flush()
+
+    def flush(self):
+        n = len(self._buffer_dates)
+        if not n:
+            return
+
+        t1 = self.n_written + n
+        self.time_var[self.n_written:t1] = date2num(self._buffer_dates, units=self.time_var.units)
+        self.data_var[self.n_written:t1] = self._buffer[:n]
+        self.n_written = t1
+        self._buffer_dates = []
+
+    def close(self):
+        self.flush()
+        self.ds.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class DailyMeanAggregator(object):
+    def __init__(self, callback):
+        """
+        :param callback: function(day, daily mean field) called as soon as a day is complete
+        """
+        self.callback = callback
+        self._day = None
+        self._sum = None
+        self._count = 0
+
+    def add(self, the_date, field):
+        """
+        :param field: array, the records should come in the order of time
+        """
+        the_day = datetime(the_date.year, the_date.month, the_date.day)
+        if the_day != self._day:
+            self.flush()
+            self._day = the_day
+            self._sum = np.array(field, dtype=np.float64)
+            self._count = 1
+        else:
+            self._sum += field
+            self._count += 1
+
+    def flush(self):
+        if self._count:
+            self.callback(self._day, self._sum / float(self._count))
+        self._day = None
+        self._sum = None
+        self._count = 0
@@ -0,0 +1,207 @@
+import os
+
+import numpy as np
+import tables as tb
+from scipy import sparse
+
+from crcm5.analyse_hdf.event_statistics import read_sorted_fields_where, rows_to_datetime64
+from util import direction_and_value
+
+__author__ = 'huziy'
+
+
+# Cell-major (transposed) store of the time series of a simulation:
+#   - each variable is saved in a .npy file of shape (ncells, ntimes), so the series at a point is
+#     one contiguous read whatever the length of the record,
+#   - for the variables summed over the upstream cells (i.e. runoff) the upstream sums are precomputed,
+#   - the upstream cells of all the cells are saved as a table (indptr, indices) in the csr format.
+# The store is built once, going through the simulation data in blocks of time steps.
+
+INDEX_FILE = "index.npz"
+UPSTREAM_SUM_SUFFIX = ".upstream_sum"
+
+
+def get_downstream_indices(flow_directions):
+    """
+    :param flow_directions: 2d field of the flow directions (1, 2, 4, ..., 128)
+    :return: flat index of the next downstream cell for each cell (flattened), -1 if there is no next cell
+    """
+    nx, ny = flow_directions.shape
+    fdirs = np.asarray(flow_directions).flatten()
+
+    valid = np.isin(fdirs, direction_and_value.values)
+    k = np.searchsorted(direction_and_value.values, np.where(valid, fdirs, 1))
+
+    i, j = np.indices((nx, ny))
+    i_next = i.flatten() + direction_and_value.iShifts[k]
+    j_next = j.flatten() + direction_and_value.jShifts[k]
+
+    valid &= (i_next >= 0) & (i_next < nx) & (j_next >= 0) & (j_next < ny)
+    return np.where(valid, i_next * ny + j_next, -1)
+
+
+def get_upstream_table(downstream_indices):
+    """
+    Upstream cells (including the cell itself) of each cell, by following all the cells downstream simultaneously
+    :return: indptr, indices - the upstream cells of the cell c are indices[indptr[c]:indptr[c + 1]]
+    """
+    n = len(downstream_indices)
+    owners, members = [np.arange(n)], [np.arange(n)]
+
+    current = np.arange(n)
+    source = np.arange(n)
+    for _ in range(n):
+        current = downstream_indices[current]
+        active = current >= 0
+        if not np.any(active):
+            break
+
+        current, source = current[active], source[active]
+        owners.append(current)
+        members.append(source)
+
+    owners = np.concatenate(owners)
+    members = np.concatenate(members)
+
+    order = np.argsort(owners, kind="mergesort")
+    indptr = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum(np.bincount(owners, minlength=n), out=indptr[1:])
+    return indptr, members[order]
+
+
+class PointSeriesStore(object):
+    def __init__(self, folder=""):
+        """
+        :param folder: folder created by build_point_series_store
+        """
+        self.folder = str(folder)
+
+        with np.load(os.path.join(self.folder, INDEX_FILE)) as index:
+            self.times = index["times"]
+            self.field_shape = tuple(index["field_shape"])
+            self.upstream_indptr = index["upstream_indptr"]
+            self.upstream_indices = index["upstream_indices"]
+
+        self._name_to_data = {}
+
+    @property
+    def dates(self):
+        return self.times.astype("datetime64[s]").tolist()
+
+    def _get_data(self, name):
+        if name not in self._name_to_data:
+            self._name_to_data[name] = np.load(os.path.join(self.folder, name + ".npy"), mmap_mode="r")
+        return self._name_to_data[name]
+
+    def _get_cell(self, i, j):
+        return i * self.field_shape[1] + j
+
+    def get_series(self, name, i, j):
+        """
+        The time series of the variable at the point (i, j)
+        """
+        return np.array(self._get_data(name)[self._get_cell(i, j)])
+
+    def get_upstream_sum(self, name, i, j):
+        """
+        The time series of the sum of the variable over the cells upstream of (i, j), including (i, j)
+        """
+        return self.get_series(name + UPSTREAM_SUM_SUFFIX, i, j)
+
+    def get_upstream_indices(self, i, j):
+        c = self._get_cell(i, j)
+        return self.upstream_indices[self.upstream_indptr[c]:self.upstream_indptr[c + 1]]
+
+    def get_upstream_mask(self, i, j):
+        """
+        2d array which is 1 for the cells upstream of (i, j) (including (i, j)), as CellManager.get_mask_of_...
+        """
+        the_mask = np.zeros(self.field_shape, dtype=int)
+        the_mask.flat[self.get_upstream_indices(i, j)] = 1
+        return the_mask
+
+
+def build_point_series_store(folder, flow_directions, times, name_to_blocks, upstream_sum_names=(),
+                             dtype=np.float32):
+    """
+    :param flow_directions: 2d field of the flow directions, used to find the upstream cells
+    :param times: the dates of all the time steps (numpy.datetime64 or datetime objects)
+    :param name_to_blocks: {name: iterable of the consecutive blocks of fields (time, nx, ny) covering the times}
+    :param upstream_sum_names: names of the variables for which the sums over the upstream cells are saved
+    :return: PointSeriesStore
+    """
+    if not os.path.isdir(folder):
+        os.makedirs(folder)
+
+    field_shape = flow_directions.shape
+    ncells = int(np.prod(field_shape))
+    times = np.asarray(times).astype("datetime64[s]")
+    nt = len(times)
+
+    indptr, indices = get_upstream_table(get_downstream_indices(flow_directions))
+    upstream_matrix = sparse.csr_matrix((np.ones(len(indices)), indices, indptr), shape=(ncells, ncells))
+
+    for name, blocks in name_to_blocks.items():
+        out = np.lib.format.open_memmap(os.path.join(folder, name + ".npy"), mode="w+",
+                                        dtype=dtype, shape=(ncells, nt))
+
+        out_ups = None
+        if name in upstream_sum_names:
+            out_ups = np.lib.format.open_memmap(os.path.join(folder, name + UPSTREAM_SUM_SUFFIX + ".npy"),
+                                                mode="w+", dtype=dtype, shape=(ncells, nt))
+
+        t0 = 0
+        for block in blocks:
+            block = np.asarray(block).reshape((-1, ncells)).T
+            t1 = t0 + block.shape[1]
+            out[:, t0:t1] = block
+            if out_ups is not None:
+                out_ups[:, t0:t1] = upstream_matrix.dot(block.astype(np.float64))
+            t0 = t1
+
+        assert t0 == nt, "{}: {} time steps were written instead of {}".format(name, t0, nt)
+
+        out.flush()
+        del out
+        if out_ups is not None:
+            out_ups.flush()
+            del out_ups
+
+    np.savez(os.path.join(folder, INDEX_FILE), times=times, field_shape=np.array(field_shape),
+             upstream_indptr=indptr, upstream_indices=indices)
+
+    return PointSeriesStore(folder)
+
+
+def get_blocks_from_dicts(date_to_field, dates, times_per_block=365):
+    """
+    Blocks of fields for build_point_series_store from a {date: field} dictionary
+    """
+    for t0 in range(0, len(dates), times_per_block):
+        yield np.array([date_to_field[d] for d in dates[t0:t0 + times_per_block]])
+
+
+def build_point_series_store_from_hdf(folder, hdf_path, flow_directions, var_names, upstream_sum_names=(),
+                                      level_index=0):
+    """
+    Build the store from the hdf file with the tables of fields (columns year, month, ..., level_index, field),
+    the tables are read year by year. The time axis is taken from the first variable.
+    """
+    with tb.open_file(hdf_path) as h:
+        first_table = h.get_node("/", var_names[0])
+        # only the date columns are read
+        sel = first_table.col("level_index") == level_index
+        date_cols = [c for c in ["year", "month", "day", "hour", "minute", "second"] if c in first_table.colnames]
+        date_rows = np.rec.fromarrays([first_table.col(c)[sel] for c in date_cols], names=date_cols)
+        times = np.unique(rows_to_datetime64(date_rows))
+        years = np.unique(times.astype("datetime64[Y]").astype(int) + 1970)
+
+        def _blocks(table):
+            for the_year in years:
+                query = "(year == {}) & (level_index == {})".format(the_year, level_index)
+                the_times, data = read_sorted_fields_where(table, query)
+                yield data[np.isin(the_times, times)]
+
+        name_to_blocks = {name: _blocks(h.get_node("/", name)) for name in var_names}
+        return build_point_series_store(folder, flow_directions, times, name_to_blocks,
+                                        upstream_sum_names=upstream_sum_names)
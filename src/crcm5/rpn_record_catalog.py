@@ -0,0 +1,178 @@
+import os
+import pickle
+
+import numpy as np
+
+try:
+    from rpn import level_kinds
+    from rpn.rpn import RPN
+except ImportError as e:
+    class LevelKinds(object):
+        pass
+    level_kinds = LevelKinds()
+    level_kinds.ARBITRARY = -1
+    print(e)
+
+__author__ = 'huziy'
+
+
+# Catalog of the records in a folder of rpn files (i.e. the Samples folder of a simulation):
+# for each file (and its modification time and size) and each (name, level, level_kind),
+# the validity dates of the records, their origin date and the levels.
+# A file is scanned (all the records of the variable are decoded) only the first time the variable is requested,
+# afterwards only the records with the requested dates are decoded (fstinf by date, origin and level),
+# and the files without the requested dates are not opened at all.
+# The catalog is saved in the folder and updated when files are added or modified.
+
+CATALOG_FILE_NAME_FORMAT = ".record_catalog_{}.bin"
+TMP_SUFFIX = ".tmp"
+
+# level of the entries for all the levels of a variable (read with get_4d_field)
+ALL_LEVELS = None
+
+
+class FileRecords(object):
+    def __init__(self, mtime=None, size=None):
+        self.mtime = mtime
+        self.size = size
+        # {(name, level, level_kind): (dates, date_o, levels)}
+        self.var_key_to_records = {}
+
+
+class RecordCatalog(object):
+    def __init__(self, folder="", file_name_prefix="", catalog_path=None):
+        """
+        :param folder: folder with the rpn files
+        :param file_name_prefix: only the files starting with the prefix are considered (i.e. pm or dm)
+        :param catalog_path: where the catalog is saved, in the folder by default
+        """
+        self.folder = folder
+        self.file_name_prefix = file_name_prefix
+        if catalog_path is None:
+            catalog_path = os.path.join(folder, CATALOG_FILE_NAME_FORMAT.format(file_name_prefix))
+        self.catalog_path = catalog_path
+
+        self.file_name_to_records = {}
+        self._modified = False
+
+        if os.path.isfile(self.catalog_path):
+            with open(self.catalog_path, "rb") as f:
+                self.file_name_to_records = pickle.load(f)
+
+    def get_file_names(self):
+        return sorted(fn for fn in os.listdir(self.folder)
+                      if fn.startswith(self.file_name_prefix) and not fn.startswith("."))
+
+    def _get_file_records(self, file_name):
+        st = os.stat(os.path.join(self.folder, file_name))
+        file_records = self.file_name_to_records.get(file_name)
+        if file_records is None or (file_records.mtime, file_records.size) != (st.st_mtime, st.st_size):
+            file_records = FileRecords(mtime=st.st_mtime, size=st.st_size)
+            self.file_name_to_records[file_name] = file_records
+            self._modified = True
+        return file_records
+
+    def iter_fields(self, var_name, level=-1, level_kind=level_kinds.ARBITRARY, date_selector=None):
+        """
+        Go through the records of the variable in the order of the files, decoding only the selected ones
+        :param level: ALL_LEVELS (None) to get the 3d fields {level: field} of all the levels
+        :param date_selector: function of the array of dates (numpy.datetime64) returning the boolean mask of
+            the selected dates, all the dates are selected if None
+        :return: generator of (date, field)
+        """
+        key = (var_name, level, level_kind)
+
+        try:
+            for file_name in self.get_file_names():
+                file_records = self._get_file_records(file_name)
+                path = os.path.join(self.folder, file_name)
+
+                if key in file_records.var_key_to_records:
+                    for date, field in self._read_selected(path, key, file_records.var_key_to_records[key],
+                                                           date_selector):
+                        yield date, field
+                    continue
+
+                # the first time the file is seen for the variable
+                r = RPN(path)
+                r.suppress_log_messages()
+                try:
+                    if level is ALL_LEVELS:
+                        data = r.get_4d_field(name=var_name, level_kind=level_kind)
+                    else:
+                        data = r.get_all_time_records_for_name_and_level(varname=var_name, level=level,
+                                                                         level_kind=level_kind)
+                    date_o = r.get_dateo_of_last_read_record() if len(data) else None
+                finally:
+                    r.close()
+
+                dates = sorted(data.keys())
+                levels = sorted(data[dates[0]].keys()) if len(dates) and level is ALL_LEVELS else None
+                file_records.var_key_to_records[key] = (dates, date_o, levels)
+                self._modified = True
+
+                for i in np.where(_select(dates, date_selector))[0]:
+                    yield dates[i], data[dates[i]]
+        finally:
+            self.save()
+
+    def _read_selected(self, path, key, records, date_selector):
+        var_name, level, level_kind = key
+        dates, date_o, levels = records
+
+        selected = np.where(_select(dates, date_selector))[0]
+        if not len(selected):
+            return
+
+        r = RPN(path)
+        r.suppress_log_messages()
+        try:
+            for i in selected:
+                d = dates[i]
+                if level is ALL_LEVELS:
+                    field = {lev: r.get_record_for_date_and_level(var_name=var_name, date=d, date_o=date_o,
+                                                                  level=lev, level_kind=level_kind)
+                             for lev in levels}
+                else:
+                    field = r.get_record_for_date_and_level(var_name=var_name, date=d, date_o=date_o,
+                                                            level=level, level_kind=level_kind)
+                yield d, field
+        finally:
+            r.close()
+
+    def save(self):
+        if not self._modified:
+            return
+
+        try:
+            with open(self.catalog_path + TMP_SUFFIX, "wb") as f:
+                pickle.dump(self.file_name_to_records, f)
+            os.rename(self.catalog_path + TMP_SUFFIX, self.catalog_path)
+            self._modified = False
+        except (IOError, OSError) as e:
+            # i.e. the folder is not writable, the catalog is used only for this session
+            print("Could not save the record catalog to {}: {}".format(self.catalog_path, e))
+
+
+def _select(dates, date_selector):
+    if date_selector is None:
+        return np.ones(len(dates), dtype=bool)
+    return np.asarray(date_selector(np.array(dates, dtype="datetime64[s]")), dtype=bool)
+
+
+def get_year_month_selector(start_year=None, end_year=None, months=None):
+    """
+    :return: date selector for RecordCatalog.iter_fields
+    """
+    def _selector(times):
+        years = times.astype("datetime64[Y]").astype(int) + 1970
+        sel = np.ones(len(times), dtype=bool)
+        if start_year is not None:
+            sel &= years >= start_year
+        if end_year is not None:
+            sel &= years <= end_year
+        if months is not None:
+            sel &= np.isin(times.astype("datetime64[M]").astype(int) % 12 + 1, list(months))
+        return sel
+
+    return _selector
@@ -0,0 +1,75 @@
+import numpy as np
+
+from util.geo import lat_lon
+
+__author__ = 'huziy'
+
+
+# Matching of the streamflow stations to the model grid cells for many stations at once:
+# one kdtree query for all the stations, then the candidate cells (nneighbours closest cells) are scored
+# as arrays (stations x neighbours) by the relative drainage area mismatch plus the distance normalized by
+# the distance to the farthest candidate, as in Crcm5ModelDataManager._get_model_indices_for_stfl_station.
+
+MATCH_DTYPE = [("ix", int), ("jy", int), ("flat_index", int), ("acc_area_km2", float),
+               ("da_diff", float), ("distance_m", float), ("score", float)]
+
+
+def get_station_coordinates(station_list):
+    """
+    :param station_list: list of data.cehq_station.Station
+    :return: longitudes, latitudes, drainage areas (km**2) of the stations as arrays
+    """
+    lons = np.array([s.longitude for s in station_list], dtype=float)
+    lats = np.array([s.latitude for s in station_list], dtype=float)
+    drainage = np.array([s.drainage_km2 for s in station_list], dtype=float)
+    return lons, lats, drainage
+
+
+def match_stations_to_grid(kdtree, accumulation_area_km2, lons, lats, drainage_km2, nneighbours=4,
+                           max_da_diff=0.15):
+    """
+    :param kdtree: cKDTree of the cartesian coordinates of the grid cells (flattened in the C order)
+    :param accumulation_area_km2: 2d field of the model drainage areas
+    :param lons, lats, drainage_km2: arrays with the station longitudes, latitudes and drainage areas
+    :param max_da_diff: the cells with the relative drainage area difference >= max_da_diff are not considered
+    :return: record array (one record per station) with the fields of MATCH_DTYPE,
+        ix = jy = flat_index = -1 for the stations without a suitable cell
+    """
+    acc_area_1d = np.ravel(accumulation_area_km2)
+    drainage_km2 = np.asarray(drainage_km2, dtype=float)
+    nstations = len(drainage_km2)
+
+    result = np.full(nstations, -1, dtype=MATCH_DTYPE).view(np.recarray)
+    for name in ["acc_area_km2", "da_diff", "distance_m", "score"]:
+        result[name] = np.nan
+
+    if not nstations:
+        return result
+
+    xyz = np.column_stack(lat_lon.lon_lat_to_cartesian(np.asarray(lons, dtype=float), np.asarray(lats, dtype=float)))
+    distances, indices = kdtree.query(xyz, k=nneighbours)
+    distances = distances.reshape((nstations, -1))
+    indices = indices.reshape((nstations, -1))
+
+    acc = acc_area_1d[indices]
+    da = drainage_km2[:, np.newaxis]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        da_diff = np.abs(acc - da) / da
+        score = da_diff + distances / distances.max(axis=1, keepdims=True)
+
+    candidates = (acc > 0) & (da_diff < max_da_diff)
+    score = np.where(candidates, score, np.inf)
+
+    best = np.argmin(score, axis=1)
+    matched = candidates.any(axis=1)
+    rows = np.where(matched)[0]
+    cols = best[matched]
+
+    flat = indices[rows, cols]
+    result.flat_index[rows] = flat
+    result.ix[rows], result.jy[rows] = np.unravel_index(flat, np.shape(accumulation_area_km2))
+    result.acc_area_km2[rows] = acc[rows, cols]
+    result.da_diff[rows] = da_diff[rows, cols]
+    result.distance_m[rows] = distances[rows, cols]
+    result.score[rows] = score[rows, cols]
+    return result
@@ -0,0 +1,254 @@
+import hashlib
+import os
+import pickle
+from datetime import datetime
+
+import numpy as np
+
+__author__ = 'huziy'
+
+
+# Persistent store of the streamflow validation results for each (model run, station):
+#   - the matched model cell and its upstream mask,
+#   - the aligned observed and modelled series, their climatologies and the skill scores.
+# Each entry is saved together with a signature of everything it was computed from (model files,
+# observations, matching parameters), an entry is reused only if the signature did not change.
+# Entries are added one by one, so that new stations and runs are computed incrementally.
+
+TMP_SUFFIX = ".tmp"
+
+
+def get_files_signature(paths):
+    """
+    :param paths: list of the model data files (hdf or rpn)
+    :return: list of (path, modification time, size), changes when any of the files is modified
+    """
+    result = []
+    for p in sorted(str(p) for p in paths):
+        st = os.stat(p)
+        result.append((os.path.abspath(p), st.st_mtime, st.st_size))
+    return result
+
+
+def get_station_signature(station):
+    """
+    Id, location, drainage area and a hash of the observed values of the station
+    """
+    values = np.asarray(station.values, dtype=np.float64)
+    h = hashlib.sha1(values.tobytes())
+    h.update(str([d.isoformat() for d in station.dates[:1] + station.dates[-1:]]).encode())
+    return dict(id=station.id, longitude=station.longitude, latitude=station.latitude,
+                drainage_km2=station.drainage_km2, n=len(values), values_hash=h.hexdigest())
+
+
+def to_datetime64(dates):
+    """
+    :param dates: datetime objects or numpy.datetime64
+    """
+    if np.issubdtype(np.asarray(dates).dtype, np.datetime64):
+        return np.asarray(dates).astype("datetime64[s]")
+    return np.array([np.datetime64(d, "s") for d in dates], dtype="datetime64[s]")
+
+
+def align_series(obs_dates, obs_values, mod_dates, mod_values, freq="D"):
+    """
+    Average both series to the time steps of freq ("D" or "M") and keep the common time steps
+    :return: dates (numpy.datetime64 of the freq), obs, mod
+    """
+    def _resample(dates, values):
+        t = to_datetime64(dates).astype("datetime64[{}]".format(freq))
+        values = np.ma.filled(np.ma.masked_invalid(np.asarray(values, dtype=np.float64)), np.nan)
+        ok = ~np.isnan(values)
+        steps, inverse = np.unique(t[ok], return_inverse=True)
+        counts = np.bincount(inverse, minlength=len(steps))
+        return steps, np.bincount(inverse, weights=values[ok], minlength=len(steps)) / counts
+
+    t_obs, v_obs = _resample(obs_dates, obs_values)
+    t_mod, v_mod = _resample(mod_dates, mod_values)
+
+    common, i_obs, i_mod = np.intersect1d(t_obs, t_mod, assume_unique=True, return_indices=True)
+    return common, v_obs[i_obs], v_mod[i_mod]
+
+
+def get_climatology(dates, values, stamp_year=2001, years=None):
+    """
+    Mean for each (month, day) of the series, the 29th of February is excluded
+    :param dates: numpy.datetime64 or datetime objects
+    :param years: list of the years to consider, all the years are used if None
+    :return: stamp dates (list of datetime in the stamp_year), mean values
+    """
+    t = to_datetime64(dates)
+    values = np.asarray(values, dtype=np.float64)
+
+    the_years = t.astype("datetime64[Y]").astype(int) + 1970
+    the_months = t.astype("datetime64[M]").astype(int) % 12 + 1
+    the_days = (t.astype("datetime64[D]") - t.astype("datetime64[M]")).astype(int) + 1
+
+    ok = ~((the_months == 2) & (the_days == 29)) & ~np.isnan(values)
+    if years is not None:
+        ok &= np.isin(the_years, years)
+
+    keys, inverse = np.unique(the_months[ok] * 100 + the_days[ok], return_inverse=True)
+    clim = np.bincount(inverse, weights=values[ok]) / np.bincount(inverse)
+
+    return [datetime(stamp_year, k // 100, k % 100) for k in keys], clim
+
+
+def calculate_skill_scores(obs, mod):
+    """
+    :return: dict with the Nash-Sutcliffe coefficient (ns), correlation (corr), bias (mean(mod - obs))
+            and the relative bias in % (rel_bias); nan if there is not enough data
+    """
+    obs = np.asarray(obs, dtype=np.float64)
+    mod = np.asarray(mod, dtype=np.float64)
+
+    ok = ~(np.isnan(obs) | np.isnan(mod))
+    obs, mod = obs[ok], mod[ok]
+
+    scores = dict(ns=np.nan, corr=np.nan, bias=np.nan, rel_bias=np.nan, n=len(obs))
+    if len(obs) == 0:
+        return scores
+
+    obs_mean = obs.mean()
+    scores["bias"] = mod.mean() - obs_mean
+    if obs_mean != 0:
+        scores["rel_bias"] = scores["bias"] / obs_mean * 100.0
+
+    if len(obs) > 1 and obs.std() > 0:
+        scores["ns"] = 1.0 - np.sum((mod - obs) ** 2) / np.sum((obs - obs_mean) ** 2)
+        if mod.std() > 0:
+            scores["corr"] = np.corrcoef(obs, mod)[0, 1]
+
+    return scores
+
+
+class StationValidation(object):
+    def __init__(self, run_label="", station_id="", ix=None, jy=None, upstream_mask=None, accumulation_area=None,
+                 dates=None, obs=None, mod=None, clim_dates=None, obs_clim=None, mod_clim=None, scores=None):
+        """
+        :param upstream_mask: 2d array, nonzero for the cells upstream of the matched cell (ix, jy),
+            only the indices of the upstream cells are kept
+        :param dates, obs, mod: the aligned series
+        :param clim_dates, obs_clim, mod_clim: the climatologies (stamp dates)
+        :param scores: see calculate_skill_scores
+        """
+        self.run_label = run_label
+        self.station_id = station_id
+        self.ix = ix
+        self.jy = jy
+        self.accumulation_area = accumulation_area
+
+        self.field_shape = None
+        self.upstream_indices = None
+        if upstream_mask is not None:
+            self.field_shape = upstream_mask.shape
+            self.upstream_indices = np.where(upstream_mask > 0.5)
+
+        self.dates = dates
+        self.obs = obs
+        self.mod = mod
+        self.clim_dates = clim_dates
+        self.obs_clim = obs_clim
+        self.mod_clim = mod_clim
+        self.scores = {} if scores is None else scores
+
+    @property
+    def upstream_mask(self):
+        if self.upstream_indices is None:
+            return None
+
+        the_mask = np.zeros(self.field_shape, dtype=int)
+        the_mask[self.upstream_indices] = 1
+        return the_mask
+
+    def __str__(self):
+        return "{} ({}): ns={ns:.2f}, corr={corr:.2f}, bias={bias:.2f}".format(
+            self.station_id, self.run_label, **{k: self.scores.get(k, np.nan) for k in ["ns", "corr", "bias"]})
+
+
+class StreamflowValidationStore(object):
+    def __init__(self, folder="streamflow_validation_store"):
+        """
+        :param folder: the entries are saved in folder/<hash of the run label>/<key>.bin
+        """
+        self.folder = str(folder)
+
+    def _get_entry_path(self, run_label, key):
+        run_folder = hashlib.sha1(str(run_label).encode()).hexdigest()[:10]
+        return os.path.join(self.folder, run_folder, "{}.bin".format(key))
+
+    def load(self, run_label, key, signature):
+        """
+        :return: the saved object or None if there is no entry or it was saved with a different signature
+        """
+        path = self._get_entry_path(run_label, key)
+        if not os.path.isfile(path):
+            return None
+
+        with open(path, "rb") as f:
+            saved = pickle.load(f)
+
+        if saved["signature"] != signature:
+            return None
+
+        return saved["data"]
+
+    def save(self, run_label, key, data, signature):
+        path = self._get_entry_path(run_label, key)
+        folder = os.path.dirname(path)
+        if not os.path.isdir(folder):
+            os.makedirs(folder)
+
+        with open(path + TMP_SUFFIX, "wb") as f:
+            pickle.dump(dict(signature=signature, run_label=run_label, data=data), f)
+        os.rename(path + TMP_SUFFIX, path)
+
+    def get_or_compute(self, run_label, key, signature, compute_func):
+        """
+        :param compute_func: function without arguments, called only if there is no valid entry
+        """
+        data = self.load(run_label, key, signature)
+        if data is None:
+            data = compute_func()
+            self.save(run_label, key, data, signature)
+        return data
+
+    def get_validations(self, run_label):
+        """
+        All the StationValidation entries saved for the run (whatever their signatures)
+        """
+        run_folder = os.path.dirname(self._get_entry_path(run_label, "_"))
+        if not os.path.isdir(run_folder):
+            return []
+
+        result = []
+        for fname in sorted(os.listdir(run_folder)):
+            if not fname.endswith(".bin"):
+                continue
+            with open(os.path.join(run_folder, fname), "rb") as f:
+                data = pickle.load(f)["data"]
+            if isinstance(data, StationValidation):
+                result.append(data)
+        return result
+
+
+def build_station_validation(run_label, station_id, model_point, upstream_mask, obs_dates, obs_values,
+                             mod_dates, mod_values, freq="D", stamp_year=2001, years=None):
+    """
+    Align the observed and modelled series, calculate their climatologies over the common time steps and the scores
+    :param model_point: crcm5.model_point.ModelPoint
+    """
+    dates, obs, mod = align_series(obs_dates, obs_values, mod_dates, mod_values, freq=freq)
+
+    if years is not None:
+        sel = np.isin(dates.astype("datetime64[Y]").astype(int) + 1970, years)
+        dates, obs, mod = dates[sel], obs[sel], mod[sel]
+
+    clim_dates, obs_clim = get_climatology(dates, obs, stamp_year=stamp_year)
+    _, mod_clim = get_climatology(dates, mod, stamp_year=stamp_year)
+
+    return StationValidation(run_label=run_label, station_id=station_id, ix=model_point.ix, jy=model_point.jy,
+                             accumulation_area=model_point.accumulation_area, upstream_mask=upstream_mask,
+                             dates=dates, obs=obs, mod=mod,
+                             clim_dates=clim_dates, obs_clim=obs_clim, mod_clim=mod_clim,
+                             scores=calculate_skill_scores(obs, mod))
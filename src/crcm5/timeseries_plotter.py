@@ -16,7 +16,11 @@ import matplotlib.pyplot as plt
 class TimeseriesPlotter:
 
     def __init__(self, name_to_date_to_field, basemap, lons2d, lats2d,
-                 ax = None, cell_area = None, cell_manager = None, data_manager = None):
+                 ax = None, cell_area = None, cell_manager = None, data_manager = None, point_store = None):
+        """
+        :param point_store: crcm5.point_series_store.PointSeriesStore, if given the series and the upstream masks
+            are read from it (the time dependent fields are then not needed in name_to_date_to_field)
+        """
 
 
         self.gwdi_mean_field = None
@@ -26,12 +30,12 @@ class TimeseriesPlotter:
 
 
         self.basemap = basemap
-        self.date_to_stfl_field = name_to_date_to_field["STFL"]
-        self.date_to_traf_field = name_to_date_to_field["TRAF"]
-        self.date_to_tdra_field = name_to_date_to_field["TDRA"]
-        self.date_to_pr_field = name_to_date_to_field["PR"]
-        self.date_to_swe_field = name_to_date_to_field["I5"]
-        self.date_to_swst_field = name_to_date_to_field["SWST"]
+        self.date_to_stfl_field = name_to_date_to_field.get("STFL")
+        self.date_to_traf_field = name_to_date_to_field.get("TRAF")
+        self.date_to_tdra_field = name_to_date_to_field.get("TDRA")
+        self.date_to_pr_field = name_to_date_to_field.get("PR")
+        self.date_to_swe_field = name_to_date_to_field.get("I5")
+        self.date_to_swst_field = name_to_date_to_field.get("SWST")
         #self.date_to_imav_field = name_to_date_to_field["IMAV"]
 
         self.acc_area_km2 = name_to_date_to_field["FACC"]
@@ -54,15 +58,19 @@ class TimeseriesPlotter:
 
         self.lons_flat = lons2d.flatten()
         self.lats_flat = lats2d.flatten()
-        self.dates_sorted = list( sorted(list(name_to_date_to_field.items())[0][1].keys()) )
+        self.point_store = point_store
+        if point_store is not None:
+            self.dates_sorted = point_store.dates
+        else:
+            self.dates_sorted = list(sorted(self.date_to_stfl_field.keys()))
 
 
         self.counter = 0
 
-        self.date_to_swsr_field = name_to_date_to_field["SWSR"]
-        self.date_to_swsl_field = name_to_date_to_field["SWSL"]
+        self.date_to_swsr_field = name_to_date_to_field.get("SWSR")
+        self.date_to_swsl_field = name_to_date_to_field.get("SWSL")
         #self.date_to_gwdi_field = name_to_date_to_field["GWDI"]
-        self.date_to_upin_field = name_to_date_to_field["UPIN"]
+        self.date_to_upin_field = name_to_date_to_field.get("UPIN")
 
 
         #static fields
@@ -96,36 +104,55 @@ class TimeseriesPlotter:
 
 
 
+    def _get_point_series(self, name, i, j):
+        """
+        :param name: name of the variable (i.e. STFL)
+        """
+        if self.point_store is not None:
+            return self.point_store.get_series(name, i, j)
+
+        date_to_field = self._name_to_date_to_field()[name]
+        return np.array([date_to_field[d][i, j] for d in self.dates_sorted])
+
+    def _get_upstream_sum_series(self, name, i, j, mask):
+        if self.point_store is not None:
+            return self.point_store.get_upstream_sum(name, i, j)
+
+        date_to_field = self._name_to_date_to_field()[name]
+        return np.array([np.sum(date_to_field[d][mask == 1]) for d in self.dates_sorted])
+
+    def _name_to_date_to_field(self):
+        return {
+            "STFL": self.date_to_stfl_field, "TRAF": self.date_to_traf_field, "TDRA": self.date_to_tdra_field,
+            "PR": self.date_to_pr_field, "I5": self.date_to_swe_field, "SWST": self.date_to_swst_field,
+            "SWSR": self.date_to_swsr_field, "SWSL": self.date_to_swsl_field, "UPIN": self.date_to_upin_field
+        }
+
     def __call__(self,event):
         if event.button != 3:
             return
         i,j = self._get_closest_ij( event )
 
-        vals = [
-            self.date_to_stfl_field[d][i,j] for d in self.dates_sorted
-        ]
+        vals = self._get_point_series("STFL", i, j)
         plt.figure()
         plt.plot(self.dates_sorted, vals, label = "STFL")
 
 
-        mask = self.cell_manager.get_mask_of_cells_connected_with(self.cell_manager.cells[i][j])
+        if self.point_store is not None:
+            mask = self.point_store.get_upstream_mask(i, j)
+        else:
+            mask = self.cell_manager.get_mask_of_cells_connected_with(self.cell_manager.cells[i][j])
 
 
         print("sum(mask) = ", np.sum(mask))
 
-        vals1 = [
-           np.sum( self.date_to_traf_field[d][mask == 1] ) for d in self.dates_sorted
-        ]
+        vals1 = self._get_upstream_sum_series("TRAF", i, j, mask)
         plt.plot(self.dates_sorted, vals1, label = "TRAF")
 
-        vals2 = [
-           np.sum( self.date_to_tdra_field[d][mask == 1] ) for d in self.dates_sorted
-        ]
+        vals2 = self._get_upstream_sum_series("TDRA", i, j, mask)
         plt.plot(self.dates_sorted, vals2, label = "TDRA")
 
-        vals3 = [
-           np.sum( self.date_to_pr_field[d][mask == 1] ) for d in self.dates_sorted
-        ]
+        vals3 = self._get_upstream_sum_series("PR", i, j, mask)
         plt.plot(self.dates_sorted, vals3, label = "PR")
 
 
@@ -134,16 +161,14 @@ class TimeseriesPlotter:
         #]
         #plt.plot(self.dates_sorted, vals4, label = "GWDI")
 
-        vals5 = [
-           np.sum( self.date_to_upin_field[d][i,j] ) for d in self.dates_sorted
-        ]
+        vals5 = self._get_point_series("UPIN", i, j)
         plt.plot(self.dates_sorted, vals5, label = "UPIN")
 
 
 
 
 
-        if self.upin_mean_field is None:
+        if self.upin_mean_field is None and self.point_store is None:
             self.upin_mean_field = np.mean(list(self.date_to_upin_field.values()), axis = 0)
 
 
@@ -229,26 +254,18 @@ class TimeseriesPlotter:
         plt.figure()
 
         #snow
-        vals6 = [
-                   np.sum( self.date_to_swe_field[d][mask == 1] ) for d in self.dates_sorted
-        ]
+        vals6 = self._get_upstream_sum_series("I5", i, j, mask)
         plt.plot(self.dates_sorted, vals6, label = "SWE")
 
 
-        vals4 = [
-           np.sum( self.date_to_swe_field[d][i,j] ) for d in self.dates_sorted
-        ]
+        vals4 = self._get_point_series("I5", i, j)
         plt.plot(self.dates_sorted, vals4, label = "GWST")
 
 
-        vals5 = [
-           np.sum( self.date_to_swsr_field[d][i,j] ) for d in self.dates_sorted
-        ]
+        vals5 = self._get_point_series("SWSR", i, j)
         plt.plot(self.dates_sorted, vals5, label = "SWSR")
 
-        vals5 = [
-           np.sum( self.date_to_swsl_field[d][i,j] ) for d in self.dates_sorted
-        ]
+        vals5 = self._get_point_series("SWSL", i, j)
         plt.plot(self.dates_sorted, vals5, label = "SWSL")
         plt.legend()
         plt.title("{0}, lkfr = {1}".format(self.counter, self.data_manager.lake_fraction[i,j]))
@@ -264,15 +281,13 @@ class TimeseriesPlotter:
 
         #traf -> dict( date -> value in m**3/s )
 
-        traf_dict = dict(list(zip(self.dates_sorted,
-            [self.date_to_traf_field[d][i,j] for d in self.dates_sorted])) )
+        traf_dict = dict(list(zip(self.dates_sorted, self._get_point_series("TRAF", i, j))))
 
         traf_dict = {"TRAF": traf_dict}
 
         info.update(traf_dict)
 
-        upin_dict = dict(list(zip(self.dates_sorted,
-            [self.date_to_upin_field[d][i,j] for d in self.dates_sorted])) )
+        upin_dict = dict(list(zip(self.dates_sorted, self._get_point_series("UPIN", i, j))))
         upin_dict = {"UPIN": upin_dict}
         info.update(upin_dict)
 
@@ -282,23 +297,19 @@ class TimeseriesPlotter:
 #        gwdi_dict = {"GWDI": gwdi_dict}
 #        info.update(gwdi_dict)
 
-        swsr_dict = dict(list(zip(self.dates_sorted,
-                            [self.date_to_swsr_field[d][i,j] for d in self.dates_sorted])) )
+        swsr_dict = dict(list(zip(self.dates_sorted, self._get_point_series("SWSR", i, j))))
         swsr_dict = {"SWSR": swsr_dict }
         info.update(swsr_dict)
 
-        swsl_dict = dict(list(zip(self.dates_sorted,
-                                    [self.date_to_swsl_field[d][i,j] for d in self.dates_sorted])) )
+        swsl_dict = dict(list(zip(self.dates_sorted, self._get_point_series("SWSL", i, j))))
         swsl_dict = {"SWSL": swsl_dict }
         info.update(swsl_dict)
 
-        stfl_dict = dict(list(zip(self.dates_sorted,
-                            [self.date_to_stfl_field[d][i,j] for d in self.dates_sorted])) )
+        stfl_dict = dict(list(zip(self.dates_sorted, self._get_point_series("STFL", i, j))))
         stfl_dict = {"STFL": stfl_dict }
         info.update(stfl_dict)
 
-        swst_dict = dict(list(zip(self.dates_sorted,
-                            [self.date_to_swst_field[d][i,j] for d in self.dates_sorted])) )
+        swst_dict = dict(list(zip(self.dates_sorted, self._get_point_series("SWST", i, j))))
         swst_dict = {"SWST": swst_dict }
         info.update(swst_dict)
 
@@ -310,7 +321,7 @@ class TimeseriesPlotter:
         info["LKOU"] = self.lake_outlet[i,j]
 
 
-        pickle.dump(info, open(fName, mode="w"))
+        pickle.dump(info, open(fName, mode="wb"))
 
 
 
@@ -7,7 +7,6 @@ import itertools
 import pickle
 from mpl_toolkits.basemap import Basemap
 import numpy as np
-from pandas.core.panel import Panel
 from scipy.spatial.ckdtree import cKDTree
 from data.base_data_manager import BaseDataManager
 from util.geo import lat_lon
@@ -141,95 +140,82 @@ class AnuSplinManager(BaseDataManager):
     def _get_year(self, fname):
         return datetime.strptime(fname, self.fname_format)
 
-    def get_daily_climatology_fields(self, start_year=1980, end_year=1988):
+    def get_daily_climatology_fields(self, start_year=1980, end_year=1988, processes=None):
         """
-        :rtype : pandas.DataFrame
+        Each monthly file is opened exactly once by a worker, which returns per-day sums and counts
+        (NaNs are not counted), the partial sums are then merged here.
+
         :param start_year: start year of the averaging period
         :param end_year: end year of the averaging period
-        :return pandas DataFrame of daily mean climatologies
+        :param processes: number of worker processes (None - use the number of cpus)
+        :return dates (in the stamp year, Feb 29 is skipped) and
+            the masked array of daily mean climatologies (365, nx, ny), oriented as self.lons2d
         """
         stamp_year = 2001
 
-        cache_file = "anusplin_daily_climatology_{0}_{1}_{2}.cache.hdf".format(start_year, end_year, self.nc_varname)
+        cache_file = "anusplin_daily_climatology_{0}_{1}_{2}.cache.nc".format(start_year, end_year, self.nc_varname)
         if os.path.isfile(cache_file):
-            store = pd.HDFStore(cache_file)
-            df = store.get("dailyClimFrame")
-            store.close()
-            return df
+            return _read_daily_clim_cache(cache_file)
 
-        import calendar
-
-
-        # open files
-        sorted_keys = []
-        day_month_to_nc_path = {}
-        for month in range(1, 13):
-            wkday, ndays = calendar.monthrange(stamp_year, month)
-            for day in range(1, ndays + 1):
-                key = (month, day)
-                day_month_to_nc_path[key] = []
-                sorted_keys.append(key)
+        times = [datetime(stamp_year, 1, 1) + timedelta(days=i) for i in range(365)]
+        month_to_first_day_index = {}
+        for i, t in enumerate(times):
+            month_to_first_day_index.setdefault(t.month, i)
 
+        tasks = []
         for the_year in range(start_year, end_year + 1):
             for month in range(1, 13):
                 fname = datetime(the_year, month, 1).strftime(self.fname_format)
-                fpath = os.path.join(self.folder_path, fname)
-                ds = Dataset(fpath)
-
-                month_days = ds.variables["time"][:] if month != 2 else list(range(1, 29))
-                ds.close()
-                for day in month_days:
-                    key = (month, int(day))
-                    day_month_to_nc_path[key].append(fpath)
+                tasks.append((os.path.join(self.folder_path, fname), month, self.nc_varname))
 
-        assert len(sorted_keys) == 365
-        times = [datetime(stamp_year, the_key[0], the_key[1]) for the_key in sorted_keys]
+        clim_sum = None
+        clim_count = None
 
-        pool = Pool(processes=20)
+        pool = Pool(processes=processes)
+        for month, month_sum, month_count in pool.imap_unordered(_monthly_file_reducer, tasks):
+            if clim_sum is None:
+                clim_sum = np.zeros((len(times),) + month_sum.shape[1:])
+                clim_count = np.zeros((len(times),) + month_sum.shape[1:], dtype=np.int32)
 
-        path_lists = [day_month_to_nc_path[key] for key in sorted_keys]
-        day_of_month_list = [key[1] for key in sorted_keys]
-        varname_list = [self.nc_varname] * len(path_lists)
+            i0 = month_to_first_day_index[month]
+            clim_sum[i0:i0 + month_sum.shape[0]] += month_sum
+            clim_count[i0:i0 + month_count.shape[0]] += month_count
 
+        pool.close()
+        pool.join()
 
+        daily_clim_fields = np.ma.masked_where(clim_count == 0, clim_sum / np.where(clim_count > 0, clim_count, 1))
 
-        # daily_clim_fields = [
-        # np.asarray([ds.variables[self.nc_varname][day - 1, :, :] for ds in ds_list]).mean(axis=0)
-        #    for day, ds_list in zip(day_list, ds_lists)
-        # ]
+        # (time, ni, nj) -> (time, nj, ni) to be consistent with lons2d and lats2d
+        daily_clim_fields = daily_clim_fields.transpose((0, 2, 1))
 
-        daily_clim_fields = pool.map(_reader, list(zip(path_lists, day_of_month_list, varname_list)))
-        daily_clim_fields = np.asarray(daily_clim_fields)
-        daily_clim_fields = np.ma.masked_where(np.isnan(daily_clim_fields), daily_clim_fields)
-
-        ni, nj = daily_clim_fields[0].shape
-        panel = pd.Panel(data=daily_clim_fields.transpose((1, 0, 2)), major_axis=times, minor_axis=list(range(nj)),
-                         items=list(range(ni)))
-
-        store = pd.HDFStore(cache_file)
-        store.put("dailyClimFrame", panel)
-        store.close()
-
-        return panel
+        _write_daily_clim_cache(cache_file, times, daily_clim_fields)
+        return times, daily_clim_fields
 
 
     def getMeanFieldForMonths(self, months=None, start_year=1979, end_year=1988):
         if months is None:
             months = list(range(1, 13))
 
-        df = self.get_daily_climatology_fields(start_year=start_year, end_year=end_year)
+        times, daily_clim_fields = self.get_daily_climatology_fields(start_year=start_year, end_year=end_year)
 
-        assert isinstance(df, Panel)
+        selected = np.array([t.month in months for t in times])
+        return daily_clim_fields[selected].mean(axis=0)
 
-        df_monthly = df.select(lambda d: d.month in months, axis=1)
 
-        df_mean = df_monthly.apply(np.mean)
+    def get_daily_clim_fields_interpolated_to(self, start_year=None, end_year=None,
+                                              lons_target=None, lats_target=None):
+        # Return 365 fields
+        times, daily_clim_fields = self.get_daily_climatology_fields(start_year=start_year, end_year=end_year)
 
-        assert isinstance(df_mean, pd.DataFrame)
-        print(df_mean.values.shape)
+        lons1d, lats1d = lons_target.flatten(), lats_target.flatten()
+        xt, yt, zt = lat_lon.lon_lat_to_cartesian(lons1d, lats1d)
+
+        dists, indices = self.kdtree.query(list(zip(xt, yt, zt)))
 
-        field = df_mean.values
-        return np.ma.masked_where(np.isnan(field), field)
+        nt = daily_clim_fields.shape[0]
+        clim_fields = daily_clim_fields.reshape((nt, -1))[:, indices].reshape((nt,) + lons_target.shape)
+        return times, clim_fields
 
 
     def get_longest_rain_event_durations(self):
@@ -263,12 +249,57 @@ class AnuSplinManager(BaseDataManager):
 
 
 
-def _reader(x):
-    paths, day_of_month, nc_varname = x
-    ds_list = [Dataset(path) for path in paths]
-    mean_for_day = np.asarray([ds.variables[nc_varname][day_of_month - 1, :, :] for ds in ds_list]).mean(axis=0)
-    [ds.close() for ds in ds_list]
-    return mean_for_day
+def _monthly_file_reducer(x):
+    """
+    Read a monthly file once and calculate sums and counts of the valid values for each day of the month
+    :param x: (path, month, nc_varname)
+    :return: month, sums and counts of shape (ndays, ni, nj), Feb 29 is dropped
+    """
+    path, month, nc_varname = x
+    ds = Dataset(path)
+    month_days = ds.variables["time"][:] if month != 2 else list(range(1, 29))
+    data = ds.variables[nc_varname][:]
+    ds.close()
+
+    data = np.ma.filled(np.ma.masked_invalid(data).astype(np.float64), np.nan)
+
+    month_sum = np.zeros((len(month_days),) + data.shape[1:])
+    month_count = np.zeros((len(month_days),) + data.shape[1:], dtype=np.int32)
+    for i, day in enumerate(month_days):
+        field = data[int(day) - 1]
+        valid = ~np.isnan(field)
+        month_sum[i][valid] = field[valid]
+        month_count[i] = valid
+
+    return month, month_sum, month_count
+
+
+def _write_daily_clim_cache(cache_file, times, daily_clim_fields):
+    tmp_file = cache_file + ".tmp"
+    ds = Dataset(tmp_file, mode="w")
+    ds.createDimension("time", len(times))
+    ds.createDimension("x", daily_clim_fields.shape[1])
+    ds.createDimension("y", daily_clim_fields.shape[2])
+
+    time_var = ds.createVariable("time", "i4", ("time",))
+    time_var.units = "days since {:%Y-%m-%d}".format(times[0])
+    time_var[:] = [(t - times[0]).days for t in times]
+
+    clim_var = ds.createVariable("daily_climatology", "f4", ("time", "x", "y"), zlib=True, fill_value=np.nan)
+    clim_var[:] = daily_clim_fields
+    ds.close()
+
+    os.rename(tmp_file, cache_file)
+
+
+def _read_daily_clim_cache(cache_file):
+    ds = Dataset(cache_file)
+    time_var = ds.variables["time"]
+    t0 = datetime.strptime(time_var.units.split()[-1], "%Y-%m-%d")
+    times = [t0 + timedelta(days=int(d)) for d in time_var[:]]
+    daily_clim_fields = np.ma.masked_invalid(ds.variables["daily_climatology"][:])
+    ds.close()
+    return times, daily_clim_fields
 
 
 def demo_seasonal_mean():
@@ -295,18 +326,10 @@ def demo():
     application_properties.set_current_directory()
     am = AnuSplinManager()
     t0 = time.clock()
-    df = am.get_daily_climatology_fields()
+    times, daily_clim_fields = am.get_daily_climatology_fields()
     print("Execution time: {0} seconds".format(time.clock() - t0))
-    # x,t,y - the order of the axes
-
-
 
-    print(dir(df))
-    df = df.fillna(value=np.nan)
-
-    annual_mean = np.mean(df.values[:, :, :], axis=1)
-
-    annual_mean = np.ma.masked_where(~(annual_mean == annual_mean), annual_mean)
+    annual_mean = daily_clim_fields.mean(axis=0)
     import matplotlib.pyplot as plt
 
     b = Basemap(resolution="l")
@@ -314,18 +337,16 @@ def demo():
     x, y = b(am.lons2d, am.lats2d)
 
     plt.figure()
-    b.pcolormesh(x, y, annual_mean.transpose())
+    b.pcolormesh(x, y, annual_mean)
     b.drawcoastlines()
     b.colorbar()
 
-    monthly_means = df.groupby(lambda d: d.month).mean()
-
+    months = np.array([t.month for t in times])
     for the_month in range(1, 13):
         plt.figure()
         plt.title("{0}".format(the_month))
 
-        v = monthly_means.values[:, the_month - 1, :].transpose()
-        v = np.ma.masked_invalid(v)
+        v = daily_clim_fields[months == the_month].mean(axis=0)
         b.pcolormesh(x, y, v)
         b.drawcoastlines()
         b.colorbar()
@@ -0,0 +1,98 @@
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from data.timeseries import TimeSeries
+
+__author__ = 'huziy'
+
+
+# Benchmark of the TimeSeries resampling engine against the previous implementation,
+# which built one boolean vector per period in python (O(periods x samples)).
+# The previous implementation is too slow for the full series, so it is timed on the first
+# reference_years years and the time is extrapolated to the full series (the cost of the aggregations
+# is quadratic in the length, the slicing and the lookup of dates are linear).
+
+
+def _loop_monthly_means(times, data):
+    new_times, new_data = [], []
+    t0 = datetime(times[0].year, times[0].month, 1)
+    while t0 <= times[-1]:
+        bool_vector = np.array([(x.month == t0.month) and (x.year == t0.year) for x in times])
+        new_times.append(t0)
+        new_data.append(np.mean(data[bool_vector]))
+        t0 = t0.replace(month=t0.month + 1) if t0.month < 12 else t0.replace(year=t0.year + 1, month=1)
+    return new_times, new_data
+
+
+def _loop_daily_means(times, data):
+    new_times, new_data = [], []
+    t0 = datetime(times[0].year, times[0].month, times[0].day)
+    while t0 <= times[-1]:
+        bool_vector = np.array([(x.day == t0.day) and (x.month == t0.month) and (x.year == t0.year) for x in times])
+        new_times.append(t0)
+        new_data.append(np.mean(data[bool_vector]))
+        t0 += timedelta(days=1)
+    return new_times, new_data
+
+
+def _loop_time_slice(times, data, start_date, end_date):
+    bool_vector = np.array([start_date <= t <= end_date for t in times])
+    return list(filter(lambda t: start_date <= t <= end_date, times)), data[bool_vector]
+
+
+def _loop_data_for_dates(times, data, the_dates):
+    the_dict = dict(list(zip(times, data)))
+    return np.array([the_dict[x] for x in the_dates])
+
+
+def _timeit(func, *args):
+    t0 = time.perf_counter()
+    result = func(*args)
+    return time.perf_counter() - t0, result
+
+
+def main(start_year=1981, n_years=30, dt_hours=3, reference_years=2):
+    start = datetime(start_year, 1, 1)
+    end = datetime(start_year + n_years, 1, 1)
+    nt = int((end - start).total_seconds() // (dt_hours * 3600))
+
+    times = [start + timedelta(hours=dt_hours * i) for i in range(nt)]
+    data = np.random.rand(nt)
+    print("{} years of {}-hourly data: {} samples".format(n_years, dt_hours, nt))
+
+    n_ref = int((datetime(start_year + reference_years, 1, 1) - start).total_seconds() // (dt_hours * 3600))
+    scale = (float(nt) / n_ref) ** 2
+
+    obs_dates = [start + timedelta(days=i) for i in range(0, n_years * 365, 3)]
+    slice_limits = (datetime(start_year + 5, 3, 1), datetime(start_year + 20, 11, 30))
+    ref_slice_limits = (datetime(start_year, 3, 1), datetime(start_year + reference_years - 1, 11, 30))
+
+    cases = [
+        ("monthly means", lambda ts: ts.get_ts_of_monthly_means(), _loop_monthly_means, ()),
+        ("daily means", lambda ts: ts.get_ts_of_daily_means(), _loop_daily_means, ()),
+        ("time slice", lambda ts: ts.time_slice(*slice_limits), _loop_time_slice, ref_slice_limits),
+        ("data for dates", lambda ts: ts.get_data_for_dates(obs_dates), _loop_data_for_dates,
+         ([d for d in obs_dates if d < times[n_ref - 1]], )),
+        ("monthly max", lambda ts: ts.resample(freq="M", how="max"), None, ()),
+    ]
+
+    print("{:20s}{:>15s}{:>15s}{:>30s}".format("", "engine, s", "repeated, s", "previous (estimated), s"))
+    for name, engine_func, loop_func, loop_args in cases:
+        # the first call on a new object includes the conversion of the time axis to numpy.datetime64
+        ts = TimeSeries(data=data, time=times)
+        t_engine, _ = _timeit(engine_func, ts)
+        t_repeated, _ = _timeit(engine_func, ts)
+
+        if loop_func is None:
+            print("{:20s}{:15.3f}{:15.3f}{:>30s}".format(name, t_engine, t_repeated, "-"))
+            continue
+
+        the_scale = scale if name in ("monthly means", "daily means") else float(nt) / n_ref
+        t_loop, _ = _timeit(loop_func, times[:n_ref], data[:n_ref], *loop_args)
+        print("{:20s}{:15.3f}{:15.3f}{:30.2f}".format(name, t_engine, t_repeated, t_loop * the_scale))
+
+
+if __name__ == '__main__':
+    main()
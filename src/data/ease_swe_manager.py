@@ -14,7 +14,10 @@ from collections import OrderedDict
 
 import numpy as np
 import os
-import struct
+import json
+import hashlib
+
+import tables as tb
 
 from mpl_toolkits.basemap import Basemap
 from pyresample import geometry, kd_tree
@@ -38,17 +41,19 @@ LONLAT_CONVERSION_COEF = 100000.0
 
 
 
-def _get_array_from_file(path, nbytes_per_field=NBYTES_PER_FIELD_SWE, dtype="h", mask_negative=False):
-    data_bin = open(path, mode="rb").read()
-    ncols = (len(data_bin) // nbytes_per_field) ** 0.5
-    ncols = int(ncols + 0.5)
-    nrows = ncols
+def _memmap_field(path, dtype="h"):
+    """
+    :param dtype: struct code of the little-endian integers in the file (h - 16 bit, i - 32 bit)
+    :return: memory-mapped (nrows, ncols) array in the order of the file (the top row first)
+    """
+    data = np.memmap(path, dtype="<{}".format(dtype), mode="r")
+    ncols = int(len(data) ** 0.5 + 0.5)
+    return data.reshape(ncols, ncols)
 
-    v = struct.unpack("<{}{}".format(ncols * nrows, dtype), data_bin)
 
-    arr = np.array(v)
-    arr = arr.reshape(nrows, ncols)
-    arr = np.flipud(arr).astype(float)
+def _get_array_from_file(path, nbytes_per_field=NBYTES_PER_FIELD_SWE, dtype="h", mask_negative=False):
+    assert np.dtype(dtype).itemsize == nbytes_per_field
+    arr = np.flipud(_memmap_field(path, dtype=dtype)).astype(float)
 
     if mask_negative:
         arr = np.ma.masked_where(arr < 0, arr)
@@ -63,18 +68,187 @@ def _get_year_and_month(filename):
 
 
 
+# the cube is saved in the current directory (the data folders are not necessarily writable),
+# the name depends on the data and numdays folders, so that the cubes of different folders do not overwrite each other
+CUBE_FILE_NAME_FORMAT = "ease_swe_cube_{}.hdf"
+
+
+def get_default_cube_path(data_folder="", numdays_folder=""):
+    h = hashlib.sha1()
+    for folder in [data_folder, numdays_folder]:
+        h.update(os.path.abspath(folder).encode("utf-8"))
+        h.update(b"\0")
+    return CUBE_FILE_NAME_FORMAT.format(h.hexdigest()[:12])
+
+
+class SweCube(object):
+    def __init__(self, data_folder="", numdays_folder="", cube_path=None, block_size=12):
+        """
+        (time, y, x) cubes of the monthly SWE and of the numbers of days in the monthly means, built from the
+        binary files on first use and saved in a compressed hdf file together with the date index.
+        The cube is rebuilt when the files in the data or numdays folders change (names, sizes, modification times).
+        The fields are oriented as the ones returned by _get_array_from_file, the negative values are masked.
+        :param cube_path: get_default_cube_path(data_folder, numdays_folder) if None
+        :param block_size: maximum number of consecutive fields read at once from the cube when calculating the means
+        """
+        self.data_folder = data_folder
+        self.numdays_folder = numdays_folder
+        self.cube_path = get_default_cube_path(data_folder, numdays_folder) if cube_path is None else cube_path
+        self.block_size = block_size
+
+        signature = self.get_source_signature()
+        if not self._is_up_to_date(signature):
+            self.build(signature)
+
+        with tb.open_file(self.cube_path) as h:
+            self.years = h.get_node("/", "year")[:]
+            self.months = h.get_node("/", "month")[:]
+
+    def _get_file_names(self):
+        fnames = [fn for fn in os.listdir(self.data_folder) if not fn.startswith(".")]
+        return sorted(fnames, key=_get_year_and_month)
+
+    def get_source_signature(self):
+        result = []
+        for fn in self._get_file_names():
+            for path in [os.path.join(self.data_folder, fn), os.path.join(self.numdays_folder, "{}.num".format(fn))]:
+                if os.path.isfile(path):
+                    st = os.stat(path)
+                    result.append([path, st.st_size, st.st_mtime])
+        return json.dumps(result)
+
+    def _is_up_to_date(self, signature):
+        if not os.path.isfile(self.cube_path):
+            return False
+
+        with tb.open_file(self.cube_path) as h:
+            return getattr(h.root._v_attrs, "source_signature", None) == signature
+
+    def build(self, signature=None):
+        fnames = self._get_file_names()
+        print("Building the SWE cube {} from {} files".format(self.cube_path, len(fnames)))
+
+        tmp_path = self.cube_path + ".tmp"
+        filters = tb.Filters(complevel=5, complib="zlib", shuffle=True)
+        with tb.open_file(tmp_path, "w") as h:
+            shape = _memmap_field(os.path.join(self.data_folder, fnames[0])).shape
+            swe = h.create_carray("/", "swe", atom=tb.Int16Atom(), shape=(len(fnames), ) + shape, filters=filters,
+                                  chunkshape=(1, ) + shape)
+            numdays = h.create_carray("/", "numdays", atom=tb.Int16Atom(), shape=(len(fnames), ) + shape,
+                                      filters=filters, chunkshape=(1, ) + shape)
+
+            for t, fn in enumerate(fnames):
+                swe[t] = np.flipud(_memmap_field(os.path.join(self.data_folder, fn)))
+
+                numdays_path = os.path.join(self.numdays_folder, "{}.num".format(fn))
+                numdays[t] = np.flipud(_memmap_field(numdays_path)) if os.path.isfile(numdays_path) else -1
+
+            year_month = np.array([_get_year_and_month(fn) for fn in fnames], dtype=int).reshape((-1, 2))
+            h.create_array("/", "year", year_month[:, 0])
+            h.create_array("/", "month", year_month[:, 1])
+            h.root._v_attrs.source_signature = self.get_source_signature() if signature is None else signature
+
+        os.rename(tmp_path, self.cube_path)
+
+    def get_time_indices(self, start_year=-np.inf, end_year=np.inf, months=None):
+        sel = (self.years >= start_year) & (self.years <= end_year)
+        if months is not None:
+            sel &= np.isin(self.months, list(months))
+        return np.where(sel)[0]
+
+    def get_fields_for_date_range(self, start_date=None, end_date=None):
+        """
+        :return: years, months, masked array (time, y, x) of the fields for the months between the dates
+        """
+        ym = self.years * 12 + self.months - 1
+        sel = np.ones(len(ym), dtype=bool)
+        if start_date is not None:
+            sel &= ym >= start_date.year * 12 + start_date.month - 1
+        if end_date is not None:
+            sel &= ym <= end_date.year * 12 + end_date.month - 1
+
+        indices = np.where(sel)[0]
+        with tb.open_file(self.cube_path) as h:
+            data = h.root.swe[indices[0]:indices[-1] + 1] if len(indices) else np.zeros((0, ) + h.root.swe.shape[1:])
+
+        data = data[indices - indices[0]] if len(indices) else data
+        return self.years[indices], self.months[indices], np.ma.masked_less(data.astype(float), 0)
+
+    def _iter_blocks(self, h, indices, node_name="swe"):
+        """
+        The fields for the indices, each contiguous run of the indices is read in slices of at most block_size fields,
+        so that only the requested fields are decompressed
+        :return: generator of (indices of the block, fields of the block)
+        """
+        indices = np.asarray(indices)
+        if not len(indices):
+            return
+
+        node = h.get_node("/", node_name)
+        run_starts = np.concatenate(([0], np.where(np.diff(indices) != 1)[0] + 1, [len(indices)]))
+        for r0, r1 in zip(run_starts[:-1], run_starts[1:]):
+            for i in range(r0, r1, self.block_size):
+                block = indices[i:min(i + self.block_size, r1)]
+                yield block, node[block[0]:block[-1] + 1]
+
+    def get_monthly_means(self, start_year=-np.inf, end_year=np.inf, months=range(1, 13)):
+        """
+        :return: OrderedDict {month: mean field over the years (masked where there are no valid values)}
+        """
+        result = OrderedDict()
+        with tb.open_file(self.cube_path) as h:
+            for m in months:
+                the_sum, count = 0, 0
+                for _, block in self._iter_blocks(h, self.get_time_indices(start_year, end_year, [m])):
+                    valid = block >= 0
+                    the_sum = the_sum + np.where(valid, block, 0).sum(axis=0, dtype=np.float64)
+                    count = count + valid.sum(axis=0)
+                result[m] = np.ma.masked_where(np.asarray(count) == 0, the_sum / np.maximum(count, 1))
+        return result
+
+    def get_weighted_mean(self, indices):
+        """
+        Mean of the fields weighted by the numbers of days (the fields and the weights are masked where negative)
+        """
+        num, den, n_valid = 0, 0, 0
+        with tb.open_file(self.cube_path) as h:
+            for block_indices, block in self._iter_blocks(h, indices):
+                weights = h.root.numdays[block_indices[0]:block_indices[-1] + 1]
+                valid = (block >= 0) & (weights >= 0)
+                weights = np.where(weights >= 0, weights, 0).astype(np.float64)
+                num = num + np.where(valid, block * weights, 0).sum(axis=0)
+                den = den + weights.sum(axis=0)
+                n_valid = n_valid + valid.sum(axis=0)
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return np.ma.masked_where((np.asarray(n_valid) == 0) | (np.asarray(den) == 0), num / den)
+
+
 class EaseSweManager(object):
 
     def __init__(self, data_folder="/RESCUE/skynet3_rech1/huziy/obs_data/SWE/NSIDC-EASE-grid-monthly/nsidc0271v01/north/all",
-                 numdays_folder="/HOME/huziy/skynet3_rech1/obs_data/SWE/NSIDC-EASE-grid-monthly/nsidc0271v01/north/numdays"):
+                 numdays_folder="/HOME/huziy/skynet3_rech1/obs_data/SWE/NSIDC-EASE-grid-monthly/nsidc0271v01/north/numdays",
+                 cube_path=None):
 
         self.data_folder = data_folder
         self.numdays_folder = numdays_folder
+        self.cube_path = cube_path
+        self._cube = None
 
         self.lons = _get_array_from_file(LONS_PATH, nbytes_per_field=NBYTES_PER_FIELD_LON_LAT, dtype="i") / LONLAT_CONVERSION_COEF
         self.lats = _get_array_from_file(LATS_PATH, nbytes_per_field=NBYTES_PER_FIELD_LON_LAT, dtype="i") / LONLAT_CONVERSION_COEF
         self.kdtree = None
 
+    @property
+    def cube(self):
+        """
+        SweCube of the data, built or rebuilt when needed
+        """
+        if self._cube is None:
+            self._cube = SweCube(data_folder=self.data_folder, numdays_folder=self.numdays_folder,
+                                 cube_path=self.cube_path)
+        return self._cube
+
 
     def get_seasonal_clim_interpolated_to(self, target_lon2d=None, target_lat2d=None, season_to_months=None, start_year=-np.Inf, end_year=np.Inf):
         season_to_clim = self.get_seasonal_clim(season_to_months=season_to_months, start_year=start_year, end_year=end_year)
@@ -109,39 +283,15 @@ class EaseSweManager(object):
         """
         season_to_clim_field = OrderedDict()
 
+        # each month is attributed to the first season containing it
+        assigned = set()
+        for season, months in season_to_months.items():
+            the_months = [m for m in months if m not in assigned]
+            assigned.update(the_months)
 
-        # select files for each season
-        season_to_file_list = OrderedDict([(s, []) for s in season_to_months])
-        season_to_nday_list = OrderedDict([(s, []) for s in season_to_months])
-        for fn in os.listdir(self.data_folder):
-            y, m = _get_year_and_month(fn)
-
-
-            if y < start_year or y > end_year:
-                continue
-
-
-            for season, months in season_to_months.items():
-                if m in months:
-                    season_to_file_list[season].append(os.path.join(self.data_folder, fn))
-                    season_to_nday_list[season].append(os.path.join(self.numdays_folder, "{}.num".format(fn)))
-                    break
-
-
-
-        # Calculate seasonal means
-        for season, flist in season_to_file_list.items():
-
-            all_for_season = np.ma.array([_get_array_from_file(os.path.join(self.data_folder, fp), mask_negative=True) for fp in flist])
-            weights = np.ma.asarray([_get_array_from_file(os.path.join(self.data_folder, fp), mask_negative=True) for fp in season_to_nday_list[season]]).astype(float)
-            weights /= weights.sum(axis=0)[np.newaxis, :, :]
-
-
-            print(weights.sum(), len(weights))
-
-            print(weights.min(), weights.max())
-            season_to_clim_field[season] = np.ma.sum(all_for_season * weights, axis=0)
-
+            # mean weighted by the number of days
+            indices = self.cube.get_time_indices(start_year=start_year, end_year=end_year, months=the_months)
+            season_to_clim_field[season] = self.cube.get_weighted_mean(indices)
 
         return season_to_clim_field
 
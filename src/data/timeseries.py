@@ -7,6 +7,82 @@ __author__ = 'huziy'
 
 import numpy as np
 
+# Resampling engine: the time axis is converted once to numpy.datetime64 and then to integer period codes
+# (i.e. months since 1970-01), so that each aggregation is a single pass over the samples.
+
+# numpy datetime64 units of the supported periods
+FREQ_TO_UNIT = {
+    "Y": "Y",
+    "M": "M",
+    "D": "D",
+    "H": "h"
+}
+
+
+def to_datetime64(times):
+    """
+    :param times: list of datetime objects (or numpy.datetime64 array)
+    """
+    return np.asarray(times).astype("datetime64[s]")
+
+
+def get_period_codes(times64, freq="M"):
+    """
+    :param times64: numpy.datetime64 array
+    :param freq: one of the keys of FREQ_TO_UNIT
+    :return: integer codes of the periods (i.e. the number of months since 1970-01 for freq="M")
+    """
+    return times64.astype("datetime64[{}]".format(FREQ_TO_UNIT[freq])).astype(np.int64)
+
+
+def aggregate_by_codes(codes, data, how="mean"):
+    """
+    Aggregate the data (along the first axis) for each distinct code in a single pass
+    :param how: mean, sum, min, max or count
+    :return: sorted unique codes, aggregated values
+    """
+    data = np.asarray(data)
+    if len(codes) and np.all(codes[1:] >= codes[:-1]):
+        # the usual case of the time ordered data
+        order = None
+        sorted_codes = codes
+    else:
+        order = np.argsort(codes, kind="mergesort")
+        sorted_codes = codes[order]
+
+    is_start = np.ones(len(sorted_codes), dtype=bool)
+    is_start[1:] = sorted_codes[1:] != sorted_codes[:-1]
+    starts = np.where(is_start)[0]
+    unique_codes = sorted_codes[starts]
+
+    counts = np.diff(np.append(starts, len(sorted_codes)))
+    if how == "count":
+        return unique_codes, counts
+
+    sorted_data = data if order is None else data[order]
+    if not len(starts):
+        return unique_codes, sorted_data[:0]
+
+    if how in ("mean", "sum"):
+        sums = np.add.reduceat(sorted_data.astype(np.float64), starts, axis=0)
+        if how == "sum":
+            return unique_codes, sums
+        return unique_codes, sums / counts.reshape((-1,) + (1,) * (sums.ndim - 1))
+    elif how == "min":
+        return unique_codes, np.minimum.reduceat(sorted_data, starts, axis=0)
+    elif how == "max":
+        return unique_codes, np.maximum.reduceat(sorted_data, starts, axis=0)
+
+    raise ValueError("Unknown aggregation: {}".format(how))
+
+
+def codes_to_dates(codes, freq="M"):
+    """
+    :return: list of datetime objects corresponding to the starts of the periods
+    """
+    return codes.astype("datetime64[{}]".format(FREQ_TO_UNIT[freq])).astype("datetime64[s]").tolist()
+
+
 class TimeSeries:
     def __init__(self, data = None, time = None):
 
@@ -21,14 +97,54 @@ class TimeSeries:
 
 
         self.stamp_day_dates = None
+
+        # the time axis converted to numpy.datetime64 (see self.times64)
+        self._times64 = None
+        self._times64_source = None
         pass
 
+    @property
+    def times64(self):
+        """
+        The time axis as numpy.datetime64, converted once (again only if self.time is replaced)
+        """
+        if self._times64 is None or self._times64_source is not self.time:
+            self._times64 = to_datetime64(self.time)
+            self._times64_source = self.time
+        return self._times64
+
+    def _new_ts(self, times, data):
+        ts = TimeSeries(data=data, time=times)
+        ts.metadata = self.metadata
+        return ts
+
+    def resample(self, freq="D", how="mean"):
+        """
+        :param freq: Y, M, D or H
+        :param how: mean, sum, min, max or count
+        :return: TimeSeries with one value per period containing data (the periods start times as the dates)
+        """
+        codes, values = aggregate_by_codes(get_period_codes(self.times64, freq), self.data, how=how)
+        return self._new_ts(codes_to_dates(codes, freq), values)
+
     def get_data_for_dates(self, the_dates):
         """
         Used to select data for the same dates as for obsevations
         """
-        the_dict = dict(list(zip(self.time, self.data)))
-        return np.array([the_dict[x] for x in the_dates])
+        times64 = self.times64
+        order = np.argsort(times64, kind="mergesort")
+        sorted_times = times64[order]
+
+        targets = to_datetime64(the_dates)
+        pos = np.searchsorted(sorted_times, targets)
+        pos_ok = np.minimum(pos, len(sorted_times) - 1)
+        found = (pos < len(sorted_times)) & (sorted_times[pos_ok] == targets)
+        if not np.all(found):
+            raise KeyError(the_dates[np.where(~found)[0][0]])
+
+        # the last of the equal dates is used, as for a dict built from the time series
+        last = np.searchsorted(sorted_times, targets, side="right") - 1
+        return np.asarray(self.data)[order[last]]
 
 
     def get_ts_of_dt_means(self, dt = timedelta(days = 1)):
@@ -36,88 +152,38 @@ class TimeSeries:
         pass
 
     def time_slice(self, start_date, end_date):
-        bool_vector = np.array( [start_date <= t <= end_date for t in self.time] )
+        times64 = self.times64
+        bool_vector = (times64 >= np.datetime64(start_date, "s")) & (times64 <= np.datetime64(end_date, "s"))
 
-        new_times =  list( filter( lambda t: start_date <= t <= end_date, self.time))
-        #print bool_vector
+        new_times = [t for t, b in zip(self.time, bool_vector) if b]
         new_data = np.array(self.data)[bool_vector]
-        ts = TimeSeries(time=new_times, data=new_data)
-        ts.metadata = self.metadata
-        return ts
+        return self._new_ts(new_times, new_data)
 
+    def _check_no_gaps(self, codes, freq):
+        n_expected = codes[-1] - codes[0] + 1
+        assert len(codes) == n_expected, "No data for {}".format(
+            codes_to_dates(np.setdiff1d(np.arange(codes[0], codes[-1] + 1), codes)[:1], freq)[0])
 
     def get_ts_of_monthly_means(self):
         """
-        returns Timeseries obt containing daily means
+        returns Timeseries obt containing monthly means
         """
-        new_times = []
-        new_data = []
-        t0 = self.time[0]
-        t0 = datetime(t0.year, t0.month, 1)
-
-        end_date = self.time[-1]
-        end_date = datetime(end_date.year, end_date.month, end_date.day)
-        if end_date.day != 1:
-            if end_date.month + 1 <= 12:
-                end_date = end_date.replace(month=end_date.month + 1, day=1)
-            else:
-                end_date = end_date.replace(year=end_date.year + 1, month=1, day=1)
-
         self.data = np.array(self.data)
-        print(end_date)
-        while t0 < end_date:
-            bool_vector = np.array( [(x.month == t0.month) and
-                                                  (x.year == t0.year) for x in self.time] )
-
-            assert np.any(bool_vector), t0
-            new_times.append(t0)
-            new_data.append(np.mean(self.data[bool_vector]))
-
-            if t0.month + 1 <= 12:
-                t0 = t0.replace(month=t0.month + 1)
-            else:
-                t0 = t0.replace(year=t0.year + 1,month=1)
-
-        print("initial data = from {0} to {1}".format(min(self.data), max(self.data)))
-        print("monthly means = from {0} to {1}".format(min(new_data), max(new_data)))
-        ts = TimeSeries(data=np.array(new_data), time=new_times)
-        ts.metadata = self.metadata
+        ts = self.resample(freq="M", how="mean")
+        self._check_no_gaps(get_period_codes(to_datetime64(ts.time), "M"), "M")
+
+        print("initial data = from {0} to {1}".format(self.data.min(), self.data.max()))
+        print("monthly means = from {0} to {1}".format(ts.data.min(), ts.data.max()))
         return ts
 
     def get_ts_of_monthly_integrals_in_time(self):
         """
-        returns Timeseries obt containing daily means,
+        returns Timeseries obt containing monthly sums,
         Note: the result is not multiplied by timestep
         """
-        new_times = []
-        new_data = []
-        t0 = self.time[0]
-        t0 = datetime(t0.year, t0.month, 1)
-
-        end_date = self.time[-1]
-        if end_date.day != 1:
-            if end_date.month + 1 <= 12:
-                end_date = end_date.replace(month=end_date.month + 1, day=1)
-            else:
-                end_date = end_date.replace(year=end_date.year + 1, month=1, day=1)
-
         self.data = np.array(self.data)
-        print(end_date)
-        while t0 < end_date:
-            bool_vector = np.array( [(x.month == t0.month) and
-                                                  (x.year == t0.year) for x in self.time] )
-
-            assert np.any(bool_vector), t0
-            new_times.append(t0)
-            new_data.append(np.sum(self.data[bool_vector]))
-
-            if t0.month + 1 <= 12:
-                t0 = t0.replace(month=t0.month + 1)
-            else:
-                t0 = t0.replace(year=t0.year + 1,month=1)
-
-        ts = TimeSeries(data=np.array(new_data), time=new_times)
-        ts.metadata = self.metadata
+        ts = self.resample(freq="M", how="sum")
+        self._check_no_gaps(get_period_codes(to_datetime64(ts.time), "M"), "M")
         return ts
 
 
@@ -126,51 +192,32 @@ class TimeSeries:
         """
         returns Timeseries obt containing daily means
         """
-        day = timedelta(days = 1)
-
-        new_times = []
-        new_data = []
-        t0 = self.time[0]
-        t0 = datetime(t0.year, t0.month, t0.day)
-
         self.data = np.array(self.data)
-        while t0 <= self.time[-1]:
-            bool_vector = np.array( [(x.day == t0.day) and
-                                                  (x.month == t0.month) and
-                                                  (x.year == t0.year) for x in self.time] )
+        ts = self.resample(freq="D", how="mean")
+        self._check_no_gaps(get_period_codes(to_datetime64(ts.time), "D"), "D")
 
-
-            assert np.any(bool_vector), t0
-            new_times.append(t0)
-            new_data.append(np.mean(self.data[bool_vector]))
-            t0 += day
-
-        print("initial data = from {0} to {1}".format(min(self.data), max(self.data)))
-        print("daily means = from {0} to {1}".format(min(new_data), max(new_data)))
-        ts = TimeSeries(data=np.array(new_data), time=new_times)
-        ts.metadata = self.metadata
+        print("initial data = from {0} to {1}".format(self.data.min(), self.data.max()))
+        print("daily means = from {0} to {1}".format(ts.data.min(), ts.data.max()))
         return ts
-        pass
 
     def get_mean(self, months = range(1,13)):
         """
         returns mean over the months speciifed in the
         months parameter
         """
-        bool_vector = [x.month in months for x in self.time]
-        indices = np.where(bool_vector)[0]
-        return np.mean(self.data[indices])
+        the_months = get_period_codes(self.times64, "M") % 12 + 1
+        return np.mean(np.asarray(self.data)[np.isin(the_months, list(months))])
 
     def get_monthly_normals(self):
         """
         returns the list of 12 monthly normals corresponding
         to the 12 months [0->Jan, ..., 11->Dec]
         """
+        the_months = get_period_codes(self.times64, "M") % 12 + 1
         result = np.zeros((12,))
-        for m in range(1, 13):
-            bool_vector = [x.month == m for x in self.time]
-            indices = np.where(bool_vector)[0]
-            result[m - 1] = np.mean(np.array(self.data)[indices])
+        months, means = aggregate_by_codes(the_months, np.asarray(self.data, dtype=np.float64), how="mean")
+        result[:] = np.nan
+        result[months - 1] = means
         return result
 
 
@@ -138,8 +138,7 @@ class GridConfig(object):
         if not folder.is_dir():
             folder.mkdir()
 
-        lonr = [(i - (self.iref - 1)) * self.dx + self.xref for i in range(self.ni)]
-        latr = [(j - (self.jref - 1)) * self.dy + self.yref for j in range(self.nj)]
+        lons_c, lats_c = self.get_corner_lons_lats_2d()
 
         margin = 0
         if free_zone_only:
@@ -155,18 +154,14 @@ class GridConfig(object):
             export_mask = np.ones((self.ni, self.nj), dtype=bool)
 
         for i in range(start_i, end_i + 1):
-            x = lonr[i]
-
             for j in range(start_j, end_j + 1):
-                y = latr[j]
-
                 if not export_mask[i, j]:
                     continue
 
-                p00 = self.rll.toGeographicLonLat(x - self.dx / 2.0, y - self.dy / 2.0)
-                p01 = self.rll.toGeographicLonLat(x - self.dx / 2.0, y + self.dy / 2.0)
-                p11 = self.rll.toGeographicLonLat(x + self.dx / 2.0, y + self.dy / 2.0)
-                p10 = self.rll.toGeographicLonLat(x + self.dx / 2.0, y - self.dy / 2.0)
+                p00 = (lons_c[i, j], lats_c[i, j])
+                p01 = (lons_c[i, j + 1], lats_c[i, j + 1])
+                p11 = (lons_c[i + 1, j + 1], lats_c[i + 1, j + 1])
+                p10 = (lons_c[i + 1, j], lats_c[i + 1, j])
 
                 w.poly(parts=[
                     [p00, p01, p11, p10]
@@ -232,8 +227,7 @@ class GridConfig(object):
         with fiona.open(str(folder.joinpath(shp_filename)), mode="w", driver="ESRI Shapefile", crs=proj,
                         schema=schema) as output:
 
-            lonr = [(i - (self.iref - 1)) * self.dx + self.xref for i in range(self.ni)]
-            latr = [(j - (self.jref - 1)) * self.dy + self.yref for j in range(self.nj)]
+            lons_c, lats_c = self.get_corner_lons_lats_2d()
 
             margin = 0
             if free_zone_only:
@@ -252,18 +246,14 @@ class GridConfig(object):
             lake_fractions = []
 
             for i in range(start_i, end_i + 1):
-                x = lonr[i]
-
                 for j in range(start_j, end_j + 1):
-                    y = latr[j]
-
                     if not export_mask[i, j]:
                         continue
 
-                    p00 = self.rll.toGeographicLonLat(x - self.dx / 2.0, y - self.dy / 2.0)
-                    p01 = self.rll.toGeographicLonLat(x - self.dx / 2.0, y + self.dy / 2.0)
-                    p11 = self.rll.toGeographicLonLat(x + self.dx / 2.0, y + self.dy / 2.0)
-                    p10 = self.rll.toGeographicLonLat(x + self.dx / 2.0, y - self.dy / 2.0)
+                    p00 = (lons_c[i, j], lats_c[i, j])
+                    p01 = (lons_c[i, j + 1], lats_c[i, j + 1])
+                    p11 = (lons_c[i + 1, j + 1], lats_c[i + 1, j + 1])
+                    p10 = (lons_c[i + 1, j], lats_c[i + 1, j])
 
                     # p00 = (x - self.dx / 2.0, y - self.dy / 2.0)
                     # p01 = (x - self.dx / 2.0, y + self.dy / 2.0)
@@ -337,8 +327,7 @@ class GridConfig(object):
         layer.CreateField(ogr.FieldDefn("i", ogr.OFTInteger))
         layer.CreateField(ogr.FieldDefn("j", ogr.OFTInteger))
 
-        lonr = [(i - (self.iref - 1)) * self.dx + self.xref for i in range(self.ni)]
-        latr = [(j - (self.jref - 1)) * self.dy + self.yref for j in range(self.nj)]
+        lons_c, lats_c = self.get_corner_lons_lats_2d()
 
         margin = 0
         if free_zone_only:
@@ -351,18 +340,14 @@ class GridConfig(object):
         end_j = self.nj - margin - 1
 
         for i in range(start_i, end_i + 1):
-            x = lonr[i]
-
             for j in range(start_j, end_j + 1):
-                y = latr[j]
-
                 # create the feature
                 feature = ogr.Feature(layer.GetLayerDefn())
 
-                p00 = self.rll.toGeographicLonLat(x - self.dx / 2.0, y - self.dy / 2.0)
-                p01 = self.rll.toGeographicLonLat(x - self.dx / 2.0, y + self.dy / 2.0)
-                p11 = self.rll.toGeographicLonLat(x + self.dx / 2.0, y + self.dy / 2.0)
-                p10 = self.rll.toGeographicLonLat(x + self.dx / 2.0, y - self.dy / 2.0)
+                p00 = (lons_c[i, j], lats_c[i, j])
+                p01 = (lons_c[i, j + 1], lats_c[i, j + 1])
+                p11 = (lons_c[i + 1, j + 1], lats_c[i + 1, j + 1])
+                p10 = (lons_c[i + 1, j], lats_c[i + 1, j])
 
                 ring = ogr.Geometry(ogr.wkbLinearRing)
                 ring.AddPoint(*p00)
@@ -424,8 +409,8 @@ class GridConfig(object):
         layer.CreateField(ogr.FieldDefn("i", ogr.OFTInteger))
         layer.CreateField(ogr.FieldDefn("j", ogr.OFTInteger))
 
-        lonr = [(i - (self.iref - 1)) * self.dx + self.xref for i in range(self.ni)]
-        latr = [(j - (self.jref - 1)) * self.dy + self.yref for j in range(self.nj)]
+        # the cell corners in the rotated coordinates
+        lonr_c, latr_c = self.get_rotated_corner_lons_lats_1d()
 
         margin = 0
         if free_zone_only:
@@ -438,18 +423,14 @@ class GridConfig(object):
         end_j = self.nj - margin - 1
 
         for i in range(start_i, end_i + 1):
-            x = lonr[i]
-
             for j in range(start_j, end_j + 1):
-                y = latr[j]
-
                 # create the feature
                 feature = ogr.Feature(layer.GetLayerDefn())
 
-                p00 = (x - self.dx / 2.0, y - self.dy / 2.0)
-                p01 = (x - self.dx / 2.0, y + self.dy / 2.0)
-                p11 = (x + self.dx / 2.0, y + self.dy / 2.0)
-                p10 = (x + self.dx / 2.0, y - self.dy / 2.0)
+                p00 = (lonr_c[i], latr_c[j])
+                p01 = (lonr_c[i], latr_c[j + 1])
+                p11 = (lonr_c[i + 1], latr_c[j + 1])
+                p10 = (lonr_c[i + 1], latr_c[j])
 
                 ring = ogr.Geometry(ogr.wkbLinearRing)
                 ring.AddPoint(*p00)
@@ -570,6 +551,100 @@ class GridConfig(object):
     def get_rot_latlon_proj_obj(self):
         return self.rll
 
+    def get_rotated_lons_lats_1d(self):
+        """
+        :return: rotated longitudes (ni, ) and latitudes (nj, ) of the cell centers
+        """
+        lonr = (np.arange(self.ni) - (self.iref - 1)) * self.dx + self.xref
+        latr = (np.arange(self.nj) - (self.jref - 1)) * self.dy + self.yref
+        return lonr, latr
+
+    def get_lons_lats_2d(self):
+        """
+        :return: geographic longitudes and latitudes (ni, nj) of the cell centers
+        """
+        lonr, latr = self.get_rotated_lons_lats_1d()
+        latr, lonr = np.meshgrid(latr, lonr)
+        return self.rll.toGeographicLonLat(lonr, latr)
+
+    def get_rotated_corner_lons_lats_1d(self):
+        """
+        :return: rotated longitudes (ni + 1) and latitudes (nj + 1) of the cell corners
+        """
+        lonr, latr = self.get_rotated_lons_lats_1d()
+        lonr = np.append(lonr - self.dx / 2.0, lonr[-1] + self.dx / 2.0)
+        latr = np.append(latr - self.dy / 2.0, latr[-1] + self.dy / 2.0)
+        return lonr, latr
+
+    def get_corner_lons_lats_2d(self):
+        """
+        :return: geographic longitudes and latitudes (ni + 1, nj + 1) of the cell corners,
+            the corners of the cell (i, j) are [i, j], [i, j + 1], [i + 1, j + 1] and [i + 1, j]
+        """
+        lonr, latr = self.get_rotated_corner_lons_lats_1d()
+        latr, lonr = np.meshgrid(latr, lonr)
+        return self.rll.toGeographicLonLat(lonr, latr)
+
+    def get_cell_areas_m2(self):
+        return self.rll.get_areas_of_gridcells(self.dx, self.dy, self.ni, self.nj, self.yref, self.jref)
+
+    def lon_lat_to_fractional_ij(self, lons, lats):
+        """
+        Analytic inverse of the grid: 0-based fractional indices, so that the center of the cell (i, j) is at (i, j)
+        :param lons: geographic longitudes (scalar or array)
+        :param lats: geographic latitudes of the same shape
+        """
+        x, y = self.rll.toProjectionXY(lons, lats)
+
+        # rotated longitudes within 180 degrees from the reference longitude
+        x = (x - self.xref + 180.0) % 360.0 - 180.0 + self.xref
+
+        fi = (x - self.xref) / self.dx + self.iref - 1
+        fj = (y - self.yref) / self.dy + self.jref - 1
+        return fi, fj
+
+    def lon_lat_to_ij(self, lons, lats):
+        """
+        :return: 0-based indices of the cells containing the points and the mask of the points inside the grid
+            (the indices of the points outside of the grid are clipped to the grid limits)
+        """
+        fi, fj = self.lon_lat_to_fractional_ij(lons, lats)
+        i = np.round(fi).astype(int)
+        j = np.round(fj).astype(int)
+
+        inside = (i >= 0) & (i < self.ni) & (j >= 0) & (j < self.nj)
+        return np.clip(i, 0, self.ni - 1), np.clip(j, 0, self.nj - 1), inside
+
+    def get_bilinear_weights(self, lons, lats):
+        """
+        Bilinear interpolation weights for the points, the value at a point is
+        sum(weights[..., k] * field[i[k], j[k]]) over the corners k
+        :return: i, j - lists of 4 arrays of the indices of the corners ((i0, j0), (i0 + 1, j0), (i0, j0 + 1),
+            (i0 + 1, j0 + 1)), weights - array (..., 4), mask of the points inside the grid
+        """
+        fi, fj = self.lon_lat_to_fractional_ij(lons, lats)
+
+        inside = (fi >= 0) & (fi <= self.ni - 1) & (fj >= 0) & (fj <= self.nj - 1)
+
+        i0 = np.clip(np.floor(fi).astype(int), 0, self.ni - 2)
+        j0 = np.clip(np.floor(fj).astype(int), 0, self.nj - 2)
+
+        wi = np.clip(fi - i0, 0, 1)
+        wj = np.clip(fj - j0, 0, 1)
+
+        i = [i0, i0 + 1, i0, i0 + 1]
+        j = [j0, j0, j0 + 1, j0 + 1]
+        weights = np.stack([(1 - wi) * (1 - wj), wi * (1 - wj), (1 - wi) * wj, wi * wj], axis=-1)
+        return i, j, weights, inside
+
+    def interpolate_bilinear(self, field, lons, lats):
+        """
+        Interpolate the field (ni, nj) to the points, the points outside of the grid are masked
+        """
+        i, j, weights, inside = self.get_bilinear_weights(lons, lats)
+        result = sum(weights[..., k] * field[i[k], j[k]] for k in range(4))
+        return np.ma.masked_where(~inside, result)
+
     def subgrid(self, i0, j0, di=-1, dj=-1):
 
         """
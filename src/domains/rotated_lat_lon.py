@@ -36,8 +36,7 @@ class RotatedLatLon():
         e2 = (dot_prod * p1 - p2)
         row1 = e2 / np.sqrt(np.dot(e2, e2))
         row2 = cross_prod / np.sqrt(np.dot(cross_prod, cross_prod))
-        self.rot_matrix = np.matrix([row0, row1, row2])
-        assert isinstance(self.rot_matrix, np.matrix)
+        self.rot_matrix = np.array([row0, row1, row2])
 
 
     def write_coords_to_rpn(self, rpnObj, x, y):
@@ -61,23 +60,32 @@ class RotatedLatLon():
         return ig
 
 
+    @staticmethod
+    def _rotate(matrix, lon, lat):
+        """
+        Apply the rotation matrix to the points on the unit sphere, works for scalars and arrays of any shape
+        """
+        p = np.array(lat_lon.lon_lat_to_cartesian(lon, lat, R=1))
+        q = np.tensordot(matrix, p, axes=1)
+
+        lon_out = np.degrees(np.arctan2(q[1], q[0]))
+        lat_out = np.degrees(np.arcsin(np.clip(q[2] / np.sqrt((q ** 2).sum(axis=0)), -1, 1)))
+        return lon_out, lat_out
+
     def toProjectionXY(self, lon, lat):
         """
         Convert geographic lon/lat coordinates to the rotated lat lon coordinates
+        (lon and lat can be scalars or arrays of the same shape)
         """
-
-        p = lat_lon.lon_lat_to_cartesian(lon, lat, R=1)
-        p = self.rot_matrix * np.mat(p).T
-        return lat_lon.cartesian_to_lon_lat(p.A1)
+        return self._rotate(self.rot_matrix, lon, lat)
 
 
     def toGeographicLonLat(self, x, y):
         """
-        convert geographic lat / lon to rotated coordinates
+        convert rotated coordinates to geographic lat / lon
+        (x and y can be scalars or arrays of the same shape)
         """
-        p = lat_lon.lon_lat_to_cartesian(x, y, R=1)
-        p = self.rot_matrix.T * np.mat(p).T
-        return lat_lon.cartesian_to_lon_lat(p.A1)
+        return self._rotate(self.rot_matrix.T, x, y)
 
 
     def get_areas_of_gridcells(self, dlon, dlat, nx, ny, latref, jref):
@@ -90,34 +98,31 @@ class RotatedLatLon():
 
         latref_rad = np.radians(latref)
 
-        lats2d = np.zeros((nx, ny))
-        for j in range(ny):
-            lat = latref_rad + (j - jref + 1) * dy
-            lats2d[:, j] = lat
+        lats1d = latref_rad + (np.arange(ny) - jref + 1) * dy
+        lats2d = np.repeat(lats1d[np.newaxis, :], nx, axis=0)
 
         return self.mean_earth_radius_m_crcm5 ** 2 * np.cos(lats2d) * dx * dy
 
 
     def get_south_pol_coords(self):
-        rot_pole = self.rot_matrix * np.mat([0, 0, -1]).T
-        return lat_lon.cartesian_to_lon_lat(rot_pole.A1)
-        pass
+        rot_pole = np.dot(self.rot_matrix, [0, 0, -1])
+        return lat_lon.cartesian_to_lon_lat(rot_pole)
 
 
     def get_north_pole_coords(self):
         """
         get true coordinates of the rotated north pole
         """
-        rot_pole = self.rot_matrix * np.mat([0, 0, 1]).T
-        return lat_lon.cartesian_to_lon_lat(rot_pole.A1)
+        rot_pole = np.dot(self.rot_matrix, [0, 0, 1])
+        return lat_lon.cartesian_to_lon_lat(rot_pole)
 
 
     def get_true_pole_coords_in_rotated_system(self):
         """
         needed for lon_0 in basemap
         """
-        rot_pole = self.rot_matrix.T * np.mat([0, 0, 1]).T
-        return lat_lon.cartesian_to_lon_lat(rot_pole.A1)
+        rot_pole = np.dot(self.rot_matrix.T, [0, 0, 1])
+        return lat_lon.cartesian_to_lon_lat(rot_pole)
 
 
 
@@ -51,56 +51,203 @@ def _get_slope_data(path=""):
     return np.flipud(data)[:100, :100]
 
 
-def _get_slope_data_by_cols_and_rows(path="", cols=None, rows=None, missing_value=255,
-                                     nrows_total = None, ncols_total = None):
-    # with open(path) as f:
-    #     lines = f.readlines()[6:][::-1]
-    #     data = [[int(lines[row].split()[col]) for row in rows] for col in cols]
+def _get_band_offsets(path="", rows_per_band=256, nheader_lines=6):
+    """
+    Scan the ascii file once and remember the positions of the first rows of the bands,
+    so that the bands can be read independently (i.e. in different processes)
+    :return: list of the byte offsets (the rows are counted from the top of the file)
+    """
+    offsets = []
+    with open(path, "rb") as f:
+        for _ in range(nheader_lines):
+            f.readline()
+
+        row = 0
+        pos = f.tell()
+        line = f.readline()
+        while line.strip():
+            if row % rows_per_band == 0:
+                offsets.append(pos)
+            row += 1
+            pos = f.tell()
+            line = f.readline()
 
+    return offsets
+
+
+def _read_band(path="", offset=0, nrows=1, cols=slice(None)):
+    """
+    Read nrows rows starting at the byte offset
+    :return: numpy.ndarray (nrows, ncols), the first row is the northernmost
     """
+    with open(path, "rb") as f:
+        f.seek(offset)
+        lines = [f.readline().decode() for _ in range(nrows)]
 
-    :param path:
-    :return: numpy.ndarray
+    return np.loadtxt(lines, dtype=np.int16, ndmin=2)[:, cols]
+
+
+def _get_target_windows(lons2d_target, lats2d_target, lons1d_source, lats1d_source, delta_deg=0.05):
+    """
+    Source cells with |lon_source - lon_target| < delta_deg and |lat_source - lat_target| < delta_deg
+    are attributed to a target cell, since the source grid is regular the windows are rectangular.
+    :return: row_start, row_end (rows of the source file, counted from the top),
+        list of the (col_start, col_end) pairs (the second pair is for the longitudes shifted by 360 degrees),
+        all the ends are exclusive
     """
+    lons = lons2d_target.flatten()
+    lats = lats2d_target.flatten()
 
-    imin = min(rows) if rows is not None else 0
-    imax = max(rows)
+    nrows = len(lats1d_source)
+    j_start = np.searchsorted(lats1d_source, lats - delta_deg, side="right")
+    j_end = np.searchsorted(lats1d_source, lats + delta_deg, side="left")
 
-    data = np.genfromtxt(path, skip_header=nrows_total - (imax+1) + 6, 
-                         skip_footer = imin,
-                         dtype=np.uint8, usecols=cols, missing_values=missing_value,
-                         usemask = True)
+    col_ranges = []
+    for the_lons in [lons, np.where(lons < 0, lons + 360, lons - 360)]:
+        col_ranges.append((np.searchsorted(lons1d_source, the_lons - delta_deg, side="right"),
+                           np.searchsorted(lons1d_source, the_lons + delta_deg, side="left")))
 
-    data = np.ma.masked_where(data == missing_value, data)
-    return np.flipud(data)
+    return nrows - j_end, nrows - j_start, col_ranges
 
 
-def fill_missing_values(route_slope, interpolated_slopes,
-                        lons2d=None, lats2d=None):
+def _box_sums(table, row_start, row_end, col_start, col_end):
+    """
+    Sums over the boxes using the summed area table (with a leading row and column of zeros),
+    the empty boxes give 0
+    """
+    row_end = np.maximum(row_end, row_start)
+    col_end = np.maximum(col_end, col_start)
+    return (table[row_end, col_end] - table[row_start, col_end]
+            - table[row_end, col_start] + table[row_start, col_start])
+
+
+def _process_band(args):
+    """
+    Calculate the sums of the slopes, the numbers of the valid and of all the source cells
+    for each target window within the band
+    """
+    paths, offsets, class_medians, band_start, nrows_band, missing_value, col_start0, col_end0, windows = args
+
+    cols = slice(col_start0, col_end0)
+    slope = None
+    is_missing = None
+    for path, offset, med in zip(paths, offsets, class_medians):
+        data = _read_band(path=path, offset=offset, nrows=nrows_band, cols=cols)
+
+        is_missing = (data == missing_value) if is_missing is None else is_missing | (data == missing_value)
+        slope = med * data if slope is None else slope + med * data
+
+    slope = np.where(is_missing, 0.0, slope / 100.0)
+
+    nr, nc = slope.shape
+    sum_table = np.zeros((nr + 1, nc + 1))
+    valid_table = np.zeros((nr + 1, nc + 1))
+    sum_table[1:, 1:] = slope.cumsum(axis=0).cumsum(axis=1)
+    valid_table[1:, 1:] = (~is_missing).cumsum(axis=0).cumsum(axis=1)
+
+    row_start, row_end, col_ranges = windows
+    row_start = np.clip(row_start - band_start, 0, nr)
+    row_end = np.clip(row_end - band_start, 0, nr)
+
+    sums = np.zeros(row_start.shape)
+    valid = np.zeros(row_start.shape)
+    total = np.zeros(row_start.shape)
+    for col_start, col_end in col_ranges:
+        col_start = np.clip(col_start - col_start0, 0, nc)
+        col_end = np.clip(col_end - col_start0, 0, nc)
+        sums += _box_sums(sum_table, row_start, row_end, col_start, col_end)
+        valid += _box_sums(valid_table, row_start, row_end, col_start, col_end)
+        total += np.maximum(row_end - row_start, 0) * np.maximum(col_end - col_start, 0)
 
+    return sums, valid, total
 
+
+def get_slopes_interpolated_to(lons2d_target, lats2d_target, in_path_template="", delta_deg=0.05,
+                               rows_per_band=256, processes=None, min_valid_fraction=0.4):
+    """
+    Average the slopes (calculated from the fractions of the slope classes) over the windows of
+    2 * delta_deg around the target points. The source files are read in bands of rows_per_band rows,
+    the bands are processed in parallel and the statistics for the target cells are accumulated.
+
+    :param processes: number of the processes, if None - the number of cpus
+    :param min_valid_fraction: if the fraction of the valid source cells in the window is smaller,
+        the result is -1 for the target cell
+    :return: 2d array of the slopes (the shape of lons2d_target)
+    """
+    from multiprocessing import Pool
+
+    classes = sorted(SLOPE_CLASS_TO_MEDIAN)
+    paths = [in_path_template.format(sc) for sc in classes]
+    class_medians = [SLOPE_CLASS_TO_MEDIAN[sc] for sc in classes]
+
+    params, lons1d_source, lats1d_source = _get_source_lon_lat(path=paths[0])
+    print(params)
+
+    windows = _get_target_windows(lons2d_target, lats2d_target, lons1d_source, lats1d_source, delta_deg=delta_deg)
+    row_start, row_end, col_ranges = windows
+
+    # Read only the columns and bands covering the target domain
+    non_empty = [c_end > c_start for c_start, c_end in col_ranges]
+    col_start0 = min(c_start[ne].min() for (c_start, _), ne in zip(col_ranges, non_empty) if np.any(ne))
+    col_end0 = max(c_end[ne].max() for (_, c_end), ne in zip(col_ranges, non_empty) if np.any(ne))
+    row_min, row_max = row_start.min(), row_end.max()
+
+    path_to_offsets = [_get_band_offsets(path=p, rows_per_band=rows_per_band) for p in paths]
+    nrows_total = params["nrows"]
+
+    tasks = []
+    for band_index, band_start in enumerate(range(0, nrows_total, rows_per_band)):
+        nrows_band = min(rows_per_band, nrows_total - band_start)
+        if band_start + nrows_band <= row_min or band_start >= row_max:
+            continue
+
+        offsets = [offs[band_index] for offs in path_to_offsets]
+        tasks.append((paths, offsets, class_medians, band_start, nrows_band, params["NODATA_value"],
+                      col_start0, col_end0, windows))
+
+    sums = np.zeros(row_start.shape)
+    valid = np.zeros(row_start.shape)
+    total = np.zeros(row_start.shape)
+
+    pool = Pool(processes=processes)
+    for band_sums, band_valid, band_total in pool.imap_unordered(_process_band, tasks):
+        sums += band_sums
+        valid += band_valid
+        total += band_total
+    pool.close()
+    pool.join()
+
+    interpolated_slopes = -np.ones(row_start.shape)
+    enough_data = (valid > 0) & (valid >= min_valid_fraction * total)
+    interpolated_slopes[enough_data] = sums[enough_data] / valid[enough_data]
+    return interpolated_slopes.reshape(lons2d_target.shape)
+
+
+def fill_missing_values(route_slope, interpolated_slopes,
+                        lons2d=None, lats2d=None):
+    """
+    Use the closest valid slopes where the routing slope is defined, but the interpolated slope is not (< 0)
+    """
     to_fill = (route_slope >= 0) & (interpolated_slopes < 0)
 
     # Only do the filling if necessary
     if not np.any(to_fill):
         return
 
-
-
     correct_slopes = interpolated_slopes >= 0
 
     x, y, z = lat_lon.lon_lat_to_cartesian(lons2d[correct_slopes], lats2d[correct_slopes])
-    ktree = cKDTree(list(zip(x, y, z)))
+    ktree = cKDTree(np.array([x, y, z]).T)
 
     xt, yt, zt = lat_lon.lon_lat_to_cartesian(lons2d[to_fill], lats2d[to_fill])
-    dists, inds = ktree.query(list(zip(xt, yt, zt)))
+    dists, inds = ktree.query(np.array([xt, yt, zt]).T)
     interpolated_slopes[to_fill] = interpolated_slopes[correct_slopes][inds]
 
 
-
 def interpolate_slopes(in_path_template="",
                        in_path_rpn_geophy="/skynet3_rech1/huziy/geof_lake_infl_exp/geophys_Quebec_0.1deg_260x260_with_dd_v6",
-                       out_path_rpn_geophy=None, var_name_with_target_coords="SLOP", delta_deg=0.05):
+                       out_path_rpn_geophy=None, var_name_with_target_coords="SLOP", delta_deg=0.05,
+                       rows_per_band=256, processes=None):
     """
     interpolate slope data at in_path_template (template because there are 8 files, 1 for each class),
     to a grid defined in a geophy file (rpn)
@@ -108,6 +255,8 @@ def interpolate_slopes(in_path_template="",
     :param in_path_template:
     :param in_path_rpn_geophy:
     :param out_path_rpn_geophy:
+    :param rows_per_band: the source files are read in bands of rows, the bands are processed in parallel
+    :param processes: number of the processes used to process the bands
     """
     if out_path_rpn_geophy is None:
         out_path_rpn_geophy = in_path_rpn_geophy + "_with_ITFS"
@@ -179,82 +328,9 @@ def interpolate_slopes(in_path_template="",
     lons2d_target[lons2d_target >= 180] -= 360
 
     # Interpolate and save interflow slopes
-    mat = None
-    params = None
-
-    index_map = {}
-    imin, jmin = np.Inf, np.Inf
-    imax, jmax = -1, -1
-    for sc, med in SLOPE_CLASS_TO_MEDIAN.items():
-        inpath = in_path_template.format(sc)
-        if mat is None:
-            params, lons1d_source, lats1d_source = _get_source_lon_lat(path=inpath)
-            print(params)
-            # build the map of closest indices
-            nx, ny = lons2d_target.shape
-            for i in range(nx):
-                # if not (100 <= i <= 160): continue
-                for j in range(ny):
-                    # if not (100 <= j <= 160): continue
-                    lon_target, lat_target = lons2d_target[i, j], lats2d_target[i, j]
-                    dlon1 = np.abs(lons1d_source - lon_target)
-                    dlon2 = np.abs(lons1d_source - 360 - lon_target) if lon_target < 0 else \
-                        np.abs(lons1d_source + 360 - lon_target)
-
-                    dlat = np.abs(lats1d_source - lat_target)
-                    inds_i = np.where((dlon1 < delta_deg) |
-                                      (dlon2 < delta_deg))[0]
-
-                    inds_j = np.where(dlat < delta_deg)[0]
-                    # assert len(inds_i) > 0 and len(inds_j) > 0
-
-                    imin, jmin = min(imin, inds_i.min()), min(jmin, inds_j.min())
-                    imax, jmax = max(imax, inds_i.max()), max(jmax, inds_j.max())
-
-                    inds_i, inds_j = np.meshgrid(inds_i, inds_j)
-
-                    index_map[(i, j)] = [inds_j.flatten(), inds_i.flatten()]
-                    # print i, j
-        # i <-> longitude <-> columns in the file
-        # j <-> latitude <-> rows in the file
-        tmp_mat = _get_slope_data_by_cols_and_rows(path=inpath,
-                                                   cols=list(range(imin, imax + 1)),
-                                                   rows=list(range(jmin, jmax + 1)),
-                                                   missing_value=params["NODATA_value"],
-                                                   ncols_total = params["ncols"], nrows_total = params["nrows"])
-        #tmp_mat = tmp_mat.astype(int)
-
-        #nodata_pts = (tmp_mat == params["NODATA_value"])
-        #tmp_mat = np.ma.masked_where(nodata_pts, tmp_mat)
-        print(tmp_mat.shape)
-        print(tmp_mat.min(), tmp_mat.max(), tmp_mat.mean())
-        if mat is None:
-            mat = med * tmp_mat
-        else:
-            mat += med * tmp_mat
-
-
-
-    mat /= 100.0
-
-
-    # debug
-    # import matplotlib.pyplot as plt
-    # plt.figure()
-    # plt.pcolormesh(mat)
-    # plt.show()
-
-
-    # compare length scales
-    interpolated_slopes = np.zeros_like(lons2d_target)
-
-    for ij, inds in index_map.items():
-        data = mat[inds[0] - jmin, inds[1] - imin]
-        print(len(data[~data.mask]), np.prod(data.shape, dtype=np.float32), data.shape)
-        if float(len(data[~data.mask])) / np.prod(data.shape, dtype=np.float32) < 0.4:
-            interpolated_slopes[ij[0], ij[1]] = -1
-        else:
-            interpolated_slopes[ij[0], ij[1]] = data[~data.mask].mean()
+    interpolated_slopes = get_slopes_interpolated_to(lons2d_target, lats2d_target,
+                                                     in_path_template=in_path_template, delta_deg=delta_deg,
+                                                     rows_per_band=rows_per_band, processes=processes)
 
     print("ITFS: ", interpolated_slopes.min(), interpolated_slopes.max())
 
@@ -281,7 +357,7 @@ def interpolate_slopes(in_path_template="",
     r_obj_out.close()
 
 
-def main(use_half_of_cols=True):
+def main():
     folder_path = "/home/huziy/skynet3_rech1/Global_terrain_slopes_30s"
     out_filename = "slopes_30s.nc"
     in_fname_pattern = "GloSlopesCl{0}_30as.asc"
@@ -1,12 +1,10 @@
 import os
 from netCDF4 import Dataset
 import geopy
-from geopy import distance
 import numpy as np
 from rpn.rpn import RPN
 from scipy import sparse
-from scipy.spatial.ckdtree import cKDTree
-from util.geo import lat_lon
+from fao_un.interp_and_convert_slope_data_to_rpn import get_slopes_interpolated_to, fill_missing_values
 
 __author__ = 'huziy'
 
@@ -53,7 +51,8 @@ def _get_slope_data(path=""):
 
 def interpolate_slopes(in_path_template="",
                        in_path_rpn_geophy="/skynet3_rech1/huziy/geof_lake_infl_exp/geophys_Quebec_0.1deg_260x260_with_dd_v6",
-                       out_path_rpn_geophy=None, var_name_with_target_coords="Z0"):
+                       out_path_rpn_geophy=None, var_name_with_target_coords="Z0", delta_deg=0.05,
+                       rows_per_band=256, processes=None):
     """
     interpolate slope data at in_path_template (template because there are 8 files, 1 for each class),
     to a grid defined in a geophy file (rpn)
@@ -130,45 +129,14 @@ def interpolate_slopes(in_path_template="",
     lons2d_target, lats2d_target = r_obj_in.get_longitudes_and_latitudes_for_the_last_read_rec()
     #lons2d_target[lons2d_target >= 180] -= 360
 
-    #Interpolate and save interflow slopes
-    mat = None
-    params, lons2d_source, lat2d_source = None, None, None
-    ktree = None
-    for sc, med in SLOPE_CLASS_TO_MEDIAN.items():
-        inpath = in_path_template.format(sc)
-        if mat is None:
-            params, lons2d_source, lat2d_source = _get_source_lon_lat(path=inpath)
-            print(lons2d_target.min(), lons2d_target.max())
-            print(lons2d_source.shape)
-            xs, ys, zs = lat_lon.lon_lat_to_cartesian(lons2d_source.flatten(), lat2d_source.flatten())
-            print("processing slopes of class sc={0}".format(sc))
-            ktree = cKDTree(list(zip(xs, ys, zs)))
-            print("created kdtree..")
-
-        tmp_mat = med * _get_slope_data(path=inpath)
-        if mat is None:
-            mat = tmp_mat
-        else:
-            mat += tmp_mat
-
-    mat /= 100.0
-    xt, yt, zt = lat_lon.lon_lat_to_cartesian(lons2d_target.flatten(), lats2d_target.flatten())
-
-    #compare length scales
-    a_source = distance.GreatCircleDistance(
-        (lat2d_source[0, 0], lons2d_source[0, 0]),
-        (lat2d_source[-1, -1], lons2d_source[-1, -1])).km ** 2 / np.prod(lons2d_source.shape)
-
-    a_target = distance.GreatCircleDistance(
-        (lats2d_target[0, 0], lons2d_target[0, 0]),
-        (lats2d_target[-1, -1], lons2d_target[-1, -1])).km ** 2 / np.prod(lons2d_target.shape)
-
-    nnegihbours = max(int(a_target / a_source), 2)
-    print("nneighbours = {0}".format(nnegihbours))
-    print("a_target = {0} km**2; a_source = {1} km**2".format(a_target, a_source))    
-
-    dists, inds = ktree.query(list(zip(xt, yt, zt)), k=nnegihbours)
-    interpolated_slopes = mat.flatten()[inds].mean(axis=1).reshape(lons2d_target.shape)
+    #Interpolate and save interflow slopes (the source files are streamed in bands of rows)
+    interpolated_slopes = get_slopes_interpolated_to(lons2d_target, lats2d_target,
+                                                     in_path_template=in_path_template, delta_deg=delta_deg,
+                                                     rows_per_band=rows_per_band, processes=processes)
+
+    # the target cells without source pixels (< 0) take the closest valid slopes
+    fill_missing_values(np.zeros_like(interpolated_slopes), interpolated_slopes,
+                        lons2d=lons2d_target, lats2d=lats2d_target)
 
     r_obj_out.write_2D_field(name="ITFS",
                              data=interpolated_slopes, ip=ips_for_sl,
@@ -183,7 +151,7 @@ def interpolate_slopes(in_path_template="",
     r_obj_out.close()
 
 
-def main(use_half_of_cols=True):
+def main():
     folder_path = "/home/huziy/skynet3_rech1/Global_terrain_slopes_30s"
     out_filename = "slopes_30s.nc"
     in_fname_pattern = "GloSlopesCl{0}_30as.asc"
@@ -1,7 +1,8 @@
 from matplotlib.cm import get_cmap
 from matplotlib.colors import BoundaryNorm
 from mpl_toolkits.basemap import Basemap
-from rpn.rpn import RPN
+from converting import rpn_to_nc_service
+from converting.rpn_to_nc_service import ConversionManifest, ConversionTask, VariableSpec
 import netCDF4 as nc
 __author__ = 'huziy'
 
@@ -45,59 +46,17 @@ def diagnose_mean():
     plt.show()
 
 
-def main():
+def main(processes=1):
     rpn_path = "/home/huziy/skynet1_rech3/cordex/for_Samira/Africa_0.44deg_ERA40-Int1.5_E21981-2010/dailyAfrica_0.44deg_ERA40-Int1.5_E21981-2010TRAF"
     nc_path = rpn_path + ".nc"
 
     varname = "TRAF"
-    time_units = "days since 1981-01-01 00:00:00"
 
+    # all the levels of the variable are converted
+    manifest = ConversionManifest([VariableSpec(name=varname, level=None)],
+                                  [ConversionTask([rpn_path], nc_path)])
+    rpn_to_nc_service.convert(manifest, processes=processes)
 
-    rObj = RPN(rpn_path)
-    lons2d, lats2d = rObj.get_longitudes_and_latitudes()
-    rObj.suppress_log_messages()
-    data = rObj.get_4d_field(name=varname)
-
-    rObj.close()
-
-
-    ds = nc.Dataset(nc_path, "w", format="NETCDF3_CLASSIC")
-
-    nx, ny = lons2d.shape
-
-    levels = list(data.items())[0][1].keys()
-
-    ds.createDimension("lon", nx)
-    ds.createDimension("lat", ny)
-    ds.createDimension("level", len(levels))
-    ds.createDimension("time", None)
-
-    var = ds.createVariable(varname, "f4", dimensions=("time","level", "lon", "lat"))
-    lonVar = ds.createVariable("longitude", "f4", dimensions=("lon", "lat"))
-    latVar = ds.createVariable("latitude", "f4", dimensions=("lon", "lat"))
-    timeVar = ds.createVariable("time", "f4", dimensions=("time",))
-
-
-    times_sorted = list( sorted( data.keys() ) )
-    levels_sorted = list( sorted(levels) )
-
-    data_arr = [
-        [ data[t][lev] for lev in levels_sorted ] for t in times_sorted
-    ]
-
-    data_arr = np.array(data_arr)
-    var[:] = data_arr
-
-    timeVar.units = time_units
-    times_num = nc.date2num(times_sorted, time_units)
-    timeVar[:] = times_num
-
-    lonVar[:] = lons2d
-    latVar[:] = lats2d
-    ds.close()
-
-
-    pass
 
 if __name__ == "__main__":
     import application_properties
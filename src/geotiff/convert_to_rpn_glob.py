@@ -1,7 +1,7 @@
 from datetime import datetime
 import time
 from osgeo.gdal import Dataset
-from scipy.spatial.kdtree import KDTree
+from scipy.spatial.ckdtree import cKDTree
 from domains.rotated_lat_lon import RotatedLatLon
 from rpn.rpn import RPN
 from multiprocessing import Pool
@@ -31,97 +31,71 @@ name_to_mult = {
 }
 
 LIMIT_DIST = 50e3 #in meters
-AGGR_SIZE = 2500 #number of the closest high res cells taken for aggragation to a single value of the low resolution grid
-
-def convert(inPath, lonlats):
-
+MIN_USABLE_FRACTION = 0.25 #the cells with the smaller fraction of usable high res pixels are set to no_data (-1)
+ROWS_PER_BLOCK = 512 #number of the raster rows read at once
+
+def convert(inPath, lonlats, rows_per_block=ROWS_PER_BLOCK):
+    """
+    Aggregate the high resolution raster to the points lonlats: each usable pixel is attributed to the closest
+    target point (if it is closer than LIMIT_DIST) and the values are averaged for each target point.
+    The raster is read in blocks of rows_per_block rows.
+    :param inPath: path to the geotiff file (geographic coordinates)
+    :param lonlats: array (npoints, 2) of the longitudes and latitudes of the target points
+    :return: the aggregated values (npoints, ), -1 where there is not enough usable data
+    """
     ds = gdal.Open(inPath, gdal.GA_ReadOnly)
     assert isinstance(ds, Dataset)
     (Xul, deltaX, rotation, Yul, rotation, deltaY) = ds.GetGeoTransform()
-    print(dir(ds))
-    print(ds.GetMetadata_Dict())
     print(ds.GetDescription())
 
-    srs_wkt = ds.GetProjection()
     Nx = ds.RasterXSize
     Ny = ds.RasterYSize
-    print(ds.RasterCount)
-
-
-    nxToRead = Nx / 2
-    nyToRead = int(Ny / 1.5)
-
-    data = ds.GetRasterBand(1).ReadAsArray(0, 0, nxToRead, nyToRead).transpose()
-    print(srs_wkt)
-    print(data.shape)
-
-    #plt.imshow(data)
-    #plt.show()
-    ds = None
-
     print(Xul, Yul, deltaX, deltaY, rotation)
 
-
-    x1d = np.arange(Xul, Xul + deltaX * nxToRead, deltaX)
-    y1d = np.arange(Yul, Yul + deltaY * nyToRead, deltaY)
-
-    assert len(x1d) == nxToRead
-    assert len(y1d) == nyToRead
-
-
-
-    y, x = np.meshgrid(y1d, x1d)
-
-
-
-
     fieldName = os.path.basename(inPath).split("_")[0].lower()
-
-
     coef = name_to_mult[fieldName]
     no_data = name_to_nodata_value[fieldName]
-    usable = (data != no_data)
-
-    print(x.shape, usable.shape)
 
-    x0 = x[usable]
-    y0 = y[usable]
+    # the tree is built for the target points, so it is small
+    xi, yi, zi = lat_lon.lon_lat_to_cartesian(lonlats[:, 0], lonlats[:, 1])
+    tree = cKDTree(list(zip(xi, yi, zi)))
 
-    cartx, carty, cartz = lat_lon.lon_lat_to_cartesian(x0, y0)
+    npoints = lonlats.shape[0]
+    # the last element is for the pixels that are too far from all the target points
+    sums = np.zeros((npoints + 1, ))
+    usable_counts = np.zeros((npoints + 1, ))
+    all_counts = np.zeros((npoints + 1, ))
 
-    data_1d = data[usable]
-    print("useful data points : {0}".format(len(x0)))
+    # longitudes of the pixel centers
+    x1d = Xul + deltaX * (np.arange(Nx) + 0.5)
 
-    tree = KDTree(list(zip(cartx, carty, cartz)))
+    band = ds.GetRasterBand(1)
+    for row0 in range(0, Ny, rows_per_block):
+        nrows = min(rows_per_block, Ny - row0)
+        data = band.ReadAsArray(0, row0, Nx, nrows)
 
-    print("constructed the kdtree")
+        y1d = Yul + deltaY * (np.arange(row0, row0 + nrows) + 0.5)
+        y, x = np.meshgrid(y1d, x1d, indexing="ij")
 
-    xi, yi, zi = lat_lon.lon_lat_to_cartesian(lonlats[:,0], lonlats[:,1])
-    dists, inds = tree.query(list(zip(xi, yi, zi)), k = AGGR_SIZE)
+        cartx, carty, cartz = lat_lon.lon_lat_to_cartesian(x.flatten(), y.flatten())
+        _, inds = tree.query(np.array([cartx, carty, cartz]).T, distance_upper_bound=LIMIT_DIST)
 
+        data = data.flatten()
+        usable = (data != no_data)
 
-    npoints = dists.shape[0]
-    interp_data = np.zeros((npoints, ))
-    for i in range(npoints):
-        the_dists = dists[i,:]
-        the_inds = inds[i,:]
-
-        good_pts = (the_dists < LIMIT_DIST)
-        if len(the_dists[good_pts]) < 0.25 * AGGR_SIZE: #if there is no usable points in the vicinity, then set the value to no_data
-            interp_data[i] = -1
-            continue
-
-        the_dists = the_dists[good_pts]
-        the_inds = the_inds[good_pts]
-
-        interp_coefs = 1.0 / the_dists ** 2
-        interp_data[i] = np.sum( interp_coefs * data_1d[the_inds] ) / np.sum(interp_coefs)
-
-
-    interp_data[interp_data >= 0] *= coef
+        all_counts += np.bincount(inds, minlength=npoints + 1)
+        usable_counts += np.bincount(inds[usable], minlength=npoints + 1)
+        sums += np.bincount(inds[usable], weights=data[usable].astype(float), minlength=npoints + 1)
 
+    ds = None
 
+    sums, usable_counts, all_counts = sums[:-1], usable_counts[:-1], all_counts[:-1]
+    print("useful data points : {0}".format(int(usable_counts.sum())))
 
+    # if there is no enough usable points in the vicinity, then set the value to no_data
+    enough_data = (usable_counts > 0) & (usable_counts >= MIN_USABLE_FRACTION * all_counts)
+    interp_data = -np.ones((npoints, ))
+    interp_data[enough_data] = sums[enough_data] / usable_counts[enough_data] * coef
 
     print("completed interpolation")
     return interp_data
@@ -173,7 +147,7 @@ def main(inout_paths):
 
     lats2d, lons2d = np.meshgrid(lats1d, lons1d)
 
-    lonlats = np.array( list(map( lambda x, y: outGrid.toGeographicLonLat(x, y), lons2d.flatten(), lats2d.flatten() )) )
+    lonlats = np.array(outGrid.toGeographicLonLat(lons2d.flatten(), lats2d.flatten())).T
     print(lonlats.shape)
 
 
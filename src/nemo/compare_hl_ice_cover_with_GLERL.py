@@ -1,8 +1,11 @@
-from netCDF4 import Dataset, num2date
+from datetime import datetime
+
+from netCDF4 import Dataset
 from pathlib import Path
 from matplotlib import cm
 from matplotlib.gridspec import GridSpec
 from scipy.spatial.ckdtree import cKDTree
+from nemo.glerl_icecov_data2d_interface import GLERLIceCoverManager
 from nemo.nemo_yearly_files_manager import NemoYearlyFilesManager
 from util.geo import lat_lon
 
@@ -11,7 +14,6 @@ __author__ = 'huziy'
 from crcm5.model_data import Crcm5ModelDataManager
 import matplotlib.pyplot as plt
 import numpy as np
-import pandas as pd
 
 
 def validate_yearmax_ice_cover_from_hostetler_with_glerl(path="/home/huziy/skynet3_rech1/CRCM_GL_simulation/all_files",
@@ -54,23 +56,19 @@ def validate_yearmax_ice_cover_from_hostetler_with_glerl(path="/home/huziy/skyne
     obs_varname = "ice_cover"
     obs_lake_avg_ts = []
     with Dataset(path_to_obs) as ds:
-        time_var = ds.variables["time"]
-
         lons_obs = ds.variables["lon"][:]
         lats_obs = ds.variables["lat"][:]
 
-        dates = num2date(time_var[:], time_var.units)
-        nx, ny = lons_obs.shape
-
-        data = ds.variables[obs_varname][:]
-        data = np.ma.masked_where((data > 100) | (data < 0), data)
+        # read only the years of interest
+        dates, data = GLERLIceCoverManager.get_data_for_period_from_cube(
+            path_to_obs, start_date=datetime(start_year, 1, 1), end_date=datetime(end_year, 12, 31, 23, 59),
+            varname=obs_varname)
         print(data.min(), data.max())
-        panel = pd.Panel(data=data, items=dates, major_axis=range(nx), minor_axis=range(ny))
 
-        panel = panel.select(lambda d: start_year <= d.year <= end_year)
+        years = np.array([d.year for d in dates])
         the_max_list = []
-        for key, g in panel.groupby(lambda d: d.year, axis="items"):
-            the_max_field = np.ma.max(np.ma.masked_where((g.values > 100) | (g.values < 0), g.values), axis=0)
+        for the_year in range(start_year, end_year + 1):
+            the_max_field = data[years == the_year].max(axis=0)
             obs_lake_avg_ts.append(the_max_field.mean())
             the_max_list.append(the_max_field)
 
@@ -58,6 +58,29 @@ def main():
 
     # start_date = datetime.strptime(data_files[0].name[1:-3], "%Y%m%d")
     start_date = datetime(1973, 1, 1)
+
+    # (date, path) pairs for the 1973-2002 period (NIC/CIS files) and for the files from GLERL
+    dates_and_paths = []
+    for fpath in Path(obs_data_path_1973_2002).iterdir():
+        if not fpath.name.lower()[-3:] in ["cis", "nic"]:
+            continue
+
+        the_date = get_date_from_nic_cis_filepath(fpath)
+
+        # Avoid duplicates
+        if the_date.year >= 2003:
+            continue
+
+        if the_date.year == 2002 and the_date.month >= 12:
+            continue
+
+        dates_and_paths.append((the_date, fpath))
+
+    dates_and_paths.extend((datetime.strptime(fpath.name[1:-3], "%Y%m%d"), fpath) for fpath in data_files)
+
+    # The time axis is sorted, so that a period could be read in one slice
+    dates_and_paths.sort(key=lambda dp: dp[0])
+
     with Dataset(out_path, mode="w") as ds:
         ds.createDimension("time")
         ds.createDimension("lon", gman.ncols_target)
@@ -66,9 +89,12 @@ def main():
         tvar = ds.createVariable("time", "i4", ("time", ))
         tvar.units = "days since {:%Y-%m-%d %H:%M:%S}".format(start_date)
         tvar.description = "ice cover data from GLERL"
-        dvar = ds.createVariable("ice_cover", "f4", ("time", "lon", "lat"))
-        dvar.coordinates = "lon lat"
 
+        # chunks of about a month of the data, so the reads for a period do not touch the whole file
+        chunksizes = (31, min(256, gman.ncols_target), min(256, gman.ncols_target))
+        dvar = ds.createVariable("ice_cover", "f4", ("time", "lon", "lat"), zlib=True, complevel=4,
+                                 chunksizes=chunksizes)
+        dvar.coordinates = "lon lat"
 
         lon_var = ds.createVariable("lon", "f4", ("lon", "lat"))
         lat_var = ds.createVariable("lat", "f4", ("lon", "lat"))
@@ -77,76 +103,17 @@ def main():
         lon_var[:] = gman.lons2d_target
         lat_var[:] = gman.lats2d_target
 
+        # write the data in blocks of chunksizes[0] time steps
+        block_size = chunksizes[0]
+        for i0 in range(0, len(dates_and_paths), block_size):
+            block = dates_and_paths[i0:i0 + block_size]
 
-        i1 = 0
-        # write the data for 1973-2002 period
-        for i, fpath in enumerate(sorted(Path(obs_data_path_1973_2002).iterdir(), key=lambda zp: get_date_from_nic_cis_filepath(zp))):
-
-            if not fpath.name.lower()[-3:] in ["cis", "nic"]:
-                continue
-
-            the_date = get_date_from_nic_cis_filepath(fpath)
-
-
-            # Avoid duplicates
-            if the_date.year >= 2003:
-                continue
-
-            if the_date.year == 2002 and the_date.month >= 12:
-                continue
-
-
-            data = gman.get_data_from_file_interpolate_if_needed(fpath)
-
-            dvar[i, :, :] = data
-
-            dt = the_date - start_date
-
-            tvar[i] = dt.total_seconds() / (3600.0 * 24.0)
-
-
-            # debug for testing
-            # if fpath.name[-5] != "0":
-            #     import matplotlib.pyplot as plt
-            #
-            #     plt.figure()
-            #     prj = crs.PlateCarree()
-            #     ax = plt.axes(projection=prj)
-            #     ax.pcolormesh(gman.lons2d_target, gman.lats2d_target, data, transform=prj)
-            #     ax.add_feature(cartopy.feature.LAKES, facecolor="none", edgecolor="k", linewidth=2)
-            #     ax.coastlines()
-            #     plt.show()
-            #
-            #     if True:
-            #         raise Exception()
-
-            i1 += 1
-
-
-        print("processed data for 1973-2002 period")
-
-        for i, fpath in enumerate(data_files, start=i1):
-
-            current_date = datetime.strptime(fpath.name[1:-3], "%Y%m%d")
-
-            print(str(fpath))
-            print(current_date)
-            data = gman.get_data_from_file_interpolate_if_needed(fpath)
-            print(data.shape)
-            dvar[i, :, :] = data
-
-            # plt.figure()
-            # prj = crs.PlateCarree()
-            # ax = plt.axes(projection=prj)
-            # ax.pcolormesh(gman.lons2d_target, gman.lats2d_target, data, transform=prj)
-            # ax.add_feature(cartopy.feature.LAKES, facecolor="none", edgecolor="k", linewidth=2)
-            # ax.coastlines()
-            # plt.show()
-
-            dt = current_date - start_date
-
-            tvar[i] = dt.total_seconds() / (3600.0 * 24.0)
+            data = np.ma.asarray([gman.get_data_from_file_interpolate_if_needed(fpath) for _, fpath in block])
+            print("{} - {}: {}".format(block[0][0], block[-1][0], data.shape))
 
+            dvar[i0:i0 + len(block), :, :] = data
+            tvar[i0:i0 + len(block)] = [(the_date - start_date).total_seconds() / (3600.0 * 24.0)
+                                        for the_date, _ in block]
 
 
 if __name__ == '__main__':
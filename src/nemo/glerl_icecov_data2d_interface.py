@@ -12,7 +12,6 @@ __author__ = 'huziy'
 import os
 import numpy as np
 from scipy import constants
-import matplotlib.pyplot as plt
 
 
 def update_grid_info(func):
@@ -60,6 +59,31 @@ def get_date_from_nic_cis_filepath(path):
 
 
 
+def _parse_fixed_width_ints(lines, width):
+    """
+    Parse the lines of fixed width integer fields (right aligned, possibly negative) using numpy
+    :param lines: list of byte strings of the same length (the shorter lines are padded with spaces)
+    :param width: width of a field in characters
+    :return: 2d integer array (nlines, nfields)
+    """
+    line_len = max(len(line) for line in lines)
+    line_len -= line_len % width
+
+    buf = b"".join(line[:line_len].ljust(line_len) for line in lines)
+    chars = np.frombuffer(buf, dtype=np.uint8).reshape((len(lines), line_len // width, width)).astype(np.int64)
+
+    is_digit = (chars >= ord("0")) & (chars <= ord("9"))
+    digits = np.where(is_digit, chars - ord("0"), 0)
+
+    # take into account only the digits for the place values, i.e. for "-1 " -> 1
+    n_digits_after = np.cumsum(is_digit[:, :, ::-1], axis=2)[:, :, ::-1] - is_digit
+    values = (digits * 10 ** n_digits_after).sum(axis=2)
+
+    is_negative = (chars == ord("-")).any(axis=2)
+    values[is_negative] *= -1
+    return values
+
+
 class GLERLIceCoverManager(object):
     # Projection params for the (1024x1024 grid)
     slat = 38.8744  # Southern latitude
@@ -187,12 +211,12 @@ class GLERLIceCoverManager(object):
         self.location_info_dict["file"] = fname
 
         with open(fpath) as f:
-            self.location_info_dict["ncols"] = int(f.next().split()[1])
-            self.location_info_dict["nrows"] = int(f.next().split()[1])
-            self.location_info_dict["xllcorner"] = float(f.next().split()[1])
-            self.location_info_dict["yllcorner"] = float(f.next().split()[1])
-            self.location_info_dict["cellsize"] = float(f.next().split()[1])
-            self.location_info_dict["nodata_value"] = int(f.next().split()[1])
+            self.location_info_dict["ncols"] = int(next(f).split()[1])
+            self.location_info_dict["nrows"] = int(next(f).split()[1])
+            self.location_info_dict["xllcorner"] = float(next(f).split()[1])
+            self.location_info_dict["yllcorner"] = float(next(f).split()[1])
+            self.location_info_dict["cellsize"] = float(next(f).split()[1])
+            self.location_info_dict["nodata_value"] = int(next(f).split()[1])
 
             for key, val in self.location_info_dict.items():
                 setattr(self, key, val)
@@ -205,15 +229,17 @@ class GLERLIceCoverManager(object):
         return "g{:%Y%m%d}.ct".format(the_date)
 
 
-    @update_grid_info
-    def get_icecover_interpolated_to(self, lons2d_target=None, lats2d_target=None,
-                                     the_date=None,
-                                     r_earth_m=6400e3):
-
-
-        print(self.location_info_dict)
-
-        lons2d_target[lons2d_target > 180] -= 360
+    def get_remap_indices(self, lons2d_target, lats2d_target, r_earth_m=6400e3):
+        """
+        Calculate the indices of the source cells corresponding to the target cells and the aggregation windows
+        (for the grid described by the currently loaded location info).
+        The result can be reused for all the days having the same grid.
+        :param lons2d_target:
+        :param lats2d_target:
+        :param r_earth_m:
+        :return: dict with the keys i0, j0 (nearest source cell), imin, imax, jmin, jmax (aggregation window, inclusive)
+        """
+        lons2d_target = np.where(lons2d_target > 180, lons2d_target - 360, lons2d_target)
 
         lats2d_target_r = np.radians(lats2d_target)
         lons2d_target_r = np.radians(lons2d_target)
@@ -221,55 +247,94 @@ class GLERLIceCoverManager(object):
         yt = r_earth_m * lats2d_target_r
         xt = r_earth_m * lons2d_target_r * np.cos(lats2d_target_r)
 
-        print(xt.min(), xt.max())
-
-        i0 = ((xt - self.xllcorner) / float(self.cellsize * np.cos(lats2d_target_r))).astype(int)
+        i0 = ((xt - self.xllcorner) / (self.cellsize * np.cos(lats2d_target_r))).astype(int)
         j0 = ((yt - self.yllcorner) / float(self.cellsize)).astype(int)
 
-        nxagg = (xt.max() - xt.min()) / (self.cellsize * xt.shape[0])
-        nyagg = (yt.max() - yt.min()) / (self.cellsize * yt.shape[1])
+        # size of the target cells in the source cells
+        nxagg = int((xt.max() - xt.min()) / (self.cellsize * xt.shape[0]))
+        nyagg = int((yt.max() - yt.min()) / (self.cellsize * yt.shape[1]))
 
         print("nxagg={}; nyagg={}".format(nxagg, nyagg))
 
-        data_source = self.get_data_for_day(the_date=the_date)
+        nx, ny = self.ncols, self.nrows
 
-        plt.figure()
-        im = plt.pcolormesh(data_source.transpose())
-        plt.colorbar(im)
+        i0 = np.clip(i0, 0, nx - 1)
+        j0 = np.clip(j0, 0, ny - 1)
 
-        nx, ny = data_source.shape
+        return dict(
+            i0=i0, j0=j0,
+            imin=np.maximum(i0 - nxagg // 2, 0), imax=np.minimum(i0 + nxagg // 2, nx - 1),
+            jmin=np.maximum(j0 - nyagg // 2, 0), jmax=np.minimum(j0 + nyagg // 2, ny - 1)
+        )
 
-        j0 = np.maximum(j0, 0)
-        j0 = np.minimum(j0, ny - 1)
+    @staticmethod
+    def remap_fields(data, remap_indices, method="mean"):
+        """
+        Remap several fields at once
+        :param data: masked array (ndays, nx, ny) of the source fields
+        :param remap_indices: the result of get_remap_indices
+        :param method: "nearest" - take the value of the nearest source cell,
+                       "mean" - average of the unmasked source cells in the aggregation window around the nearest cell
+        :return: masked array (ndays, nx_target, ny_target), masked where no valid source values
+        """
+        data = np.ma.masked_invalid(np.ma.asarray(data, dtype="f8"))
+        if data.ndim == 2:
+            data = data[np.newaxis, :, :]
 
-        print(i0.min(), i0.max())
-        print(j0.min(), j0.max())
+        if method == "nearest":
+            return data[:, remap_indices["i0"], remap_indices["j0"]]
 
-        i0 = np.maximum(i0, 0)
-        i0 = np.minimum(i0, nx - 1)
+        if method != "mean":
+            raise ValueError("Unknown remapping method: {}".format(method))
 
-        # imin = np.maximum(i0 - nxagg // 2, 0)
-        # imax = np.minimum(i0 + nxagg // 2, nx - 1)
-        # jmin = np.minimum(j0 - nyagg // 2, 0)
-        # jmax = np.maximum(j0 + nyagg // 2, ny - 1)
+        valid = ~np.ma.getmaskarray(data)
 
+        # summed area tables of the values and of the numbers of valid cells with a leading row and column of 0
+        nt, nx, ny = data.shape
+        sum_table = np.zeros((nt, nx + 1, ny + 1))
+        count_table = np.zeros((nt, nx + 1, ny + 1))
+        sum_table[:, 1:, 1:] = np.where(valid, data.filled(0), 0).cumsum(axis=1).cumsum(axis=2)
+        count_table[:, 1:, 1:] = valid.cumsum(axis=1).cumsum(axis=2)
 
-        imin = imax = i0
-        jmin = jmax = j0
+        imin, imax, jmin, jmax = [remap_indices[k] for k in ["imin", "imax", "jmin", "jmax"]]
 
-        result = np.zeros_like(xt)
-        result = result.flatten()
-        imin = imin.flatten()
-        imax = imax.flatten()
-        jmin = jmin.flatten()
-        jmax = jmax.flatten()
+        def box_sum(table):
+            return (table[:, imax + 1, jmax + 1] - table[:, imin, jmax + 1]
+                    - table[:, imax + 1, jmin] + table[:, imin, jmin])
 
-        for i in range(len(result)):
-            result[i] = data_source[imin[i]:imax[i] + 1, jmin[i]:jmax[i] + 1]
+        box_counts = box_sum(count_table)
+        result = box_sum(sum_table) / np.where(box_counts > 0, box_counts, 1)
+        return np.ma.masked_where(box_counts == 0, result)
 
-        print(result.min(), result.max())
-        result[np.isnan(result)] = np.ma.masked
-        return result.reshape(xt.shape)
+    def get_icecover_interpolated_to_for_dates(self, lons2d_target=None, lats2d_target=None, dates=None,
+                                               method="mean", r_earth_m=6400e3):
+        """
+        :param dates: list of dates, the remapping indices are calculated once for each different grid
+        :return: masked array (ndays, nx, ny)
+        """
+        grid_to_remap_indices = {}
+        result = []
+        for the_date in dates:
+            self.read_location_info(self.date_to_fname(the_date))
+            grid_key = tuple(self.location_info_dict[k] for k in sorted(self.location_info_keys))
+
+            if grid_key not in grid_to_remap_indices:
+                grid_to_remap_indices[grid_key] = self.get_remap_indices(lons2d_target, lats2d_target,
+                                                                         r_earth_m=r_earth_m)
+
+            data_source = self.get_data_for_day(the_date=the_date)
+            result.append(self.remap_fields(data_source, grid_to_remap_indices[grid_key], method=method)[0])
+
+        return np.ma.asarray(result)
+
+    @update_grid_info
+    def get_icecover_interpolated_to(self, lons2d_target=None, lats2d_target=None,
+                                     the_date=None,
+                                     r_earth_m=6400e3, method="nearest"):
+        print(self.location_info_dict)
+        remap_indices = self.get_remap_indices(lons2d_target, lats2d_target, r_earth_m=r_earth_m)
+        data_source = self.get_data_for_day(the_date=the_date)
+        return self.remap_fields(data_source, remap_indices, method=method)[0]
 
 
     @staticmethod
@@ -282,43 +347,40 @@ class GLERLIceCoverManager(object):
         return [float(tok) for tok in re.findall(".{3}", line)]
 
     def get_data_from_path(self, path, skiplines=6):
-        data = []
         nrows = None
         nodata_value = -1
-        with open(path) as f:
-
-            # Skip the first 6 lines
-            last_position = -1
-            line = ""
-            for i in range(skiplines):
-                last_position = f.tell()
-                line = f.readline()
-                if "nrows" in line.lower():
-                    nrows = int(line.split()[-1])
-
-                if "nodata_value" in line.lower():
-                    nodata_value = int(line.split()[-1])
-
-            # unread the last line
-            if line.split()[0].lower() not in self.location_info_keys:
-                f.seek(last_position)
+        with open(path, "rb") as f:
+            payload = f.read()
 
+        lines = payload.splitlines()
 
-            for i, line in enumerate(f):
-                line = line.rstrip()
-                if line.strip() == "":
-                    break
+        # Parse the header
+        first_data_line = 0
+        for i, line in enumerate(lines[:skiplines]):
+            line = line.decode()
+            if "nrows" in line.lower():
+                nrows = int(line.split()[-1])
 
+            if "nodata_value" in line.lower():
+                nodata_value = int(line.split()[-1])
 
-                data.insert(0, self._parse_line(line))
+            if len(line.split()) > 0 and line.split()[0].lower() in self.location_info_keys:
+                first_data_line = i + 1
 
-                # Exit if read all the rows
-                # (Strange thing happens at the end of the file, maybe because it was created on windows.)
-                if i == nrows - 1:
-                    break
+        data_lines = []
+        for line in lines[first_data_line:]:
+            line = line.rstrip()
+            if line.strip() == b"":
+                break
+            data_lines.append(line)
 
+            # Exit if read all the rows
+            # (Strange thing happens at the end of the file, maybe because it was created on windows.)
+            if len(data_lines) == nrows:
+                break
 
-        data = np.asarray(data, dtype="f4")
+        # The first row in the file is the northernmost
+        data = _parse_fixed_width_ints(data_lines, 3)[::-1].astype("f4")
 
         print("Data shape in file: {}".format(data.shape))
 
@@ -340,11 +402,10 @@ class GLERLIceCoverManager(object):
         if path[-5] == "0":
             return np.ma.masked_all((516, 510))
 
-        data = []
-        for line in open(path):
-            # print(line)
-            data.append([int(tok) for tok in re.findall(".{2}", line.strip())])
-        data = np.asarray(data)
+        with open(path, "rb") as f:
+            lines = [line.strip() for line in f.read().splitlines()]
+
+        data = _parse_fixed_width_ints(lines, 2)
         data[data == 99] = 100
         data = np.ma.masked_where(data < 0, data)
 
@@ -391,6 +452,35 @@ class GLERLIceCoverManager(object):
             return data
 
 
+    @staticmethod
+    def get_data_for_period_from_cube(cube_path, start_date=None, end_date=None, varname="ice_cover"):
+        """
+        Read the data for the period from the netcdf cube created by nemo/convert_glerl_data_to_nc.py
+        (the time axis is sorted, so the period is read in one slice)
+        :param cube_path:
+        :param start_date:
+        :param end_date: inclusive
+        :return: dates, data (time, lon, lat) masked where there is no data
+        """
+        from netCDF4 import Dataset, num2date, date2num
+
+        with Dataset(cube_path) as ds:
+            time_var = ds.variables["time"]
+            times = time_var[:]
+
+            i0, i1 = 0, len(times)
+            if start_date is not None:
+                i0 = np.searchsorted(times, date2num(start_date, time_var.units), side="left")
+
+            if end_date is not None:
+                i1 = np.searchsorted(times, date2num(end_date, time_var.units), side="right")
+
+            dates = num2date(times[i0:i1], time_var.units)
+            data = ds.variables[varname][i0:i1, :, :]
+
+        return dates, np.ma.masked_where((data > 100) | (data < 0), data)
+
+
 if __name__ == '__main__':
     import application_properties
 
@@ -0,0 +1,203 @@
+import os
+
+from netCDF4 import Dataset
+import numpy as np
+
+__author__ = 'huziy'
+
+
+# Shared reader of the discharge_*.nc files produced by the offline routing,
+# the time variable of the files is a char array with the dates in the format %Y_%m_%d_%H_%M
+
+TIME_VARNAME = "time"
+DISCHARGE_VARNAME = "water_discharge_accumulated"
+
+SEASON_TO_MONTHS = {
+    "DJF": [12, 1, 2],
+    "MAM": [3, 4, 5],
+    "JJA": [6, 7, 8],
+    "SON": [9, 10, 11]
+}
+
+# (path, modification time) -> the decoded time axis
+_path_to_times_cache = {}
+
+
+def decode_char_time_axis(time_chars):
+    """
+    Vectorized decoding of the char time axis (ntimes, nchars) in the format %Y_%m_%d_%H_%M
+    :return: numpy.datetime64 array
+    """
+    time_chars = np.ma.filled(np.asarray(time_chars), b"0")
+    digits = time_chars.astype("S1").view(np.uint8).reshape(time_chars.shape).astype(np.int64) - ord("0")
+
+    def _to_int(i0, i1):
+        result = np.zeros(digits.shape[0], dtype=np.int64)
+        for i in range(i0, i1):
+            result = result * 10 + digits[:, i]
+        return result
+
+    year, month, day, hour, minute = _to_int(0, 4), _to_int(5, 7), _to_int(8, 10), _to_int(11, 13), _to_int(14, 16)
+
+    times = ((year - 1970) * 12 + month - 1).astype("datetime64[M]").astype("datetime64[m]")
+    times += ((day - 1) * 24 * 60 + hour * 60 + minute).astype("timedelta64[m]")
+    return times
+
+
+def _get_contiguous_blocks(indices):
+    """
+    Split the sorted indices into the blocks of consecutive values
+    :return: list of (start, end) pairs, the ends are exclusive
+    """
+    if len(indices) == 0:
+        return []
+
+    breaks = np.where(np.diff(indices) != 1)[0] + 1
+    starts = np.concatenate(([indices[0]], indices[breaks]))
+    ends = np.concatenate((indices[breaks - 1], [indices[-1]])) + 1
+    return list(zip(starts, ends))
+
+
+class OfflineRouteDischargeReader(object):
+    def __init__(self, path=""):
+        """
+        :param path: path to the discharge_*.nc file
+        """
+        self.path = path
+        self._times = None
+        self._x_index = None
+        self._y_index = None
+
+    @property
+    def times(self):
+        """
+        Dates of the time steps as numpy.datetime64 (decoded once for each file)
+        """
+        if self._times is None:
+            key = (os.path.abspath(self.path), os.path.getmtime(self.path))
+            if key not in _path_to_times_cache:
+                with Dataset(self.path) as ds:
+                    _path_to_times_cache[key] = decode_char_time_axis(ds.variables[TIME_VARNAME][:])
+            self._times = _path_to_times_cache[key]
+        return self._times
+
+    @property
+    def dates(self):
+        """
+        Dates of the time steps as a list of datetime objects
+        """
+        return self.times.astype("datetime64[s]").tolist()
+
+    def _read_cell_indices(self):
+        with Dataset(self.path) as ds:
+            self._x_index = ds.variables["x_index"][:]
+            self._y_index = ds.variables["y_index"][:]
+
+    @property
+    def x_index(self):
+        if self._x_index is None:
+            self._read_cell_indices()
+        return self._x_index
+
+    @property
+    def y_index(self):
+        if self._y_index is None:
+            self._read_cell_indices()
+        return self._y_index
+
+    def read_variable(self, varname):
+        """
+        Read a variable without the time dimension (i.e. longitude, latitude, accumulation_area)
+        """
+        with Dataset(self.path) as ds:
+            return ds.variables[varname][:]
+
+    def get_time_mask(self, months=None, season=None, start_year=None, end_year=None, years=None,
+                      exclude_feb29=False):
+        """
+        :param months: list of the months to select
+        :param season: one of the keys of SEASON_TO_MONTHS (used if months is None)
+        :param years: list of the years to select (in addition to the start_year and end_year limits)
+        :return: boolean array of the length of the time axis
+        """
+        times = self.times
+        mask = np.ones(times.shape, dtype=bool)
+
+        if months is None and season is not None:
+            months = SEASON_TO_MONTHS[season]
+
+        the_months = times.astype("datetime64[M]").astype(int) % 12 + 1
+        if months is not None:
+            mask &= np.isin(the_months, months)
+
+        the_years = times.astype("datetime64[Y]").astype(int) + 1970
+        if start_year is not None:
+            mask &= the_years >= start_year
+
+        if end_year is not None:
+            mask &= the_years <= end_year
+
+        if years is not None:
+            mask &= np.isin(the_years, years)
+
+        if exclude_feb29:
+            days = (times.astype("datetime64[D]") - times.astype("datetime64[M]")).astype(int) + 1
+            mask &= ~((the_months == 2) & (days == 29))
+
+        return mask
+
+    def read_discharge(self, time_mask=None, cell_indices=None, varname=DISCHARGE_VARNAME):
+        """
+        Read only the selected time steps and cells, the contiguous runs of the selected time steps
+        are read in one slice each.
+        :param time_mask: boolean array (see get_time_mask), if None all the time steps are read
+        :param cell_indices: list of the indices of the cells (columns), if None all the cells are read
+        :return: times (numpy.datetime64), data (ntimes, ncells)
+        """
+        time_indices = np.arange(len(self.times)) if time_mask is None else np.where(time_mask)[0]
+
+        with Dataset(self.path) as ds:
+            var = ds.variables[varname]
+            cols = slice(None) if cell_indices is None else np.asarray(cell_indices)
+
+            blocks = [var[t0:t1, cols] for t0, t1 in _get_contiguous_blocks(time_indices)]
+
+            if len(blocks):
+                data = np.ma.concatenate(blocks)
+            else:
+                ncells = var.shape[1] if cell_indices is None else len(cols)
+                data = np.ma.zeros((0, ncells))
+
+        return self.times[time_indices], data
+
+    def get_mean(self, time_mask=None, cell_indices=None, varname=DISCHARGE_VARNAME):
+        """
+        Mean over the selected time steps, the contiguous runs of the time steps are read one by one,
+        so that the selected data is never loaded at once.
+        :return: 1d array (ncells, ), NaNs if no time steps are selected
+        """
+        time_indices = np.arange(len(self.times)) if time_mask is None else np.where(time_mask)[0]
+
+        the_sum = None
+        with Dataset(self.path) as ds:
+            var = ds.variables[varname]
+            cols = slice(None) if cell_indices is None else np.asarray(cell_indices)
+
+            # no time steps selected (i.e. a season outside of the years in the file)
+            if not len(time_indices):
+                ncells = var.shape[1] if cell_indices is None else len(cols)
+                return np.full(ncells, np.nan)
+
+            for t0, t1 in _get_contiguous_blocks(time_indices):
+                block_sum = var[t0:t1, cols].sum(axis=0)
+                the_sum = block_sum if the_sum is None else the_sum + block_sum
+
+        return the_sum / float(len(time_indices))
+
+    def to_2d(self, values_1d, shape):
+        """
+        Put the values for the cells onto the 2d grid, the points without cells are masked
+        """
+        result = np.ma.masked_all(shape)
+        result[self.x_index, self.y_index] = values_1d
+        return result
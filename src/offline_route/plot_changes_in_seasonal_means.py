@@ -1,16 +1,15 @@
-from datetime import datetime
 from netCDF4 import Dataset
 import pickle
 from matplotlib import cm
 from matplotlib.colors import BoundaryNorm
 import os
 from matplotlib.transforms import Affine2D
-import pandas
 from rpn.rpn import RPN
 import scipy
 from scipy.stats import stats
 import my_colormaps
-from .plot_seasonal_means import TIME_FORMAT, get_arctic_basemap, get_arctic_basemap_nps
+from .discharge_file_reader import OfflineRouteDischargeReader
+from .plot_seasonal_means import get_arctic_basemap, get_arctic_basemap_nps
 
 __author__ = 'huziy'
 
@@ -66,32 +65,22 @@ def main(months=None, season="DJF", ax = None, clevels = None,
 
         #os.remove(cache_file)
         if not os.path.isfile(cache_file):
-            time_str = ds.variables["time"][:]
-            times = [datetime.strptime("".join(t_s), TIME_FORMAT) for t_s in time_str]
+            # calculate mean for the season for each year, reading only the time steps of the season
+            reader = OfflineRouteDischargeReader(the_path)
 
-            data = ds.variables["water_discharge_accumulated"][:]
-            df = pandas.DataFrame(data=data, index=times)
-            df["year"] = df.index.map(lambda d: d.year)
-            df["month"] = df.index.map(lambda d: d.month)
+            def _get_seasonal_means(start_year, end_year):
+                return np.ma.asarray([
+                    reader.get_mean(time_mask=reader.get_time_mask(months=months, start_year=y, end_year=y))
+                    for y in range(start_year, end_year + 1)
+                ])
 
-            print(df.shape, df.columns)
+            seasonal_means_current = _get_seasonal_means(start_year_current, end_year_current)
+            seasonal_means_future = _get_seasonal_means(start_year_future, end_year_future)
 
-            data_current = df.ix[
-                           (df.year >= start_year_current) & (df.year <= end_year_current) & df.month.isin(months), :]
-            print(data_current.columns)
-            data_current = data_current.drop(["year", "month"], axis=1)
-            seasonal_means_current = data_current.groupby(
-                by=lambda d: d.year).mean()  #calculate mean for the season for each year
+            change = seasonal_means_future - seasonal_means_current
 
-            data_future = df.ix[(df.year >= start_year_future) & (df.year <= end_year_future) & df.month.isin(months),
-                          :]
-            data_future = data_future.drop(["year", "month"], axis=1)
-            seasonal_means_future = data_future.groupby(by=lambda d: d.year).mean()
-
-            change = seasonal_means_future.values - seasonal_means_current.values
-
-            mean_current = seasonal_means_current.values.mean(axis=0)
-            mean_future = seasonal_means_future.values.mean(axis=0)
+            mean_current = seasonal_means_current.mean(axis=0)
+            mean_future = seasonal_means_future.mean(axis=0)
 
             ##axis0 - time, axis1 -  cell index
 
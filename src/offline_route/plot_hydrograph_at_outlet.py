@@ -5,6 +5,7 @@ from matplotlib.ticker import FuncFormatter, MaxNLocator
 from matplotlib import cm
 from rpn.rpn import RPN
 from data.cell_manager import CellManager
+from offline_route.discharge_file_reader import OfflineRouteDischargeReader
 from domains.rotated_lat_lon import RotatedLatLon
 from datetime import datetime, timedelta
 from util import plot_utils
@@ -292,19 +293,15 @@ def plot_streamflow():
     ax = fig.add_subplot(gs[0, 0])
 
     for p, c, label in zip(paths, colors, labels):
-        with Dataset(p) as ds:
-            stfl = ds.variables["water_discharge_accumulated"][:, cell_index]
+        # remove 29th of February and read only the period of interest
+        reader = OfflineRouteDischargeReader(p)
+        time_mask = reader.get_time_mask(start_year=start_year, end_year=end_year, exclude_feb29=True)
+        time, stfl = reader.read_discharge(time_mask=time_mask, cell_indices=[cell_index])
+        df = pd.DataFrame(index=time, data=stfl[:, 0])
 
-            time = ds.variables["time"][:].astype(str)
-            time = [datetime.strptime("".join(ts), "%Y_%m_%d_%H_%M") for ts in time]
-            df = pd.DataFrame(index=time, data=stfl)
+        df = df.groupby(lambda d: datetime(2001, d.month, d.day)).mean()
 
-            # remove 29th of February
-            df = df.select(lambda d: not (d.month == 2 and d.day == 29) and (start_year <= d.year <= end_year))
-
-            df = df.groupby(lambda d: datetime(2001, d.month, d.day)).mean()
-
-            ax.plot(df.index, df.values, c, lw=2, label=label)
+        ax.plot(df.index, df.values, c, lw=2, label=label)
 
     ax.xaxis.set_major_formatter(FuncFormatter(lambda tickval, pos: num2date(tickval).strftime("%b")[0]))
     ax.xaxis.set_major_locator(MonthLocator())
@@ -1,5 +1,4 @@
 from netCDF4 import Dataset
-from datetime import datetime
 import pickle
 from matplotlib import cm
 from matplotlib.colors import BoundaryNorm
@@ -7,6 +6,7 @@ from mpl_toolkits.basemap import Basemap
 import os
 import pandas
 from domains.rotated_lat_lon import RotatedLatLon
+from offline_route.discharge_file_reader import OfflineRouteDischargeReader
 
 __author__ = 'huziy'
 
@@ -70,19 +70,13 @@ def main(months=None, season="DJF"):
         cache_file = "_".join([str(m) for m in months]) + "_{0}_{1}_{2}_mean_cache.bin".format(start_year, end_year,
                                                                                                label)
         if not os.path.isfile(cache_file):
-            time_str = ds.variables["time"][:]
-            times = [datetime.strptime("".join(t_s), TIME_FORMAT) for t_s in time_str]
-            data = ds.variables["water_discharge_accumulated"][:]
-            df = pandas.DataFrame(data=data, index=times)
-            df["year"] = df.index.map(lambda d: d.year)
-            df["month"] = df.index.map(lambda d: d.month)
-
-            print(df.shape)
-            mean_data = df.ix[(df.year >= start_year) & (df.year <= end_year) & df.month.isin(months), :].mean(axis=0)
-            mean_data = mean_data.drop(["year", "month"])  # no need of month and year
-            pickle.dump(mean_data, open(cache_file, mode="w"))
+            # read only the time steps of the season
+            reader = OfflineRouteDischargeReader(the_path)
+            time_mask = reader.get_time_mask(months=months, start_year=start_year, end_year=end_year)
+            mean_data = pandas.Series(data=reader.get_mean(time_mask=time_mask))
+            pickle.dump(mean_data, open(cache_file, mode="wb"))
         else:
-            mean_data = pickle.load(open(cache_file))
+            mean_data = pickle.load(open(cache_file, mode="rb"))
 
         plt.figure()
         to_plot = np.ma.masked_all_like(lons2d)
@@ -14,7 +14,7 @@ import data.cehq_station as cehq_station
 from data.cehq_station import Station
 from data.cell_manager import CellManager
 from domains.rotated_lat_lon import RotatedLatLon
-from offline_route.plot_seasonal_means import TIME_FORMAT
+from offline_route.discharge_file_reader import OfflineRouteDischargeReader
 from util.geo import lat_lon
 
 __author__ = 'huziy'
@@ -163,7 +163,6 @@ def main():
 
     print("Retained {} stations.".format(len(stations)))
 
-    sim_to_time = {}
 
     monthly_dates = [datetime(2001, m, 15) for m in range(1, 13)]
     fmt = FuncFormatter(lambda x, pos: num2date(x).strftime("%b")[0])
@@ -248,18 +247,13 @@ def main():
                 stations_to_mp = get_dataless_model_points_for_stations(stations, acc_area_2d,
                                                                        lons2d, lats2d, x_index, y_index)
 
-            # read dates only once for a given simulation
-            if sim_label not in sim_to_time:
-                time_str = ds.variables["time"][:].astype(str)
-                times = [datetime.strptime("".join(t_s), TIME_FORMAT) for t_s in time_str]
-                sim_to_time[sim_label] = times
-
+            # read only the years of interest for the cell (the dates are decoded once for a given simulation)
             mp = stations_to_mp[s]
-            data = ds.variables["water_discharge_accumulated"][:, mp.cell_index]
+            reader = OfflineRouteDischargeReader(path)
+            times, data = reader.read_discharge(time_mask=reader.get_time_mask(years=years),
+                                                cell_indices=[mp.cell_index])
             print(path)
-            df = DataFrame(data=data, index=sim_to_time[sim_label], columns=["value"])
-            df["year"] = df.index.map(lambda d: d.year)
-            df = df.ix[df.year.isin(years), :]
+            df = DataFrame(data=data[:, 0], index=times, columns=["value"])
             df = df.groupby(lambda d: datetime(2001, d.month, 15)).mean()
 
 
@@ -1,7 +1,7 @@
 __author__ = 'huziy'
 
 
-from ccc.ccc import champ_ccc
+from ccc.ccc import fichier_ccc_indexe
 
 import application_properties
 import numpy as np
@@ -65,8 +65,8 @@ def inside_region(lon, lat, geometries):
 
 def main():
     data_path = "data/permafrost/p1perma"
-    cccObj = champ_ccc(data_path)
-    pData = cccObj.charge_champs()[0]["field"]
+    cccObj = fichier_ccc_indexe(data_path)
+    pData = cccObj.lit_champ(0)
 
 
 
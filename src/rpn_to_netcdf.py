@@ -1,11 +1,10 @@
-from multiprocessing.pool import Pool
 import os.path
 
-from pathlib import Path
 
 from rpn import level_kinds
-from rpn.rpn_multi import MultiRPN
 
+from converting import rpn_to_nc_service
+from converting.rpn_to_nc_service import ConversionManifest, ConversionTask, VariableSpec
 from crcm5.mh_domains import default_domains
 from crcm5.model_data import Crcm5ModelDataManager
 
@@ -103,52 +102,13 @@ def extract_runoff_to_netcdf_folder(folder_path='data/CORDEX/Africa/Samples'):
             extract_runoff_to_netcdf_file(filePath)
 
 
-def extract_runoff_to_nc_process(args):
-    in_path, out_path = args
+RUNOFF_VARIABLES = [
+    VariableSpec(name="TRAF", level=5, level_kind=level_kinds.ARBITRARY, units="kg/( m**2 * s )"),
+    VariableSpec(name="TDRA", level=5, level_kind=level_kinds.ARBITRARY, units="kg/( m**2 * s )"),
+]
 
-    if os.path.exists(out_path):
-        print("Nothing to do for: {}".format(out_path))
-        return  # skip files that already exist
 
-
-    traf_name = "TRAF"
-    tdra_name = "TDRA"
-
-    r = MultiRPN(in_path)
-    traf_data = r.get_all_time_records_for_name_and_level(varname=traf_name, level=5, level_kind=level_kinds.ARBITRARY)
-    tdra_data = r.get_all_time_records_for_name_and_level(varname=tdra_name, level=5, level_kind=level_kinds.ARBITRARY)
-    r.close()
-
-    nx, ny = list(traf_data.items())[0][1].shape
-
-    with nc.Dataset(out_path, "w", format="NETCDF3_CLASSIC") as ds:
-        ds.createDimension("lon", nx)
-        ds.createDimension("lat", ny)
-        ds.createDimension("time", None)
-
-        varTraf = ds.createVariable(traf_name, "f4", dimensions=("time", "lon", "lat"))
-        varTraf.units = "kg/( m**2 * s )"
-
-        varTdra = ds.createVariable(tdra_name, "f4", dimensions=("time", "lon", "lat"))
-        varTdra.units = "kg/( m**2 * s )"
-
-        timeVar = ds.createVariable("time", "f4", dimensions=("time",))
-
-        sorted_dates = list(sorted(traf_data.keys()))
-
-        timeVar.units = "hours since {0}".format(sorted_dates[0])
-        timeVar[:] = nc.date2num(sorted_dates, timeVar.units)
-
-        varTraf[:] = np.array(
-            [traf_data[d] for d in sorted_dates]
-        )
-
-        varTdra[:] = np.array(
-            [tdra_data[d] for d in sorted_dates]
-        )
-
-
-def runoff_to_netcdf_parallel(indir, outdir):
+def runoff_to_netcdf_parallel(indir, outdir, processes=10):
     if not os.path.isdir(outdir):
         os.mkdir(outdir)
 
@@ -158,31 +118,23 @@ def runoff_to_netcdf_parallel(indir, outdir):
 
     out_paths = [os.path.join(outdir, inName + ".nc") for inName in in_names]
 
-    ppool = Pool(processes=10)
     print("The paths below go to: ")
     print(in_paths[0])
     print("Go into: {}".format(out_paths[0]))
-    ppool.map(extract_runoff_to_nc_process, list(zip(in_paths, out_paths)))
-
-
-def runoff_to_netcdf_parallel_with_multirpn(indir, outdir):
 
-    indir_p = Path(indir)
-    outdir_p = Path(outdir)
+    tasks = [ConversionTask([in_path], out_path) for in_path, out_path in zip(in_paths, out_paths)]
+    rpn_to_nc_service.convert(ConversionManifest(RUNOFF_VARIABLES, tasks), processes=processes)
 
 
+def runoff_to_netcdf_parallel_with_multirpn(indir, outdir, processes=10):
     if not os.path.isdir(outdir):
         os.mkdir(outdir)
 
+    # one output file for each month folder
+    manifest = ConversionManifest.from_month_folders(
+        indir, outdir, RUNOFF_VARIABLES, file_filter=lambda fname: fname.startswith("pm") and fname.endswith("p"))
 
-
-    in_paths = [[str(x) for x in monthdir.iterdir() if x.name.startswith("pm") and x.name.endswith("p")] for monthdir in indir_p.iterdir() if monthdir.is_dir()]
-
-
-    out_paths = [str(outdir_p.joinpath(monthdir.name + ".nc")) for monthdir in indir_p.iterdir() if monthdir.is_dir()]
-
-    ppool = Pool(processes=10)
-    ppool.map(extract_runoff_to_nc_process, list(zip(in_paths, out_paths)))
+    rpn_to_nc_service.convert(manifest, processes=processes)
 
 
 def extract_sand_and_clay_from_rpn(rpn_path='data/geophys_africa', outpath=""):
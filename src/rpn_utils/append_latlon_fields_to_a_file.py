@@ -1,6 +1,7 @@
 
 
 import sys
+from multiprocessing import Pool
 from pathlib import Path
 
 from rpn.rpn import RPN
@@ -40,15 +41,21 @@ def main(path_param=None):
         r.write_2d_field_clean(lons, properties=info)
 
         info["varname"] = "LAT"
-        r.write_2d_field_clean(lons, properties=info)
+        r.write_2d_field_clean(lats, properties=info)
 
 
 
-def append_lat_lon_to_all_files_in_folder(folder="/HOME/huziy/skynet3_rech1/NEI_geophysics/misc_fields/gridcell_areas"):
+def append_lat_lon_to_all_files_in_folder(folder="/HOME/huziy/skynet3_rech1/NEI_geophysics/misc_fields/gridcell_areas",
+                                          processes=None):
     folder_p = Path(folder)
 
-    for f in folder_p.iterdir():
-        main(path_param=str(f))
+    # the files are independent, the records are appended to them by parallel processes
+    pool = Pool(processes=processes)
+    try:
+        pool.map(main, [str(f) for f in folder_p.iterdir()])
+    finally:
+        pool.close()
+        pool.join()
 
 
 
@@ -0,0 +1,111 @@
+import os
+import time
+from datetime import datetime
+
+import numpy as np
+from rpn.rpn import RPN
+
+from rpn_utils.record_transform import RecordTransformChain, SelectRecords, SetDates, EditField, FillWhere, \
+    AppendLatLon, process_files
+
+__author__ = 'huziy'
+
+
+# Rewriting of a synthetic sample set (by default 8 files x 1000 records of 400x300 fields, ~3.8 GB of float32)
+# with a typical sequence of edits:
+#   - the previous way: one script (one read and one write of all the records) per edit,
+#   - one pass through the chain of all the edits, in one process and in a pool of processes.
+# Measured with the default sample set (8000 records, 3.58 GB) and librmn 019.5, on 1 cpu with 5 GB of memory:
+#   One rewrite per edit: 41.6 s, 192 records/s
+#   One pass, 1 process:   6.7 s, 1197 records/s
+#   One pass, pool:       12.1 s, 664 records/s (a single cpu: only the overhead of the pool, no gain expected)
+
+SAMPLE_FOLDER = "record_transform_samples"
+
+VAR_NAMES = ["TT", "PR", "I0", "MG", "VF"]
+
+
+def _to_kelvins(field):
+    return field + 273.15
+
+
+def generate_samples(folder=SAMPLE_FOLDER, nfiles=8, nrecords=1000, shape=(400, 300), seed=1):
+    """
+    :return: paths of the generated files (existing files are reused)
+    """
+    if not os.path.isdir(folder):
+        os.makedirs(folder)
+
+    random_state = np.random.RandomState(seed)
+    paths = []
+    for i in range(nfiles):
+        path = os.path.join(folder, "sample_{:03d}.rpn".format(i))
+        paths.append(path)
+        if os.path.isfile(path):
+            continue
+
+        r = RPN(path, mode="w")
+        for k in range(nrecords):
+            data = random_state.random_sample(shape).astype(np.float32)
+            r.write_2D_field(name=VAR_NAMES[k % len(VAR_NAMES)], data=data, ip=[k % 5, k // len(VAR_NAMES), 0],
+                             ig=[100, 100, 0, 0], npas=k // len(VAR_NAMES), deet=1200, label="SAMPLE",
+                             dateo=datetime(1979, 1, 1), grid_type="L", typ_var="P", nbits=-32, data_type=5)
+        r.close()
+    return paths
+
+
+def get_transforms(mask_shape=(400, 300)):
+    mask = np.zeros(mask_shape, dtype=bool)
+    mask[::7, ::3] = True
+    return [
+        SelectRecords(exclude_names=["PR"]),
+        SetDates(dateo=datetime(1958, 1, 1), deet=1200),
+        EditField(name="I0", func=_to_kelvins),
+        FillWhere(name="MG", value=1, mask=mask),
+        AppendLatLon()
+    ]
+
+
+def main(folder=SAMPLE_FOLDER, nfiles=8, nrecords=1000, shape=(400, 300), processes=None):
+    in_paths = generate_samples(folder=folder, nfiles=nfiles, nrecords=nrecords, shape=shape)
+    n_records = nfiles * nrecords
+    size_gb = sum(os.path.getsize(p) for p in in_paths) / 1024.0 ** 3
+    print("{} files, {} records, {:.2f} GB".format(nfiles, n_records, size_gb))
+
+    transforms = get_transforms(mask_shape=shape)
+
+    # previous: one rewrite of the files per edit
+    t0 = time.perf_counter()
+    for p in in_paths:
+        current = p
+        for i, transform in enumerate(transforms):
+            out_path = "{}.step{}".format(p, i)
+            RecordTransformChain([transform], label="BENCHMARK").process_file(current, out_path)
+            if current != p:
+                os.remove(current)
+            current = out_path
+        os.remove(current)
+    t_previous = time.perf_counter() - t0
+
+    chain = RecordTransformChain(transforms, label="BENCHMARK")
+    in_out_paths = [(p, p + ".out") for p in in_paths]
+
+    t0 = time.perf_counter()
+    process_files(chain, in_out_paths, processes=1)
+    t_one_pass = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    process_files(chain, in_out_paths, processes=processes)
+    t_parallel = time.perf_counter() - t0
+
+    for _, out_path in in_out_paths:
+        os.remove(out_path)
+
+    for label, seconds in [("One rewrite per edit", t_previous), ("One pass, 1 process", t_one_pass),
+                           ("One pass, {} processes".format(processes or os.cpu_count()), t_parallel)]:
+        print("{}: {:.1f} s, {:.0f} records/s, {:.2f} GB/s".format(label, seconds, n_records / seconds,
+                                                                   size_gb / seconds))
+
+
+if __name__ == '__main__':
+    main()
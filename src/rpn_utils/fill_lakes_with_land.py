@@ -1,6 +1,7 @@
 from scipy.spatial.kdtree import KDTree
 from rpn import level_kinds
 from rpn.rpn import RPN
+from rpn_utils.record_transform import RecordTransformChain, FillWhere
 from util.geo import lat_lon
 
 __author__ = 'huziy'
@@ -23,7 +24,6 @@ def interpolate(inField, inLons2D, inLats2D, kdtree):
 
 def main():
 
-    glob_fields_to_interp = ["SAND", "CLAY", "DPTH"]
 
     in_path = "/home/huziy/skynet3_rech1/geof_lake_infl_exp/geophys_Quebec_0.1deg_260x260_with_dd_v6"
     out_path = in_path + "_no_lakes"
@@ -64,59 +64,14 @@ def main():
 
 
     thirdLevelIp1 = inRpnObj.get_ip1_from_level(3)
-    outRpnObj = RPN(out_path, mode="w")
-
-    data = []
-    inRpnObj.reset_current_info()
-    i = 0
-    while data is not None:
-        data = inRpnObj.get_next_record()
-        if data is None:
-            break
-        info = inRpnObj.get_current_info
-
-        nbits = info["nbits"].value
-        data_type = info["data_type"].value
-
-        current_ip1 = info["ip"][0].value
-
-        if nbits > 0:
-            nbits = -nbits
-
-        print("nbits = {0}, data_type = {1}".format(nbits, data_type))
-
-        ips =  [x.value for x in info["ip"]]
-        dateo = info["dateo_rpn_format"].value
-
-
-        the_varname = info["varname"].value.strip().upper()
-
-        if the_varname in glob_fields_to_interp:
-            pass #TODO, maybe do something here, later
-
-        if the_varname == "MG":
-            data[lkfr > 0] = 1
-        if the_varname == "VF" and current_ip1 == thirdLevelIp1:
-            data[:,:] = 0
-            pass
-
-        outRpnObj.write_2D_field(name = info["varname"].value,
-            data = data, ip = ips,
-            ig = [x.value for x in info["ig"]],
-            npas = info["npas"].value, deet=info["dt_seconds"].value,
-            label="IC,lake infl.exp.(nolakes)", dateo = dateo,
-            grid_type=info["grid_type"].value, typ_var=info["var_type"].value,
-            nbits = nbits, data_type = data_type
-        )
-        i += 1
-
-
-    #check that all fields were copied
-    nRecsIn = inRpnObj.get_number_of_records()
-    assert i == nRecsIn, "copied {0} records, but should be {1}".format(i, nRecsIn)
-
     inRpnObj.close()
-    outRpnObj.close()
+
+    # TODO: maybe interpolate the global fields (SAND, CLAY, DPTH) here, later
+    chain = RecordTransformChain([
+        FillWhere(name="MG", value=1, mask=lkfr > 0),
+        FillWhere(name="VF", value=0, ip1=thirdLevelIp1)
+    ], label="IC,lake infl.exp.(nolakes)")
+    chain.process_file(in_path, out_path)
 
 
 
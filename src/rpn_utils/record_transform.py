@@ -0,0 +1,312 @@
+import os
+import time
+from datetime import datetime, timedelta
+from multiprocessing import Pool
+
+import numpy as np
+from rpn.rpn import RPN
+
+__author__ = 'huziy'
+
+
+# One-pass rewriting of rpn (fst) files: each record is read once, passed through an ordered chain of
+# transforms (selection, date fixes, edits of the fields, appended records) and written once.
+# A transform is a callable transform(record, context) returning the list of records to pass further:
+# an empty list drops the record, several records append new ones.
+# The files are processed in parallel by a pool of worker processes.
+
+# the grid descriptors are always copied
+COORD_RECORD_NAMES = [">>", "^^"]
+
+TMP_SUFFIX = ".tmp"
+
+
+class Record(object):
+    def __init__(self, info=None, data=None):
+        """
+        :param info: dict of the record properties as returned by RPN.get_current_info (varname, ip, ig, npas, ...)
+        :param data: 2d field
+        """
+        self.info = info
+        self.data = data
+
+    @property
+    def name(self):
+        return self.info["varname"].strip().upper()
+
+    def is_coord_record(self):
+        return self.name in COORD_RECORD_NAMES
+
+    def copy_with(self, data=None, **info_updates):
+        """
+        New record with the same properties (except the ones in info_updates) and the data
+        """
+        info = dict(self.info)
+        info["ip"] = list(info["ip"])
+        info.update(info_updates)
+        return Record(info=info, data=self.data if data is None else data)
+
+
+class TransformContext(object):
+    def __init__(self, reader=None, in_path=""):
+        """
+        :param reader: the RPN object of the input file, positioned at the current record
+        """
+        self.reader = reader
+        self.in_path = in_path
+        # state of the transforms for the current file (i.e. the grids for which lat/lon were appended)
+        self.state = {}
+
+
+class SelectRecords(object):
+    def __init__(self, names=None, npas_values=None, exclude_names=None):
+        """
+        Keep the records with the names and the time steps (npas), the grid descriptors are always kept
+        """
+        self.names = None if names is None else set(names)
+        self.npas_values = None if npas_values is None else set(npas_values)
+        self.exclude_names = set() if exclude_names is None else set(exclude_names)
+
+    def __call__(self, record, context):
+        if record.is_coord_record():
+            return [record]
+
+        if self.names is not None and record.name not in self.names:
+            return []
+        if record.name in self.exclude_names:
+            return []
+        if self.npas_values is not None and record.info["npas"] not in self.npas_values:
+            return []
+        return [record]
+
+
+class SetDates(object):
+    def __init__(self, dateo=None, npas=None, deet=None, ip2_old_to_new=None, ip3=None):
+        """
+        Set the date of origin, time step number and time step of all the records,
+        and replace ip2 (setting ip3 if it is not None) for the records with the ip2 in ip2_old_to_new
+        """
+        self.dateo = dateo
+        self.npas = npas
+        self.deet = deet
+        self.ip2_old_to_new = {} if ip2_old_to_new is None else ip2_old_to_new
+        self.ip3 = ip3
+
+    def __call__(self, record, context):
+        updates = {}
+        if self.dateo is not None:
+            updates["dateo"] = self.dateo
+        if self.npas is not None:
+            updates["npas"] = self.npas
+        if self.deet is not None:
+            updates["dt_seconds"] = self.deet
+
+        record = record.copy_with(**updates)
+        ips = record.info["ip"]
+        if ips[1] in self.ip2_old_to_new:
+            ips[1] = self.ip2_old_to_new[ips[1]]
+            if self.ip3 is not None:
+                ips[2] = self.ip3
+        return [record]
+
+
+class CorrectDates(object):
+    def __init__(self, start_date=datetime(1950, 1, 1), leap_year=False):
+        """
+        Correct the dates of origin based on npas, the time step and the start date
+        (see correct_dates.fix_file)
+        """
+        self.start_date = start_date
+        self.leap_year = leap_year
+
+    def __call__(self, record, context):
+        hours_total = int(record.info["npas"] * record.info["dt_seconds"] / 3600)
+        record = record.copy_with()
+
+        if self.leap_year:
+            record.info["ip"][2] = hours_total
+            record.info["dateo"] = self.start_date
+        else:
+            # get the start of the current month
+            year = self.start_date.year + hours_total // (365 * 24)
+            d_temp = datetime(2001, 1, 1) + timedelta(days=hours_total % (365 * 24), hours=hours_total % 24)
+            record.info["dateo"] = datetime(year, d_temp.month, d_temp.day, d_temp.hour)
+        return [record]
+
+
+class EditField(object):
+    def __init__(self, name="", func=None, ip1=None):
+        """
+        :param func: function of the field returning the new field (i.e. lambda f: f + 273.15)
+        :param ip1: only the records with the ip1 are edited if not None
+        """
+        self.name = name
+        self.func = func
+        self.ip1 = ip1
+
+    def _is_target(self, record):
+        return record.name == self.name and (self.ip1 is None or record.info["ip"][0] == self.ip1)
+
+    def __call__(self, record, context):
+        if not self._is_target(record):
+            return [record]
+        return [record.copy_with(data=self.func(np.array(record.data)))]
+
+
+class FillWhere(EditField):
+    def __init__(self, name="", value=0, mask=None, ip1=None):
+        """
+        Set the field to the value where the mask is True (everywhere if the mask is None)
+        """
+        super(FillWhere, self).__init__(name=name, func=self._fill, ip1=ip1)
+        self.value = value
+        self.mask = mask
+
+    def _fill(self, data):
+        if self.mask is None:
+            data[...] = self.value
+        else:
+            data[self.mask] = self.value
+        return data
+
+
+class AppendLatLon(object):
+    def __init__(self, lon_name="LON", lat_name="LAT", skip_names=("HY", )):
+        """
+        Append the longitude and latitude records after the first record on each grid
+        """
+        self.lon_name = lon_name
+        self.lat_name = lat_name
+        self.skip_names = set(skip_names) | set(COORD_RECORD_NAMES) | {lon_name, lat_name}
+
+    def __call__(self, record, context):
+        if record.name in self.skip_names:
+            return [record]
+
+        done_grids = context.state.setdefault("latlon_grids", set())
+        grid_key = tuple(record.info["ig"])
+        if grid_key in done_grids:
+            return [record]
+
+        done_grids.add(grid_key)
+        lons, lats = context.reader.get_longitudes_and_latitudes_for_the_last_read_rec()
+        return [record,
+                record.copy_with(data=lons, varname=self.lon_name),
+                record.copy_with(data=lats, varname=self.lat_name)]
+
+
+def _write_record(r_out, record):
+    info = record.info
+    nbits = info["nbits"]
+    if nbits > 0:
+        nbits = -nbits
+
+    r_out.write_2D_field(name=info["varname"],
+                         data=record.data, ip=info["ip"],
+                         ig=info["ig"],
+                         npas=info["npas"], deet=info["dt_seconds"],
+                         label=info["label"], dateo=info["dateo"],
+                         grid_type=info["grid_type"], typ_var=info["var_type"],
+                         nbits=nbits, data_type=info["data_type"])
+
+
+class RecordTransformChain(object):
+    def __init__(self, transforms, label=None):
+        """
+        :param transforms: ordered list of the transforms
+        :param label: if not None, the label (etiket) of all the written records,
+            it is required if the reader does not give the labels of the records (no "label" in get_current_info),
+            so that the labels are not silently wiped
+        """
+        self.transforms = list(transforms)
+        self.label = label
+
+    def apply(self, record, context):
+        records = [record]
+        for transform in self.transforms:
+            records = [out for r in records for out in transform(r, context)]
+            if not records:
+                break
+        return records
+
+    def process_file(self, in_path, out_path=None):
+        """
+        :param out_path: if None, the input file is replaced
+        :return: in_path, number of the records read, number of the records written
+        """
+        final_path = in_path if out_path is None else out_path
+        tmp_path = final_path + TMP_SUFFIX
+
+        r_in = RPN(in_path)
+        r_out = RPN(tmp_path, mode="w")
+        context = TransformContext(reader=r_in, in_path=in_path)
+
+        n_in, n_out = 0, 0
+        try:
+            while True:
+                data = r_in.get_next_record()
+                if data is None:
+                    break
+                n_in += 1
+
+                info = dict(r_in.get_current_info())
+                info["ip"] = list(info["ip"])
+                info["ig"] = list(info["ig"])
+                if self.label is not None:
+                    info["label"] = self.label
+                elif "label" not in info:
+                    raise ValueError("The labels of the records in {} are not known, "
+                                     "please specify the label of the chain".format(in_path))
+
+                for record in self.apply(Record(info=info, data=data), context):
+                    _write_record(r_out, record)
+                    n_out += 1
+
+            # check that all the records were read
+            nrecs_in = r_in.get_number_of_records()
+            assert n_in == nrecs_in, "read {0} records, but should be {1}".format(n_in, nrecs_in)
+        except Exception:
+            r_in.close()
+            r_out.close()
+            os.remove(tmp_path)
+            raise
+
+        r_in.close()
+        r_out.close()
+        os.rename(tmp_path, final_path)
+        return in_path, n_in, n_out
+
+
+def _process_file_in_worker(args):
+    chain, in_path, out_path = args
+    try:
+        return chain.process_file(in_path, out_path)
+    except Exception as e:
+        print("Error while processing {}: {}".format(in_path, e))
+        return in_path, None, None
+
+
+def process_files(chain, in_out_paths, processes=None):
+    """
+    :param in_out_paths: list of (input path, output path or None to replace the input)
+    :param processes: number of the worker processes (the number of cpus if None), no pool if 1
+    :return: list of (in_path, records read, records written), None for the files that failed
+    """
+    t0 = time.perf_counter()
+    tasks = [(chain, in_path, out_path) for in_path, out_path in in_out_paths]
+
+    if processes == 1:
+        results = [_process_file_in_worker(t) for t in tasks]
+    else:
+        pool = Pool(processes=processes)
+        try:
+            results = list(pool.imap_unordered(_process_file_in_worker, tasks))
+        finally:
+            pool.close()
+            pool.join()
+
+    elapsed = time.perf_counter() - t0
+    n_read = sum(r[1] for r in results if r[1] is not None)
+    print("{} files, {} records read in {:.1f} s ({:.0f} records/s)".format(
+        len(results), n_read, elapsed, n_read / max(elapsed, 1e-9)))
+    return results
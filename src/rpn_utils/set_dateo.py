@@ -1,9 +1,13 @@
 import os
-from rpn.rpn import RPN
+from rpn_utils.record_transform import RecordTransformChain, SetDates, EditField
 
 __author__ = 'huziy'
 
 
+def _to_kelvins(field):
+    return field + 273.15
+
+
 def main():
     dateo = "19580101000000"
     npas = 552240
@@ -15,50 +19,13 @@ def main():
 
     folder = "/home/huziy/skynet3_rech1/init_cond_for_lake_infl_exp"
 
-    rObjIn = RPN(os.path.join(folder, in_file))
-
-    rObjOut = RPN(os.path.join(folder, out_file), mode="w")
-
-    data = []
-    i = 0
-    while data is not None:
-        data = rObjIn.get_next_record()
-        if data is None:
-            break
-        info = rObjIn.get_current_info()
-
-        nbits = info["nbits"].value
-        data_type = info["data_type"].value
-
-        if nbits > 0:
-            nbits = -nbits
-
-        print("nbits = {0}, data_type = {1}".format(nbits, data_type))
-
-        ips = info["ip"]
-        if ips[1] == ip2old:
-            ips[1] = ip2
-            ips[2] = 0  # since ip3 is 0 there
-
+    chain = RecordTransformChain([
+        SetDates(dateo=dateo, npas=npas, deet=deet, ip2_old_to_new={ip2old: ip2}, ip3=0),  # since ip3 is 0 there
         # convert soil temperature to Kelvins
-        if info["varname"].value.strip() == "I0":
-            data += 273.15
-
-        rObjOut.write_2D_field(name=info["varname"],
-                               data=data, ip=ips,
-                               ig=info["ig"],
-                               npas=npas, deet=deet, label="IC, lake infl. exp.", dateo=dateo,
-                               grid_type=info["grid_type"], typ_var=info["var_type"],
-                               nbits=nbits, data_type=data_type)
-        i += 1
-
-
-    # check that all fields were copied
-    nRecsIn = rObjIn.get_number_of_records()
-    assert i == nRecsIn, "copied {0} records, but should be {1}".format(i, nRecsIn)
+        EditField(name="I0", func=_to_kelvins)
+    ], label="IC, lake infl. exp.")
 
-    rObjIn.close()
-    rObjOut.close()
+    chain.process_file(os.path.join(folder, in_file), os.path.join(folder, out_file))
 
 
 if __name__ == "__main__":
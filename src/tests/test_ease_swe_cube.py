@@ -0,0 +1,60 @@
+__author__ = 'huziy'
+
+import os
+import tempfile
+
+import numpy as np
+
+from data.ease_swe_manager import SweCube, get_default_cube_path, _get_array_from_file
+
+
+def _write_files(data_folder, numdays_folder, year, month, random_state, shape=(6, 6)):
+    fn = "NL{}{:02d}.v01.NSIDC8".format(year, month)
+    random_state.randint(-5, 300, size=shape).astype("<i2").tofile(os.path.join(data_folder, fn))
+    random_state.randint(-1, 31, size=shape).astype("<i2").tofile(os.path.join(numdays_folder, fn + ".num"))
+    return fn
+
+
+def _get_weighted_mean_masked(data_folder, numdays_folder, fnames):
+    """
+    The formula used before the cube
+    """
+    fields = np.ma.array([_get_array_from_file(os.path.join(data_folder, fn), mask_negative=True) for fn in fnames])
+    weights = np.ma.asarray([_get_array_from_file(os.path.join(numdays_folder, fn + ".num"), mask_negative=True)
+                             for fn in fnames]).astype(float)
+    weights /= weights.sum(axis=0)[np.newaxis, :, :]
+    return np.ma.sum(fields * weights, axis=0)
+
+
+def test_swe_cube():
+    folder = tempfile.mkdtemp()
+    data_folder, numdays_folder = os.path.join(folder, "all"), os.path.join(folder, "numdays")
+    os.makedirs(data_folder)
+    os.makedirs(numdays_folder)
+
+    random_state = np.random.RandomState(2)
+    fnames = [_write_files(data_folder, numdays_folder, y, m, random_state) for y in [1980, 1981] for m in [1, 2, 12]]
+
+    cube_path = os.path.join(folder, "cube.hdf")
+    cube = SweCube(data_folder=data_folder, numdays_folder=numdays_folder, cube_path=cube_path, block_size=2)
+
+    indices = cube.get_time_indices(start_year=1980, end_year=1981, months=[12, 1])
+    assert list(zip(cube.years[indices], cube.months[indices])) == [(1980, 1), (1980, 12), (1981, 1), (1981, 12)]
+
+    expected = _get_weighted_mean_masked(data_folder, numdays_folder, [fnames[i] for i in indices])
+    result = cube.get_weighted_mean(indices)
+    assert np.array_equal(np.ma.getmaskarray(result), np.ma.getmaskarray(expected))
+    assert np.ma.allclose(result, expected)
+
+    # modifying a source file triggers a rebuild
+    mtime = os.path.getmtime(cube_path)
+    path = os.path.join(data_folder, fnames[0])
+    np.full((6, 6), 7, dtype="<i2").tofile(path)
+    os.utime(path, (mtime + 10, mtime + 10))
+
+    cube = SweCube(data_folder=data_folder, numdays_folder=numdays_folder, cube_path=cube_path)
+    _, _, fields = cube.get_fields_for_date_range()
+    assert np.all(fields[0] == 7)
+
+    # the default cube files of different folders are different
+    assert get_default_cube_path(data_folder, numdays_folder) != get_default_cube_path(numdays_folder, data_folder)
@@ -0,0 +1,36 @@
+__author__ = 'huziy'
+
+import numpy as np
+
+from crcm5.analyse_hdf.event_statistics import EventStatisticsAccumulator, get_events
+
+
+def test_get_events():
+    condition = np.array([0, 1, 1, 0, 1, 1, 1, 0, 1], dtype=bool).reshape((-1, 1, 1))
+    cell, start, end, acc = get_events(condition, covariables=[np.ones(condition.shape)], skip_first_steps=1)
+
+    assert list(start) == [1, 4, 8]
+    assert list(end) == [3, 7, 9]
+    assert list(acc[0]) == [1, 2, 0]
+
+
+def test_chunked_update_is_the_same_as_single():
+    np.random.seed(10)
+    nt = 200
+    condition = np.random.rand(nt, 3, 4) > 0.3
+    runoff = np.random.rand(nt, 3, 4)
+
+    single = EventStatisticsAccumulator((3, 4), n_covariables=1, skip_first_steps=2)
+    single.update(condition, covariables=[runoff])
+    single.close_open_events()
+
+    chunked = EventStatisticsAccumulator((3, 4), n_covariables=1, skip_first_steps=2)
+    for t0 in range(0, nt, 7):
+        chunked.update(condition[t0:t0 + 7], covariables=[runoff[t0:t0 + 7]])
+    chunked.close_open_events()
+
+    assert np.all(single.get_max_durations() == chunked.get_max_durations())
+    assert np.all(single.get_event_counts() == chunked.get_event_counts())
+    assert np.allclose(single.get_acc_for_longest_events(), chunked.get_acc_for_longest_events())
+    assert np.allclose(single.get_acc_total(), chunked.get_acc_total())
+    assert np.all(single.duration_histogram == chunked.duration_histogram)
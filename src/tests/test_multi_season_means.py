@@ -0,0 +1,46 @@
+from collections import OrderedDict
+
+import numpy as np
+
+from crcm5.analyse_hdf.multi_season_means import MultiSeasonMeans, get_season_start_month
+
+__author__ = 'huziy'
+
+
+def _get_rows(start_year, end_year, shape=(2, 3)):
+    years, months = np.meshgrid(np.arange(start_year, end_year + 1), np.arange(1, 13), indexing="ij")
+    n = years.size
+    rows = np.zeros(n, dtype=[("year", int), ("month", int), ("level_index", int), ("field", float, shape)])
+    rows["year"] = years.flatten()
+    rows["month"] = months.flatten()
+    rows["field"] = np.random.rand(n, *shape)
+    return rows
+
+
+def test_season_start_month():
+    assert get_season_start_month([12, 1, 2]) == 12
+    assert get_season_start_month([11, 12, 1]) == 11
+    assert get_season_start_month([3, 4, 5]) == 3
+    assert get_season_start_month(range(1, 13)) == 1
+
+
+def test_multi_season_means():
+    rows = _get_rows(1979, 1985)
+    seasons = OrderedDict([("DJF", [12, 1, 2]), ("JJA", [6, 7, 8])])
+
+    msm = MultiSeasonMeans(seasons, 1980, 1984, [0], rows["field"].shape[1:])
+    # the order of the rows and the chunks do not matter
+    order = np.random.permutation(len(rows))
+    msm.update(rows[order[:30]])
+    msm.update(rows[order[30:]])
+
+    years, djf = msm.get_means("DJF")
+    assert list(years) == [1980, 1981, 1982, 1983]
+    for i, y in enumerate(years):
+        sel = ((rows["year"] == y) & (rows["month"] == 12)) | ((rows["year"] == y + 1) & (rows["month"] <= 2))
+        assert np.allclose(djf[i], rows["field"][sel].mean(axis=0))
+
+    years, jja = msm.get_means("JJA", level_index=0)
+    assert list(years) == list(range(1980, 1985))
+    sel = (rows["year"] == 1984) & np.isin(rows["month"], [6, 7, 8])
+    assert np.allclose(jja[-1], rows["field"][sel].mean(axis=0))
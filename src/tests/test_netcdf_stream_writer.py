@@ -0,0 +1,34 @@
+import os
+import tempfile
+from datetime import datetime, timedelta
+
+import numpy as np
+from netCDF4 import Dataset, num2date
+
+from crcm5.netcdf_stream_writer import StreamingNetcdfWriter, DailyMeanAggregator
+
+__author__ = 'huziy'
+
+
+def test_daily_means_are_streamed_to_netcdf():
+    lons2d, lats2d = np.meshgrid(np.arange(5.0), np.arange(4.0), indexing="ij")
+    start = datetime(1990, 1, 1)
+    dates = [start + timedelta(hours=6 * i) for i in range(4 * 10)]
+    fields = np.random.rand(len(dates), 2, 5, 4)
+
+    path = os.path.join(tempfile.mkdtemp(), "test.nc")
+    with StreamingNetcdfWriter(path=path, var_name="TT", lons2d=lons2d, lats2d=lats2d, levels=[1, 2],
+                               start_date=start, chunk_time_steps=3, complevel=2) as writer:
+        aggregator = DailyMeanAggregator(writer.append)
+        for d, f in zip(dates, fields):
+            aggregator.add(d, f)
+        aggregator.flush()
+
+    with Dataset(path) as ds:
+        data = ds.variables["TT"][:]
+        time_var = ds.variables["time"]
+        days = num2date(time_var[:], time_var.units)
+
+    assert data.shape == (10, 2, 5, 4)
+    assert np.allclose(data, fields.reshape((10, 4, 2, 5, 4)).mean(axis=1), rtol=1e-6)
+    assert [(d.month, d.day) for d in days] == [(1, i) for i in range(1, 11)]
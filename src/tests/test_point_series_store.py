@@ -0,0 +1,28 @@
+__author__ = 'huziy'
+
+import numpy as np
+
+from crcm5.point_series_store import get_downstream_indices, get_upstream_table
+
+
+def test_upstream_table_is_the_same_as_following_the_rivers():
+    np.random.seed(3)
+    nx, ny = 7, 6
+    flow_directions = np.random.choice([1, 2, 128, -1], size=(nx, ny))
+
+    downstream = get_downstream_indices(flow_directions)
+    indptr, indices = get_upstream_table(downstream)
+
+    for c in range(nx * ny):
+        # the cells whose path downstream passes through c
+        expected = set()
+        for start in range(nx * ny):
+            current = start
+            while current >= 0:
+                if current == c:
+                    expected.add(start)
+                    break
+                current = downstream[current]
+
+        assert set(indices[indptr[c]:indptr[c + 1]]) == expected
+        assert indptr[c + 1] - indptr[c] == len(expected)
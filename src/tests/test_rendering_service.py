@@ -0,0 +1,56 @@
+import os
+import tempfile
+
+import numpy as np
+
+from util.rendering_service import ProjectionCache, RenderTask, render
+
+__author__ = 'huziy'
+
+
+class _Projection(object):
+    n_created = 0
+
+    def __init__(self, lons2d=None, lats2d=None, scale=1.0):
+        _Projection.n_created += 1
+        self.scale = scale
+
+    def __call__(self, lons, lats):
+        return lons * self.scale, lats * self.scale
+
+
+def _plot(value=0):
+    import matplotlib.pyplot as plt
+    fig = plt.figure()
+    plt.plot([0, value])
+    return fig
+
+
+def test_projection_cache():
+    folder = tempfile.mkdtemp()
+    lons2d, lats2d = np.meshgrid(np.arange(3.0), np.arange(4.0))
+
+    _, x, y = ProjectionCache(folder).get(lons2d, lats2d, _Projection, scale=2.0)
+    assert np.allclose(x, 2 * lons2d)
+
+    # the second instance loads the projection from disk
+    n_created = _Projection.n_created
+    proj, x, y = ProjectionCache(folder).get(lons2d, lats2d, _Projection, scale=2.0)
+    assert _Projection.n_created == n_created and proj.scale == 2.0
+
+    # another grid definition
+    ProjectionCache(folder).get(lons2d, lats2d, _Projection, scale=3.0)
+    assert _Projection.n_created == n_created + 1
+
+
+def test_render_in_parallel():
+    folder = tempfile.mkdtemp()
+    tasks = [RenderTask(_plot, kwargs=dict(value=i), out_path=os.path.join(folder, "{}.png".format(i)))
+             for i in range(3)]
+    tasks.append(RenderTask(_plot, kwargs=dict(value="a", unknown=1), label="failing"))
+
+    results = render(tasks, processes=2)
+
+    assert all(os.path.isfile(t.out_path) for t in tasks[:3])
+    assert [r[0] for r in results] == [t.label for t in tasks]
+    assert results[-1][2] is not None and all(r[2] is None for r in results[:3])
@@ -0,0 +1,91 @@
+__author__ = 'huziy'
+
+import os
+import pickle
+import tempfile
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from crcm5 import rpn_record_catalog
+from crcm5.rpn_record_catalog import RecordCatalog, get_year_month_selector
+
+
+class FakeRPN(object):
+    """
+    Reader of the pickled {date: field} files, keeping the log of the opened files and the decoded records
+    """
+    opened = []
+    decoded = []
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            self.date_to_field = pickle.load(f)
+        FakeRPN.opened.append(os.path.basename(path))
+
+    def suppress_log_messages(self):
+        pass
+
+    def get_all_time_records_for_name_and_level(self, varname="", level=-1, level_kind=-1):
+        FakeRPN.decoded.extend((os.path.basename(self.path), d) for d in self.date_to_field)
+        return dict(self.date_to_field)
+
+    def get_dateo_of_last_read_record(self):
+        return datetime(2001, 1, 1)
+
+    def get_record_for_date_and_level(self, var_name="", date=None, date_o=None, level=-1, level_kind=-1):
+        FakeRPN.decoded.append((os.path.basename(self.path), date))
+        return self.date_to_field[date]
+
+    def close(self):
+        pass
+
+
+def _write_file(folder, file_name, start_date, ndays, offset=0.0):
+    date_to_field = {start_date + timedelta(days=i): np.full((2, 3), i + offset) for i in range(ndays)}
+    with open(os.path.join(folder, file_name), "wb") as f:
+        pickle.dump(date_to_field, f)
+
+
+def _read_and_reset(folder, months):
+    FakeRPN.opened[:], FakeRPN.decoded[:] = [], []
+    catalog = RecordCatalog(folder=folder, file_name_prefix="pm")
+    return list(catalog.iter_fields("STFL", level=-1, date_selector=get_year_month_selector(months=months)))
+
+
+def test_record_catalog(monkeypatch):
+    monkeypatch.setattr(rpn_record_catalog, "RPN", FakeRPN, raising=False)
+
+    folder = tempfile.mkdtemp()
+    _write_file(folder, "pm_01", datetime(2001, 1, 30), 4)
+    _write_file(folder, "pm_07", datetime(2001, 7, 1), 3)
+
+    # the first time all the records are scanned
+    fields = _read_and_reset(folder, [1])
+    assert [d.day for d, _ in fields] == [30, 31]
+    assert FakeRPN.opened == ["pm_01", "pm_07"] and len(FakeRPN.decoded) == 7
+
+    # afterwards (a new catalog loaded from the folder) only the selected dates are decoded,
+    # and the files without the selected dates are not opened
+    fields = _read_and_reset(folder, [1])
+    assert [d.day for d, _ in fields] == [30, 31] and fields[1][1][0, 0] == 1
+    assert FakeRPN.opened == ["pm_01"]
+    assert FakeRPN.decoded == [("pm_01", datetime(2001, 1, 30)), ("pm_01", datetime(2001, 1, 31))]
+
+    assert _read_and_reset(folder, [12]) == [] and FakeRPN.opened == []
+
+    # a modified file (same size, new modification time) is scanned again
+    path = os.path.join(folder, "pm_07")
+    size, mtime = os.path.getsize(path), os.path.getmtime(path)
+    _write_file(folder, "pm_07", datetime(2001, 7, 2), 3, offset=10)
+    os.utime(path, (mtime + 10, mtime + 10))
+    assert os.path.getsize(path) == size
+
+    fields = _read_and_reset(folder, [7])
+    assert [(d.day, f[0, 0]) for d, f in fields] == [(2, 10), (3, 11), (4, 12)]
+    assert FakeRPN.opened == ["pm_07"] and len(FakeRPN.decoded) == 3
+
+    # and a grown file too
+    _write_file(folder, "pm_07", datetime(2001, 7, 1), 5)
+    assert len(_read_and_reset(folder, [7])) == 5
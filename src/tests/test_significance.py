@@ -0,0 +1,47 @@
+import numpy as np
+from scipy import stats
+
+from util.significance import calculate_t_tests, calculate_mann_whitney_u, calculate_permutation_test, \
+    get_fdr_significance_mask
+
+__author__ = 'huziy'
+
+
+def _get_samples(n1=20, n2=15, shape=(6, 7)):
+    random_state = np.random.RandomState(5)
+    return random_state.normal(size=(n1, ) + shape), random_state.normal(0.5, 2, size=(n2, ) + shape)
+
+
+def test_t_tests():
+    a, b = _get_samples(n2=20)
+    result = calculate_t_tests(a, b)
+
+    assert np.allclose(result["student"][1], stats.ttest_ind(a, b, axis=0).pvalue)
+    assert np.allclose(result["welch"][1], stats.ttest_ind(a, b, axis=0, equal_var=False).pvalue)
+    assert np.allclose(result["paired"][1], stats.ttest_rel(a, b, axis=0).pvalue)
+
+
+def test_mann_whitney_u():
+    a, b = _get_samples()
+    a, b = np.round(a), np.round(b)  # with ties
+    u, p = calculate_mann_whitney_u(a, b)
+    expected = stats.mannwhitneyu(a, b, axis=0, method="asymptotic")
+    assert np.allclose(u, expected.statistic)
+    assert np.allclose(p, expected.pvalue)
+
+
+def test_permutation_test_does_not_depend_on_workers():
+    a, b = _get_samples()
+    b[:, 0, 0] = np.nan
+    diff, p1 = calculate_permutation_test(a, b, n_permutations=250, chunk_size=40, seed=1)
+    _, p2 = calculate_permutation_test(a, b, n_permutations=250, chunk_size=40, seed=1, n_workers=2)
+
+    assert np.array_equal(p1, p2, equal_nan=True)
+    assert np.isnan(p1[0, 0]) and np.all((p1[1:] > 0) & (p1[1:] <= 1))
+    assert np.allclose(diff[1:], a.mean(axis=0)[1:] - b.mean(axis=0)[1:])
+
+
+def test_fdr_significance_mask():
+    p = np.array([0.001, 0.008, 0.039, 0.041, 0.042, 0.06, 0.074, 0.205, np.nan])
+    mask = get_fdr_significance_mask(p, alpha=0.05)
+    assert list(mask) == [True, True] + [False] * 7
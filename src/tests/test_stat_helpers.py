@@ -0,0 +1,33 @@
+import numpy as np
+
+from util.stat_helpers import StreamingCorrelation
+
+__author__ = 'huziy'
+
+
+def test_streaming_correlation():
+    random_state = np.random.RandomState(3)
+    nt, shape = 100, (4, 5)
+    data1 = random_state.normal(size=(nt, ) + shape)
+    data2 = 0.5 * data1 + random_state.normal(size=(nt, ) + shape)
+
+    # NaNs are excluded pairwise
+    data2[3, 0, 0] = np.nan
+
+    sc = StreamingCorrelation(shape)
+    for start in range(0, nt, 17):
+        sc.update(data1[start:start + 17], data2[start:start + 17])
+
+    corr = sc.get_correlation()
+    cov = sc.get_covariance(ddof=1)
+    for i in range(shape[0]):
+        for j in range(shape[1]):
+            valid = np.isfinite(data2[:, i, j])
+            x, y = data1[valid, i, j], data2[valid, i, j]
+            assert np.allclose(corr[i, j], np.corrcoef(x, y)[0, 1])
+            assert np.allclose(cov[i, j], np.cov(x, y)[0, 1])
+
+    # no variance
+    sc = StreamingCorrelation(shape)
+    sc.update(np.ones((10, ) + shape), data2[:10])
+    assert np.all(np.ma.getmaskarray(sc.get_correlation()))
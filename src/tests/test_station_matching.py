@@ -0,0 +1,23 @@
+import numpy as np
+from scipy.spatial import cKDTree
+
+from crcm5.station_matching import match_stations_to_grid
+from util.geo import lat_lon
+
+__author__ = 'huziy'
+
+
+def test_match_stations_to_grid():
+    lons2d, lats2d = np.meshgrid(np.arange(-80, -70, 0.5), np.arange(45, 50, 0.5), indexing="ij")
+    acc_area = np.full(lons2d.shape, 100.0)
+    acc_area[4, 3] = 1000.0
+
+    kdtree = cKDTree(np.column_stack(lat_lon.lon_lat_to_cartesian(lons2d.flatten(), lats2d.flatten())))
+
+    # the first station prefers the cell with the closer drainage area, the second has no suitable cell
+    lons, lats, drainage = [lons2d[4, 4] + 0.1, lons2d[10, 5]], [lats2d[4, 4], lats2d[10, 5]], [950.0, 10.0]
+    matches = match_stations_to_grid(kdtree, acc_area, lons, lats, drainage, nneighbours=9)
+
+    assert (matches.ix[0], matches.jy[0]) == (4, 3)
+    assert np.isclose(matches.da_diff[0], 50.0 / 950.0)
+    assert matches.ix[1] == matches.jy[1] == -1
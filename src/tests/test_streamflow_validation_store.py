@@ -0,0 +1,45 @@
+__author__ = 'huziy'
+
+import tempfile
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from crcm5.model_point import ModelPoint
+from crcm5.streamflow_validation_store import StreamflowValidationStore, build_station_validation, \
+    calculate_skill_scores
+
+
+def test_skill_scores():
+    obs = np.array([1.0, 2.0, 3.0, 4.0])
+
+    scores = calculate_skill_scores(obs, obs)
+    assert scores["ns"] == 1.0 and abs(scores["corr"] - 1) < 1e-12 and scores["bias"] == 0
+
+    scores = calculate_skill_scores(obs, obs + 1)
+    assert scores["bias"] == 1.0 and scores["ns"] < 1
+
+
+def test_validation_is_reused_only_for_the_same_signature():
+    dates = [datetime(2000, 12, 31) + timedelta(hours=12 * i) for i in range(2 * 366 * 2)]
+    mod = np.arange(len(dates), dtype=float)
+    obs_dates = [datetime(2001, 1, 1) + timedelta(days=i) for i in range(365)]
+    obs = np.arange(len(obs_dates)) % 7.0
+
+    mp = ModelPoint(ix=1, jy=2)
+    mask = np.zeros((4, 5))
+    mask[1, 2] = mask[0, 2] = 1
+
+    v = build_station_validation("run", "st", mp, mask, obs_dates, obs, dates, mod, years=[2001])
+
+    # daily means of the model over 2001, the 29th of February excluded
+    assert len(v.dates) == 365 and len(v.clim_dates) == 365
+    assert v.mod[0] == 2.5
+    assert np.all(v.upstream_mask == mask)
+
+    store = StreamflowValidationStore(folder=tempfile.mkdtemp())
+    store.save("run", "st", v, dict(model=1))
+
+    assert store.load("run", "st", dict(model=2)) is None
+    assert store.load("run", "st", dict(model=1)).scores == v.scores
+    assert len(store.get_validations("run")) == 1
@@ -0,0 +1,27 @@
+__author__ = 'huziy'
+
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from data.timeseries import TimeSeries
+
+
+def test_resampling_is_the_same_as_selecting_periods():
+    times = [datetime(2000, 12, 31, 3) + timedelta(hours=3 * i) for i in range(8 * 70)]
+    data = np.random.rand(len(times))
+    ts = TimeSeries(data=data, time=times)
+
+    monthly = ts.get_ts_of_monthly_means()
+    assert monthly.time == [datetime(2000, 12, 1), datetime(2001, 1, 1), datetime(2001, 2, 1), datetime(2001, 3, 1)]
+    sel = np.array([t.year == 2001 and t.month == 1 for t in times])
+    assert np.isclose(monthly.data[1], data[sel].mean())
+
+    daily_max = ts.resample(freq="D", how="max")
+    day = datetime(2001, 1, 13)
+    sel = np.array([t.date() == day.date() for t in times])
+    assert daily_max.data[daily_max.time.index(day)] == data[sel].max()
+
+    sliced = ts.time_slice(times[10], times[20])
+    assert sliced.time == times[10:21] and np.all(sliced.data == data[10:21])
+    assert np.all(ts.get_data_for_dates([times[7], times[2]]) == data[[7, 2]])
@@ -0,0 +1,154 @@
+import hashlib
+import os
+import pickle
+import time
+import traceback
+from multiprocessing import Pool
+
+import numpy as np
+
+__author__ = 'huziy'
+
+
+# Rendering of figure batches:
+#   - ProjectionCache: the projection objects (i.e. Basemap, with the coastlines and boundaries already
+#     processed for the domain) and the projected coordinates of the grid are saved on disk,
+#     keyed by the grid (longitudes and latitudes) and the parameters of the projection,
+#   - render: independent figures are plotted in parallel worker processes with the Agg backend,
+#     the time spent on each figure is reported.
+
+DEFAULT_CACHE_FOLDER = "projection_cache"
+TMP_SUFFIX = ".tmp"
+
+
+class ProjectionCache(object):
+    def __init__(self, folder=DEFAULT_CACHE_FOLDER):
+        self.folder = folder
+        self._key_to_entry = {}
+
+    @staticmethod
+    def get_key(lons2d, lats2d, factory, **params):
+        """
+        :return: hash of the grid, of the function creating the projection and its parameters
+        """
+        h = hashlib.sha1()
+        for arr in [lons2d, lats2d]:
+            arr = np.ascontiguousarray(arr, dtype=np.float64)
+            h.update(str(arr.shape).encode())
+            h.update(arr.tobytes())
+        h.update("{}.{}".format(getattr(factory, "__module__", ""), getattr(factory, "__qualname__", factory)).encode())
+        h.update(repr(sorted(params.items())).encode())
+        return h.hexdigest()
+
+    def get(self, lons2d, lats2d, factory, **params):
+        """
+        :param factory: function(lons2d=..., lats2d=..., **params) creating the projection (i.e. Basemap)
+        :return: projection, x, y - the projection and the projected coordinates of the grid
+        """
+        key = self.get_key(lons2d, lats2d, factory, **params)
+        if key in self._key_to_entry:
+            return self._key_to_entry[key]
+
+        path = os.path.join(self.folder, "{}.bin".format(key))
+        entry = None
+        if os.path.isfile(path):
+            try:
+                with open(path, "rb") as f:
+                    entry = pickle.load(f)
+            except Exception as e:
+                print("Could not load the cached projection {}: {}".format(path, e))
+
+        if entry is None:
+            projection = factory(lons2d=lons2d, lats2d=lats2d, **params)
+            x, y = projection(lons2d, lats2d)
+            entry = (projection, x, y)
+            self._save(path, entry)
+
+        self._key_to_entry[key] = entry
+        return entry
+
+    def _save(self, path, entry):
+        try:
+            if not os.path.isdir(self.folder):
+                os.makedirs(self.folder)
+            with open(path + TMP_SUFFIX, "wb") as f:
+                pickle.dump(entry, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.rename(path + TMP_SUFFIX, path)
+        except Exception as e:
+            print("Could not cache the projection to {}: {}".format(path, e))
+
+
+_cache_folder_to_instance = {}
+
+
+def get_projection_cache(folder=DEFAULT_CACHE_FOLDER):
+    """
+    The cache instance shared within the process (the projections are loaded only once per process)
+    """
+    if folder not in _cache_folder_to_instance:
+        _cache_folder_to_instance[folder] = ProjectionCache(folder=folder)
+    return _cache_folder_to_instance[folder]
+
+
+class RenderTask(object):
+    def __init__(self, plot_func, kwargs=None, out_path=None, label=None, savefig_kwargs=None):
+        """
+        :param plot_func: module level function plot_func(**kwargs), it either saves its figures itself or returns
+            the figure, which is then saved to out_path
+        :param label: name of the task in the timing report (out_path or the function name by default)
+        """
+        self.plot_func = plot_func
+        self.kwargs = {} if kwargs is None else kwargs
+        self.out_path = out_path
+        self.savefig_kwargs = {} if savefig_kwargs is None else savefig_kwargs
+        if label is None:
+            label = out_path if out_path is not None else plot_func.__name__
+        self.label = label
+
+
+def _init_worker():
+    import matplotlib.pyplot as plt
+    plt.switch_backend("Agg")
+
+
+def _run_task(task):
+    """
+    :return: label, time spent in seconds, error message (None if there was no error)
+    """
+    import matplotlib.pyplot as plt
+
+    t0 = time.perf_counter()
+    try:
+        fig = task.plot_func(**task.kwargs)
+        if task.out_path is not None and fig is not None:
+            fig.savefig(task.out_path, **task.savefig_kwargs)
+            plt.close(fig)
+        error = None
+    except Exception:
+        error = traceback.format_exc()
+    return task.label, time.perf_counter() - t0, error
+
+
+def render(tasks, processes=None):
+    """
+    Run the independent rendering tasks in a pool of processes
+    :param processes: number of processes (the number of cpus if None), the tasks are run in the current process if 1
+    :return: list of (label, seconds, error message or None) in the order of the tasks
+    """
+    t0 = time.perf_counter()
+    if processes == 1:
+        results = [_run_task(t) for t in tasks]
+    else:
+        pool = Pool(processes=processes, initializer=_init_worker)
+        try:
+            results = pool.map(_run_task, tasks, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+
+    for label, seconds, error in results:
+        print("{}: {:.2f} s{}".format(label, seconds, "" if error is None else ", failed:\n" + error))
+
+    print("Rendered {} figures in {:.2f} s (sum of the figure times {:.2f} s)".format(
+        len(results), time.perf_counter() - t0, sum(r[1] for r in results)))
+    return results
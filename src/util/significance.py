@@ -0,0 +1,211 @@
+from collections import OrderedDict
+from multiprocessing import Pool
+
+import numpy as np
+from scipy import stats
+
+__author__ = 'huziy'
+
+
+# Significance tests for the differences between 2 samples of fields, i.e. yearly means of 2 simulations,
+# given as (year, ...) stacks. The tests are done for all the grid points at once:
+#   - Student, Welch and paired t-tests from the sample moments (calculated once for all the tests),
+#   - Mann-Whitney U test (normal approximation with the tie and continuity corrections),
+#   - permutation test of the difference of means, the permutations are processed in chunks
+#     (memory ~ chunk_size x number of points) and each chunk has its own random stream derived from the seed,
+#     so the result does not depend on the number of workers,
+#   - field significance: Benjamini-Hochberg false discovery rate control over the grid points.
+# Masked values and NaNs: the t-tests use the available values at each point, the rank and permutation tests
+# return NaN p-values at the points with missing values.
+
+T_TESTS = ("student", "welch", "paired")
+
+
+def _as_stack(data):
+    return np.ma.filled(np.ma.asarray(data, dtype=np.float64), np.nan)
+
+
+def _get_moments(data):
+    """
+    :return: number of valid values, mean and unbiased variance along the axis 0
+    """
+    valid = ~np.isnan(data)
+    n = valid.sum(axis=0)
+    n_safe = np.where(n > 0, n, 1)
+
+    mean = np.where(valid, data, 0).sum(axis=0) / n_safe
+    var = (np.where(valid, data - mean, 0) ** 2).sum(axis=0) / np.where(n > 1, n - 1, 1)
+
+    mean[n == 0] = np.nan
+    var[n < 2] = np.nan
+    return n, mean, var
+
+
+def _two_sided_t_pvalue(t, df):
+    return 2 * stats.t.sf(np.abs(t), df)
+
+
+def calculate_t_tests(sample1, sample2, tests=T_TESTS):
+    """
+    :param sample1: (year, ...) array
+    :param sample2: (year, ...) array, for the paired test it should have the same shape as sample1
+    :param tests: names of the tests: student (equal variances), welch (unequal variances), paired
+    :return: OrderedDict {test name: (t, pvalue)}, the t statistics are for sample1 - sample2
+    """
+    unknown = set(tests) - set(T_TESTS)
+    if unknown:
+        raise ValueError("Unknown tests: {}, possible: {}".format(unknown, T_TESTS))
+
+    a, b = _as_stack(sample1), _as_stack(sample2)
+    result = OrderedDict()
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        if "student" in tests or "welch" in tests:
+            n1, m1, v1 = _get_moments(a)
+            n2, m2, v2 = _get_moments(b)
+
+        if "student" in tests:
+            df = n1 + n2 - 2.0
+            pooled_var = ((n1 - 1) * v1 + (n2 - 1) * v2) / df
+            t = (m1 - m2) / np.sqrt(pooled_var * (1.0 / n1 + 1.0 / n2))
+            result["student"] = (t, _two_sided_t_pvalue(t, df))
+
+        if "welch" in tests:
+            se1, se2 = v1 / n1, v2 / n2
+            t = (m1 - m2) / np.sqrt(se1 + se2)
+            df = (se1 + se2) ** 2 / (se1 ** 2 / (n1 - 1) + se2 ** 2 / (n2 - 1))
+            result["welch"] = (t, _two_sided_t_pvalue(t, df))
+
+        if "paired" in tests:
+            if a.shape != b.shape:
+                raise ValueError("The paired test needs samples of the same shape: {} != {}".format(a.shape, b.shape))
+
+            nd, md, vd = _get_moments(a - b)
+            t = md / np.sqrt(vd / nd)
+            result["paired"] = (t, _two_sided_t_pvalue(t, nd - 1.0))
+
+    return result
+
+
+def ttest_ind_fields(sample1, sample2, equal_var=True):
+    """
+    Replacement of scipy.stats.ttest_ind(sample1, sample2, axis=0, equal_var=equal_var)
+    :return: t, pvalue
+    """
+    return calculate_t_tests(sample1, sample2, tests=("student" if equal_var else "welch", )).popitem()[1]
+
+
+def calculate_mann_whitney_u(sample1, sample2):
+    """
+    Two-sided Mann-Whitney U test, as scipy.stats.mannwhitneyu(..., method="asymptotic") at each point
+    :return: U statistic of sample1, pvalue
+    """
+    a, b = _as_stack(sample1), _as_stack(sample2)
+    n1, n2 = a.shape[0], b.shape[0]
+    n = n1 + n2
+
+    pooled = np.concatenate((a, b), axis=0)
+    ranks = stats.rankdata(pooled, axis=0)
+
+    # sum of t^3 - t over the groups of ties, each member of a group of size t contributes t^2 - 1
+    tie_sizes = stats.rankdata(pooled, method="max", axis=0) - stats.rankdata(pooled, method="min", axis=0) + 1
+    ties = (tie_sizes ** 2 - 1).sum(axis=0)
+
+    u = ranks[:n1].sum(axis=0) - n1 * (n1 + 1) / 2.0
+    sigma = np.sqrt(n1 * n2 / 12.0 * ((n + 1) - ties / float(n * (n - 1))))
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        z = (np.abs(u - n1 * n2 / 2.0) - 0.5) / sigma
+        pvalue = np.minimum(2 * stats.norm.sf(z), 1.0)
+
+    missing = np.isnan(pooled).any(axis=0)
+    u[missing] = np.nan
+    pvalue[missing] = np.nan
+    return u, pvalue
+
+
+# the pooled sample of the permutation test in the worker processes
+_pooled = None
+
+
+def _init_worker(pooled):
+    global _pooled
+    _pooled = pooled
+
+
+def _count_exceedances(args):
+    """
+    :return: number of permutations of the chunk for which |mean1 - mean2| >= the observed one at each point
+    """
+    n1, n_perms, seed_seq, observed = args
+
+    n = _pooled.shape[0]
+    random_state = np.random.default_rng(seed_seq)
+    perms = np.argsort(random_state.random((n_perms, n)), axis=1)
+
+    # rows of weights: 1 / n1 for the members of the first sample, -1 / n2 for the others
+    weights = np.full((n_perms, n), -1.0 / (n - n1))
+    np.put_along_axis(weights, perms[:, :n1], 1.0 / n1, axis=1)
+
+    diffs = weights.dot(_pooled)
+    return (np.abs(diffs) >= observed * (1 - 1e-12)).sum(axis=0)
+
+
+def calculate_permutation_test(sample1, sample2, n_permutations=1000, chunk_size=100, seed=0, n_workers=1):
+    """
+    Two-sided permutation test of the difference of means
+    :param chunk_size: number of permutations processed at once
+    :param seed: the same seed (and chunk_size) gives the same p-values whatever the n_workers
+    :param n_workers: number of processes, the chunks are processed in the main process if 1
+    :return: mean(sample1) - mean(sample2), pvalue
+    """
+    a, b = _as_stack(sample1), _as_stack(sample2)
+    n1 = a.shape[0]
+    field_shape = a.shape[1:]
+
+    pooled = np.concatenate((a, b), axis=0).reshape((n1 + b.shape[0], -1))
+    missing = np.isnan(pooled).any(axis=0)
+    pooled[:, missing] = 0
+
+    observed_diff = pooled[:n1].mean(axis=0) - pooled[n1:].mean(axis=0)
+
+    chunk_sizes = [min(chunk_size, n_permutations - i) for i in range(0, n_permutations, chunk_size)]
+    seeds = np.random.SeedSequence(seed).spawn(len(chunk_sizes))
+    tasks = [(n1, s, seed_seq, np.abs(observed_diff)) for s, seed_seq in zip(chunk_sizes, seeds)]
+
+    if n_workers > 1:
+        pool = Pool(processes=n_workers, initializer=_init_worker, initargs=(pooled, ))
+        try:
+            counts = pool.map(_count_exceedances, tasks)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        _init_worker(pooled)
+        counts = [_count_exceedances(t) for t in tasks]
+
+    pvalue = (np.sum(counts, axis=0) + 1.0) / (n_permutations + 1.0)
+
+    observed_diff[missing] = np.nan
+    pvalue[missing] = np.nan
+    return observed_diff.reshape(field_shape), pvalue.reshape(field_shape)
+
+
+def get_fdr_significance_mask(pvalues, alpha=0.1):
+    """
+    Field significance: the points where the null hypothesis is rejected with the false discovery rate
+    controlled at alpha over the field (Benjamini-Hochberg)
+    :param pvalues: field of p-values, the masked and NaN values are not considered
+    :return: boolean array of the shape of pvalues
+    """
+    p = _as_stack(pvalues)
+    valid = ~np.isnan(p)
+
+    p_sorted = np.sort(p[valid])
+    m = len(p_sorted)
+    below = np.where(p_sorted <= alpha * np.arange(1, m + 1) / float(m))[0]
+
+    if not len(below):
+        return np.zeros(p.shape, dtype=bool)
+
+    return valid & (np.where(valid, p, np.inf) <= p_sorted[below[-1]])
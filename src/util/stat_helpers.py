@@ -28,6 +28,73 @@ def calculate_correlation_nd(data1, data2, axis=0):
 
 
 
+class StreamingCorrelation(object):
+    """
+    Accumulates means, variances and covariance of 2 variables for each grid cell,
+    the data are fed in chunks along the time axis (axis 0), the chunk statistics are merged
+    with the accumulated ones as in Chan et al. (Welford's algorithm for batches).
+    NaNs are excluded (pairwise) from the calculations.
+    """
+
+    def __init__(self, field_shape):
+        self.n = np.zeros(field_shape)
+        self.mean1 = np.zeros(field_shape)
+        self.mean2 = np.zeros(field_shape)
+        self.m2_1 = np.zeros(field_shape)
+        self.m2_2 = np.zeros(field_shape)
+        self.comoment = np.zeros(field_shape)
+
+    def update(self, data1, data2):
+        """
+        :param data1: (time, ...) array
+        :param data2: array of the same shape as data1
+        """
+        assert data1.shape == data2.shape
+
+        data1 = np.ma.filled(np.ma.asarray(data1, dtype=np.float64), np.nan)
+        data2 = np.ma.filled(np.ma.asarray(data2, dtype=np.float64), np.nan)
+        valid = np.isfinite(data1) & np.isfinite(data2)
+
+        n_b = valid.sum(axis=0)
+        n_b_safe = np.where(n_b > 0, n_b, 1)
+
+        mean1_b = np.where(valid, data1, 0).sum(axis=0) / n_b_safe
+        mean2_b = np.where(valid, data2, 0).sum(axis=0) / n_b_safe
+
+        dev1 = np.where(valid, data1 - mean1_b, 0)
+        dev2 = np.where(valid, data2 - mean2_b, 0)
+
+        n_a = self.n
+        n = n_a + n_b
+        n_safe = np.where(n > 0, n, 1)
+
+        delta1 = mean1_b - self.mean1
+        delta2 = mean2_b - self.mean2
+
+        self.m2_1 += (dev1 ** 2).sum(axis=0) + delta1 ** 2 * n_a * n_b / n_safe
+        self.m2_2 += (dev2 ** 2).sum(axis=0) + delta2 ** 2 * n_a * n_b / n_safe
+        self.comoment += (dev1 * dev2).sum(axis=0) + delta1 * delta2 * n_a * n_b / n_safe
+
+        self.mean1 += delta1 * n_b / n_safe
+        self.mean2 += delta2 * n_b / n_safe
+        self.n = n
+
+    def get_covariance(self, ddof=0):
+        return np.ma.masked_where(self.n <= ddof, self.comoment) / np.where(self.n > ddof, self.n - ddof, 1)
+
+    def get_variances(self, ddof=0):
+        denom = np.where(self.n > ddof, self.n - ddof, 1)
+        return (np.ma.masked_where(self.n <= ddof, self.m2_1) / denom,
+                np.ma.masked_where(self.n <= ddof, self.m2_2) / denom)
+
+    def get_correlation(self):
+        """
+        :return: masked array of the correlation coefficients, masked where one of the variances is 0
+        """
+        denom = np.sqrt(self.m2_1 * self.m2_2)
+        return np.ma.masked_where(denom <= 0, self.comoment) / np.where(denom > 0, denom, 1)
+
+
 def test():
 
     arr = np.array([[1, 2, 3], [1, 2, 3], [1, 2, 3]])